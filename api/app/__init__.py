@@ -1,4 +1,6 @@
-from flask import Flask, current_app, jsonify, request
+import json
+import time
+from flask import Flask, Response, current_app, g, jsonify, request, stream_with_context
 from dotenv import load_dotenv
 from flask_cors import CORS, cross_origin
 from flask_talisman import Talisman
@@ -8,17 +10,35 @@ load_dotenv()
 
 # Pipeline steps
 from steps import (
-  clean_user_query, 
-  parse_query, 
-  embed_query, 
-  chat_llm, 
-  score_query,
-  pinecone_query,
-  summarize_query,
-  run_query,
-  query_feedback
+  PipelineRegistry,
+  StreamingPipeline,
+  build_default_pipeline,
+  build_single_call_pipeline,
+  DEFAULT_PIPELINE,
+  SINGLE_CALL_PIPELINE,
+  WriteBehindQueue,
+  copy_pending,
+  copy_stats,
+  ResultCache,
+  prompt_version,
+  SemanticCache,
+  ParseAgreement,
+  configure_pinecone,
+  configure_database,
+  configure_embeddings,
+  LocalIndexBackend,
+  EmbeddingCoalescer,
+  EmbeddingCache,
+  ContextAssembler,
+  ModelRoute,
+  ModelRouter,
+  metrics,
+  start_request,
 )
 
+# Per-IP limit of the chat endpoints, on the WSGI and the ASGI app alike
+CHAT_RATE_LIMIT = "10 per minute"
+
 
 # create app factory
 def create_app(config_class=None):
@@ -27,15 +47,187 @@ def create_app(config_class=None):
 
     CORS(app)
 
+    # A negative threshold turns prepared statements off
+    prepare_threshold = app.config.get("DB_PREPARE_THRESHOLD", -1)
+    database = configure_database(
+        pool_size=app.config.get("DB_POOL_SIZE", 5),
+        max_overflow=app.config.get("DB_MAX_OVERFLOW", 10),
+        pool_timeout=app.config.get("DB_POOL_TIMEOUT", 30),
+        pool_recycle=app.config.get("DB_POOL_RECYCLE", 1800),
+        pool_pre_ping=app.config.get("DB_POOL_PRE_PING", True),
+        driver=app.config.get("DB_DRIVER", "psycopg2"),
+        prepare_threshold=prepare_threshold if prepare_threshold >= 0 else None,
+        backend=app.config.get("DB_BACKEND", "sync"),
+    )
+    app.extensions["database"] = database
+
+    write_behind = None
+    if app.config.get("PERSISTENCE_MODE") == "write_behind":
+        # Large batches are streamed in with COPY when DB_DRIVER is psycopg
+        write_behind = WriteBehindQueue(
+            copy_pending,
+            maxsize=app.config["WRITE_BEHIND_QUEUE_SIZE"],
+            batch_size=app.config["WRITE_BEHIND_BATCH_SIZE"],
+            flush_interval=app.config["WRITE_BEHIND_FLUSH_INTERVAL"],
+            logger=app.logger,
+        )
+    app.extensions["write_behind"] = write_behind
+
+    result_cache = None
+    if app.config.get("RESULT_CACHE_SIZE"):
+        result_cache = ResultCache(
+            maxsize=app.config["RESULT_CACHE_SIZE"],
+            ttl=app.config["RESULT_CACHE_TTL"],
+            version=prompt_version(),
+        )
+    app.extensions["result_cache"] = result_cache
+
+    semantic_cache = None
+    if app.config.get("SEMANTIC_CACHE_SIZE"):
+        semantic_cache = SemanticCache(
+            capacity=app.config["SEMANTIC_CACHE_SIZE"],
+            max_distance=app.config["SEMANTIC_CACHE_MAX_DISTANCE"],
+        )
+    app.extensions["semantic_cache"] = semantic_cache
+
+    pinecone_index = configure_pinecone(
+        pool_size=app.config.get("PINECONE_POOL_SIZE", 10),
+        pool_threads=app.config.get("PINECONE_POOL_THREADS", 1),
+        keep_alive_idle=app.config.get("PINECONE_KEEPALIVE_IDLE", 60),
+    )
+    if app.config.get("PINECONE_WARMUP"):
+        try:
+            app.logger.info("Pinecone warm-up: %s", pinecone_index.warm_up())
+        except Exception as e:
+            app.logger.warning("Pinecone warm-up failed: %s", e)
+    app.extensions["pinecone"] = pinecone_index
+
+    retrieval_backend = None
+    if app.config.get("RETRIEVAL_BACKEND", "pinecone") == "local":
+        retrieval_backend = LocalIndexBackend(app.config["LOCAL_INDEX_PATH"])
+        app.logger.info(
+            "Serving retrieval from %s (%d documents)",
+            app.config["LOCAL_INDEX_PATH"],
+            len(retrieval_backend),
+        )
+
+    configure_embeddings(app.config.get("EMBED_DIMENSIONS"))
+
+    embedder = None
+    if app.config.get("EMBED_COALESCE_WINDOW_MS"):
+        embedder = EmbeddingCoalescer(
+            window=app.config["EMBED_COALESCE_WINDOW_MS"] / 1000,
+            max_batch=app.config["EMBED_COALESCE_MAX_BATCH"],
+        )
+    app.extensions["embedding_coalescer"] = embedder
+
+    # The cache sits in front of the coalescer so only misses are batched
+    embedding_cache = None
+    if app.config.get("EMBED_CACHE_SIZE"):
+        embedding_cache = EmbeddingCache(
+            embedder,
+            maxsize=app.config["EMBED_CACHE_SIZE"],
+            path=app.config.get("EMBED_CACHE_PATH") or None,
+        )
+        embedder = embedding_cache
+    app.extensions["embedding_cache"] = embedding_cache
+
+    hedge_options = {
+        "hedge": app.config.get("LLM_HEDGE", False),
+        "min_hedge_delay": app.config.get("LLM_HEDGE_MIN_DELAY_MS", 250) / 1000,
+    }
+    chat_route = ModelRoute(
+        app.config.get("CHAT_MODEL", "gpt-4"),
+        app.config.get("CHAT_FALLBACK_MODEL"),
+        app.config.get("CHAT_DEADLINE_SECONDS"),
+        **hedge_options,
+    )
+    model_router = ModelRouter(
+        {
+            "parse_query": ModelRoute(
+                app.config.get("PARSE_MODEL", "gpt-4"),
+                app.config.get("PARSE_FALLBACK_MODEL"),
+                app.config.get("PARSE_DEADLINE_SECONDS"),
+                **hedge_options,
+            ),
+            "chat_llm": chat_route,
+            "review_query": chat_route,
+        },
+    )
+    app.extensions["model_router"] = model_router
+
+    context_assembler = None
+    if app.config.get("CONTEXT_TOKEN_BUDGET"):
+        context_assembler = ContextAssembler(
+            max_tokens=app.config["CONTEXT_TOKEN_BUDGET"],
+            max_similarity=app.config["CONTEXT_MAX_SIMILARITY"],
+            model=chat_route.primary,
+        )
+        # Load the tokenizer now rather than on the first request
+        app.logger.info("Counting context tokens with %s", context_assembler.load_encoder().name)
+    app.extensions["context_assembler"] = context_assembler
+
+    parse_options = {
+        "parse_mode": app.config.get("PARSE_MODE", "llm"),
+        "parse_threshold": app.config.get("PARSE_LOCAL_THRESHOLD", 0.75),
+        "parse_agreement": ParseAgreement(),
+    }
+
+    # Build the step pipelines once per process and reuse them across requests
+    pipelines = PipelineRegistry()
+    pipelines.register(
+        DEFAULT_PIPELINE,
+        lambda: build_default_pipeline(
+            write_behind,
+            result_cache,
+            semantic_cache,
+            retrieval_backend=retrieval_backend,
+            embedder=embedder,
+            context_assembler=context_assembler,
+            model_router=model_router,
+            **parse_options,
+        ),
+    )
+    pipelines.register(
+        SINGLE_CALL_PIPELINE,
+        lambda: build_single_call_pipeline(
+            write_behind,
+            result_cache,
+            retrieval_backend=retrieval_backend,
+            embedder=embedder,
+            context_assembler=context_assembler,
+            model_router=model_router,
+        ),
+    )
+    pipelines.build_all()
+    app.extensions["pipelines"] = pipelines
+    if app.config.get("PIPELINE", DEFAULT_PIPELINE) not in pipelines.names():
+        raise ValueError(
+            f"PIPELINE must be one of {pipelines.names()}, not {app.config.get('PIPELINE')!r}"
+        )
+
+    # Not a runnable, so kept out of the registry PIPELINE selects from
+    stream_pipeline = StreamingPipeline(
+        write_behind,
+        semantic_cache,
+        retrieval_backend=retrieval_backend,
+        embedder=embedder,
+        context_assembler=context_assembler,
+        model_router=model_router,
+        **parse_options,
+    )
+    app.extensions["stream_pipeline"] = stream_pipeline
+
     # Initialize rate limiter
     limiter = Limiter(
         app=app,
         key_func=get_remote_address,
         default_limits=["200 per day", "50 per hour"]
     )
+    app.extensions["rate_limiter"] = limiter
 
     # Configure Talisman with security headers
-    Talisman(
+    app.extensions["talisman"] = Talisman(
         app,
         force_https=True,
         strict_transport_security=True,
@@ -51,22 +243,14 @@ def create_app(config_class=None):
 
     @app.post("/api/chat")
     @cross_origin()
-    @limiter.limit("10 per minute")  # More specific limit for the chat endpoint
+    @limiter.limit(CHAT_RATE_LIMIT)  # More specific limit for the chat endpoint
     def recommendation():
         try:
             data = request.get_json()
             query = data["prompt"]
 
-            pipeline_chain = (
-                clean_user_query()
-                | parse_query()
-                | summarize_query()
-                | score_query()
-                | run_query()
-                | embed_query()
-                | pinecone_query()
-                | chat_llm()
-                | query_feedback()
+            pipeline_chain = pipelines.get(
+                app.config.get("PIPELINE", DEFAULT_PIPELINE)
             )
 
             result = pipeline_chain.invoke({"input": query})
@@ -81,12 +265,101 @@ def create_app(config_class=None):
         else:
             return jsonify({"success": True, "feedback": result})
 
+    @app.post("/api/chat/stream")
+    @cross_origin()
+    @limiter.limit(CHAT_RATE_LIMIT)
+    def recommendation_stream():
+        try:
+            data = request.get_json()
+            query = data["prompt"]
+        except Exception as e:
+            current_app.logger.exception(e)
+            return error_response(message="Missing prompt " + str(e))
+
+        state = {}
+
+        def generate():
+            try:
+                for event, payload in stream_pipeline.events(query, state):
+                    yield sse_event(event, payload)
+            except Exception as e:
+                current_app.logger.exception(e)
+                yield sse_event(
+                    "error",
+                    {
+                        "message": "Error running pipeline chain " + str(e),
+                        "error": "Failed Pipeline",
+                    },
+                )
+
+        response = Response(
+            stream_with_context(generate()), mimetype="text/event-stream"
+        )
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no"
+
+        # Persist only once the client has the whole stream
+        @response.call_on_close
+        def persist():
+            if "feedback" not in state:
+                return
+            with app.app_context():
+                try:
+                    stream_pipeline.persist(state)
+                except Exception as e:
+                    current_app.logger.exception(e)
+
+        return response
+
+    def sse_event(event, payload):
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    def collect_stats():
+        stats = {
+            "pipelines": pipelines.stats(),
+            "stages": metrics.snapshot(),
+            "parse_agreement": parse_options["parse_agreement"].stats(),
+            "model_router": model_router.stats(),
+            "database": database.stats(),
+        }
+        if write_behind is not None:
+            stats["write_behind"] = dict(write_behind.stats(), **copy_stats())
+        if result_cache is not None:
+            stats["result_cache"] = result_cache.stats()
+        if semantic_cache is not None:
+            stats["semantic_cache"] = semantic_cache.stats()
+        if app.extensions["embedding_coalescer"] is not None:
+            stats["embedding_coalescer"] = app.extensions["embedding_coalescer"].stats()
+        if embedding_cache is not None:
+            stats["embedding_cache"] = embedding_cache.stats()
+        return stats
+
+    app.extensions["stats"] = collect_stats
+
+    @app.get("/api/stats")
+    @limiter.exempt
+    def stats():
+        return jsonify(collect_stats())
+
+    @app.get("/api/metrics")
+    @limiter.exempt
+    def metrics_scrape():
+        return Response(
+            metrics.render_prometheus(), mimetype="text/plain; version=0.0.4"
+        )
+
     def error_response(message, status_code=400, error_type="Bad Request"):
         return (
             jsonify({"sucess": False, "message": message, "error": error_type}),
             status_code,
         )
 
+    @app.before_request
+    def before_request():
+        # Collect the per-stage timings of this request for Server-Timing
+        g.request_start = time.perf_counter()
+        g.timings = start_request()
+
     @app.after_request
     def after_request(response):
         response.headers.add(
@@ -95,6 +368,16 @@ def create_app(config_class=None):
         response.headers.add(
             "Access-Control-Allow-Methods", "GET, POST, PATCH, DELETE, OPTIONS"
         )
+
+        # A streamed response is sent before its stages have run
+        timings = g.get("timings")
+        if timings is not None and not response.is_streamed:
+            total = (time.perf_counter() - g.request_start) * 1000
+            server_timing = timings.server_timing()
+            response.headers["Server-Timing"] = ", ".join(
+                filter(None, [server_timing, f"total;dur={total:.1f}"])
+            )
+            response.headers["Timing-Allow-Origin"] = "*"
         return response
 
     return app
@@ -0,0 +1,168 @@
+import time
+from contextlib import asynccontextmanager
+
+from flask import Flask
+from limits import parse
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, RedirectResponse
+from starlette.routing import Route
+
+from steps import DEFAULT_PIPELINE, metrics, start_request
+
+from . import CHAT_RATE_LIMIT
+
+
+def _is_secure(request: Request) -> bool:
+    return (
+        request.url.scheme == "https"
+        or request.headers.get("X-Forwarded-Proto", "http") == "https"
+    )
+
+
+def security_headers(flask_app: Flask):
+    """
+    Starlette middleware applying the Flask app's Talisman settings: the
+    HTTPS redirect (off in debug mode), HSTS on secure requests, the CSP
+    and the other headers Talisman sets on every response.
+    """
+    talisman = flask_app.extensions["talisman"]
+
+    headers = {
+        "X-XSS-Protection": "1; mode=block",
+        "X-Content-Type-Options": "nosniff",
+        "Referrer-Policy": talisman.referrer_policy,
+    }
+    if talisman.frame_options:
+        headers["X-Frame-Options"] = talisman.frame_options
+    if talisman.content_security_policy:
+        headers["Content-Security-Policy"] = "; ".join(
+            f"{section} {content}"
+            for section, content in talisman.content_security_policy.items()
+        )
+
+    hsts = None
+    if talisman.strict_transport_security:
+        hsts = f"max-age={talisman.strict_transport_security_max_age}"
+        if talisman.strict_transport_security_include_subdomains:
+            hsts += "; includeSubDomains"
+        if talisman.strict_transport_security_preload:
+            hsts += "; preload"
+
+    async def dispatch(request: Request, call_next):
+        secure = _is_secure(request)
+        if talisman.force_https and not (flask_app.debug or secure):
+            return RedirectResponse(
+                str(request.url.replace(scheme="https")),
+                status_code=301 if talisman.force_https_permanent else 302,
+            )
+
+        response = await call_next(request)
+        response.headers.update(headers)
+        if secure and hsts:
+            response.headers["Strict-Transport-Security"] = hsts
+        return response
+
+    return Middleware(BaseHTTPMiddleware, dispatch=dispatch)
+
+
+# ASGI app factory serving the pipeline natively on the event loop
+def create_asgi_app(flask_app: Flask) -> Starlette:
+    """
+    Wrap a configured Flask app in an ASGI app whose /api/chat endpoint runs
+    the compiled pipeline with ``ainvoke``, so a single worker can keep many
+    requests in flight while they wait on OpenAI, Pinecone and Postgres.
+    """
+    pipelines = flask_app.extensions["pipelines"]
+
+    # Counted in the Flask limiter's storage, under a key of its own
+    limiter = flask_app.extensions["rate_limiter"]
+    chat_limit = parse(CHAT_RATE_LIMIT)
+
+    def rate_limited(request: Request) -> bool:
+        if not limiter.enabled:
+            return False
+        client = request.client.host if request.client else "127.0.0.1"
+        return not limiter.limiter.hit(chat_limit, "asgi", request.url.path, client)
+
+    def error_response(message, status_code=400, error_type="Bad Request"):
+        return JSONResponse(
+            {"sucess": False, "message": message, "error": error_type},
+            status_code=status_code,
+        )
+
+    async def recommendation(request: Request):
+        if rate_limited(request):
+            return error_response(
+                message=f"Rate limit exceeded: {CHAT_RATE_LIMIT}",
+                error_type="Too Many Requests",
+                status_code=429,
+            )
+
+        start = time.perf_counter()
+        timings = start_request()
+        try:
+            data = await request.json()
+            query = data["prompt"]
+
+            pipeline_chain = pipelines.get(
+                flask_app.config.get("PIPELINE", DEFAULT_PIPELINE)
+            )
+
+            # Steps log through current_app, so run them inside an app context
+            with flask_app.app_context():
+                result = await pipeline_chain.ainvoke({"input": query})
+
+        except Exception as e:
+            flask_app.logger.exception(e)
+            return error_response(
+                message="Error running pipeline chain " + str(e),
+                error_type="Failed Pipeline",
+                status_code=500,
+            )
+        else:
+            total = (time.perf_counter() - start) * 1000
+            server_timing = ", ".join(
+                filter(None, [timings.server_timing(), f"total;dur={total:.1f}"])
+            )
+            return JSONResponse(
+                {"success": True, "feedback": result},
+                headers={"Server-Timing": server_timing, "Timing-Allow-Origin": "*"},
+            )
+
+    async def stats(request: Request):
+        return JSONResponse(flask_app.extensions["stats"]())
+
+    async def metrics_scrape(request: Request):
+        return PlainTextResponse(
+            metrics.render_prometheus(), media_type="text/plain; version=0.0.4"
+        )
+
+    @asynccontextmanager
+    async def lifespan(app: Starlette):
+        yield
+        # The asyncio Pinecone index holds an HTTP session on this event loop
+        await flask_app.extensions["pinecone"].aclose()
+        # So does the asyncio database pool, when DB_BACKEND is "async"
+        await flask_app.extensions["database"].aclose()
+
+    return Starlette(
+        lifespan=lifespan,
+        routes=[
+            Route("/api/chat", recommendation, methods=["POST"]),
+            Route("/api/stats", stats, methods=["GET"]),
+            Route("/api/metrics", metrics_scrape, methods=["GET"]),
+        ],
+        middleware=[
+            security_headers(flask_app),
+            Middleware(
+                CORSMiddleware,
+                allow_origins=["*"],
+                allow_methods=["GET", "POST", "PATCH", "DELETE", "OPTIONS"],
+                allow_headers=["Content-Type", "Authorization"],
+            )
+        ],
+    )
@@ -0,0 +1,5 @@
+from app.asgi import create_asgi_app
+from wsgi import app as flask_app
+
+# Serve with: uvicorn --app-dir api asgi:app
+app = create_asgi_app(flask_app)
@@ -0,0 +1,7 @@
+"""
+Offline benchmark harness for the /api/chat pipeline.
+
+Runs the real ``create_app`` pipeline against local stand-ins for OpenAI,
+Pinecone and Postgres so throughput and latency can be compared between
+commits without network access or API keys. See ``bench.run``.
+"""
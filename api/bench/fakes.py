@@ -0,0 +1,487 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import sys
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.util import await_only
+
+from steps.local_parse import local_parse
+from steps.retrieval import write_local_index
+
+FEEDBACK = {
+    "strengths": [
+        "You clearly say what you want the model to do.",
+        "The request is short and focused.",
+    ],
+    "improvements": [
+        "Give the model a role, such as an experienced editor.",
+        "Add an example of the output you are hoping for.",
+        "Say how long the answer should be.",
+    ],
+    "tags": ["writing", "practice"],
+}
+
+
+class Latency:
+    """
+    A base delay in seconds with +/- ``jitter`` proportional noise. A
+    ``tail`` fraction of calls is ``tail_factor`` times slower, like a
+    provider having a bad moment.
+    """
+
+    def __init__(
+        self,
+        seconds: float,
+        jitter: float = 0.2,
+        seed: Optional[int] = None,
+        tail: float = 0.0,
+        tail_factor: float = 10.0,
+    ):
+        self.seconds = seconds
+        self.jitter = jitter
+        self.tail = tail
+        self.tail_factor = tail_factor
+        self._random = random.Random(seed)
+
+    def sample(self) -> float:
+        if self.seconds <= 0:
+            return 0.0
+        delay = self.seconds * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+        if self.tail and self._random.random() < self.tail:
+            delay *= self.tail_factor
+        return delay
+
+    def sleep(self) -> None:
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+
+    async def asleep(self) -> None:
+        delay = self.sample()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+def _last_text(messages: List[BaseMessage]) -> str:
+    return str(messages[-1].content) if messages else ""
+
+
+def _tokens(text: str) -> int:
+    # Close enough to tiktoken for English to make the token metrics plausible
+    return max(1, len(text) // 4)
+
+
+def parse_response(messages: List[BaseMessage]) -> str:
+    """What parse_query's LLM would return: the prompt's component flags."""
+    user_query = _last_text(messages)
+    return json.dumps({"user_query": user_query, **local_parse(user_query).flags})
+
+
+def feedback_response(messages: List[BaseMessage]) -> str:
+    """What chat_llm's LLM would return: a fixed piece of feedback."""
+    return json.dumps(FEEDBACK)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Stand-in for ChatOpenAI that waits ``latency`` before answering with
+    ``respond(messages)``, streams in small chunks and reports token usage.
+    """
+
+    latency: Any
+    respond: Callable[[List[BaseMessage]], str]
+    chunk_size: int = 16
+
+    @property
+    def _llm_type(self) -> str:
+        return "bench-fake-chat"
+
+    @staticmethod
+    def _usage(messages: List[BaseMessage], content: str) -> Dict[str, int]:
+        input_tokens = sum(_tokens(str(m.content)) for m in messages)
+        output_tokens = _tokens(content)
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        content = self.respond(messages)
+        message = AIMessage(content=content, usage_metadata=self._usage(messages, content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.latency.sleep()
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await self.latency.asleep()
+        return self._result(messages)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        # Time to first token, then the rest of the response arrives quickly
+        self.latency.sleep()
+        content = self.respond(messages)
+        for i in range(0, len(content), self.chunk_size):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=content[i : i + self.chunk_size]))
+        # Usage arrives in a final empty chunk, as with stream_usage on ChatOpenAI
+        yield ChatGenerationChunk(
+            message=AIMessageChunk(content="", usage_metadata=self._usage(messages, content))
+        )
+
+    def with_structured_output(self, schema, **kwargs):
+        """Answer the single-call review with the local flags and the fixed feedback."""
+
+        def review(messages) -> Any:
+            user_query = _last_text(messages.to_messages() if hasattr(messages, "to_messages") else messages)
+            return schema(**local_parse(user_query).flags, **FEEDBACK)
+
+        def run(messages):
+            self.latency.sleep()
+            return review(messages)
+
+        async def arun(messages):
+            await self.latency.asleep()
+            return review(messages)
+
+        return RunnableLambda(run, afunc=arun)
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic unit vectors derived from a hash of the text."""
+
+    def __init__(self, latency: Latency, size: int = 1536):
+        self.latency = latency
+        self.size = size
+        # Set by configure_embeddings, as on the OpenAI client
+        self.dimensions = None
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.size).astype(np.float32)
+        vector = vector[: self.dimensions or self.size]
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.latency.sleep()
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.latency.sleep()
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await self.latency.asleep()
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await self.latency.asleep()
+        return self._vector(text)
+
+
+def _matches(top_k: int):
+    return SimpleNamespace(
+        matches=[
+            SimpleNamespace(
+                id=f"doc-{i}",
+                score=0.9 - i * 0.05,
+                metadata={
+                    "text": f"Prompting guide excerpt {i}: state the task, give the model "
+                    "a role, provide context, set rules, show examples and ask for a format.",
+                    "source": "bench",
+                },
+            )
+            for i in range(top_k)
+        ]
+    )
+
+
+class FakeIndex:
+    def __init__(self, latency: Latency):
+        self.latency = latency
+
+    def describe_index_stats(self, **kwargs):
+        self.latency.sleep()
+        return SimpleNamespace(dimension=1536, total_vector_count=3)
+
+    def query(self, vector=None, top_k: int = 3, **kwargs):
+        self.latency.sleep()
+        return _matches(top_k)
+
+
+class FakeAsyncIndex:
+    def __init__(self, latency: Latency):
+        self.latency = latency
+
+    async def close(self):
+        pass
+
+    async def query(self, vector=None, top_k: int = 3, **kwargs):
+        await self.latency.asleep()
+        return _matches(top_k)
+
+
+def fake_pinecone_classes(latency: Latency):
+    """Stand-ins for the ``Pinecone`` and ``PineconeAsyncio`` client classes."""
+
+    class FakePinecone:
+        def __init__(self, *args, **kwargs):
+            self.openapi_config = SimpleNamespace(socket_options=None)
+
+        def Index(self, *args, **kwargs):
+            return FakeIndex(latency)
+
+    class FakePineconeAsyncio:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        async def close(self):
+            pass
+
+        async def describe_index(self, name):
+            return SimpleNamespace(host="bench.local")
+
+        def IndexAsyncio(self, *args, **kwargs):
+            return FakeAsyncIndex(latency)
+
+    return FakePinecone, FakePineconeAsyncio
+
+
+def write_fake_local_index(path: str, size: int, dimension: int = 1536, seed: int = 0) -> None:
+    """A LocalIndexBackend index of random documents the size of a real corpus."""
+    embeddings = np.random.default_rng(seed).standard_normal((size, dimension)).astype(np.float32)
+    write_local_index(
+        path,
+        ids=[f"doc-{i}" for i in range(size)],
+        embeddings=embeddings,
+        metadata=[{"text": f"Prompting guide excerpt {i}.", "source": "bench"} for i in range(size)],
+    )
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_query (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  deleted_at TEXT,
+  created_by TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_query_version (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_query TEXT NOT NULL,
+  task BOOLEAN NOT NULL DEFAULT FALSE,
+  role BOOLEAN NOT NULL DEFAULT FALSE,
+  context BOOLEAN NOT NULL DEFAULT FALSE,
+  rules BOOLEAN NOT NULL DEFAULT FALSE,
+  examples BOOLEAN NOT NULL DEFAULT FALSE,
+  format BOOLEAN NOT NULL DEFAULT FALSE,
+  user_query_id INTEGER REFERENCES user_query(id)
+);
+CREATE TABLE IF NOT EXISTS scores (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  total_score FLOAT,
+  max_possible_score INTEGER,
+  percentage_score FLOAT,
+  task_score INTEGER,
+  role_score INTEGER,
+  context_score INTEGER,
+  rules_score INTEGER,
+  examples_score INTEGER,
+  format_score INTEGER,
+  word_count_score FLOAT,
+  user_query_version_id INTEGER REFERENCES user_query_version(id)
+);
+CREATE TABLE IF NOT EXISTS feedback_response (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  improvements TEXT,
+  score INTEGER,
+  strengths TEXT,
+  tags TEXT,
+  user_query_version_id INTEGER REFERENCES user_query_version(id)
+);
+"""
+
+# Postgres array parameters, CAST(? AS TEXT[]), are bound as JSON text in SQLite
+_ARRAY_PARAMETER = re.compile(r"CAST\(\?\s+AS\s+TEXT\[\]\)", re.IGNORECASE)
+_INSERT_CTE = re.compile(r"\s*WITH\s+\w+\s+AS\s*\(\s*INSERT\b", re.IGNORECASE)
+_CTE_NAME = re.compile(r"[\s,]*(\w+)\s+AS\s*\(", re.IGNORECASE)
+
+
+def _scan(statement: str, start: int = 0):
+    """Characters of ``statement`` from ``start`` that aren't inside a string literal."""
+    quoted = False
+    for i in range(start, len(statement)):
+        char = statement[i]
+        if char == "'":
+            quoted = not quoted
+        elif not quoted:
+            yield i, char
+
+
+def _closing_paren(statement: str, start: int) -> int:
+    """Index of the parenthesis closing the one before ``start``."""
+    depth = 1
+    for i, char in _scan(statement, start):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError("Unbalanced parentheses in statement")
+
+
+def _placeholders(statement: str) -> int:
+    return sum(char == "?" for _, char in _scan(statement))
+
+
+def split_insert_ctes(statement: str):
+    """
+    Split ``WITH a AS (INSERT ...), b AS (...) SELECT ...`` into its named
+    parts and the final query, or return None for any other statement.
+    """
+    if not _INSERT_CTE.match(statement):
+        return None
+    position = statement.upper().index("WITH") + len("WITH")
+    parts = []
+    while True:
+        match = _CTE_NAME.match(statement, position)
+        if match is None:
+            return parts, statement[position:]
+        end = _closing_paren(statement, match.end())
+        parts.append((match.group(1), statement[match.end():end]))
+        position = end + 1
+
+
+def _execute_insert_ctes(cursor, parts, query: str, parameters) -> None:
+    # SQLite has no data-modifying CTEs. Run each part in turn, keeping the
+    # ids it returns in a temporary table of the CTE's name for the parts
+    # after it, and leave the final query's rows on the cursor.
+    parameters = list(parameters or ())
+    for name, body in parts:
+        count = _placeholders(body)
+        bound, parameters = parameters[:count], parameters[count:]
+        cursor.execute(f"DROP TABLE IF EXISTS temp.{name}")
+        cursor.execute(body, bound)
+        rows = cursor.fetchall()
+        cursor.execute(f"CREATE TEMP TABLE {name} (id INTEGER)")
+        cursor.executemany(f"INSERT INTO temp.{name} VALUES (?)", [row[:1] for row in rows])
+    cursor.execute(query, parameters)
+
+
+def _sqlite_parameters(parameters):
+    # Lists bound for Postgres arrays are stored as JSON text
+    return tuple(json.dumps(value) if isinstance(value, list) else value for value in parameters)
+
+
+def prepare_engine(engine: Engine, latency: Latency) -> None:
+    """
+    Add a simulated network round trip to every statement on ``engine`` and,
+    for SQLite, create the schema and translate the Postgres-only syntax the
+    steps use. A chained INSERT CTE is run part by part but, like on
+    Postgres, costs a single round trip. For the asyncio engine of
+    DB_BACKEND="async" this is given its sync_engine.
+    """
+    sqlite = engine.dialect.name == "sqlite"
+    asynchronous = engine.dialect.is_async
+
+    if sqlite:
+        @event.listens_for(engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            # Let SQLAlchemy issue BEGIN, taking the write lock up front so
+            # concurrent writers queue on busy_timeout rather than failing
+            dbapi_connection.isolation_level = None
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA busy_timeout=30000")
+            cursor.close()
+
+        @event.listens_for(engine, "begin")
+        def on_begin(connection):
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+        @event.listens_for(engine, "do_execute")
+        def do_execute(cursor, statement, parameters, context):
+            split = split_insert_ctes(statement)
+            if split is None:
+                return False
+            _execute_insert_ctes(cursor, *split, parameters)
+            return True
+
+        # Drop connections opened before the listeners were added
+        engine.dispose()
+
+        if asynchronous:
+            # An asyncio engine can't be used from here, so go to the file directly
+            with sqlite3.connect(engine.url.database) as connection:
+                connection.executescript(SQLITE_SCHEMA)
+        else:
+            with engine.connect() as connection:
+                connection.connection.executescript(SQLITE_SCHEMA)
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if asynchronous:
+            # Statements of an asyncio engine run in a greenlet on the event
+            # loop, which can await the delay rather than block the loop
+            await_only(latency.asleep())
+        else:
+            latency.sleep()
+        if sqlite:
+            statement = _ARRAY_PARAMETER.sub("?", statement)
+            if executemany:
+                parameters = [_sqlite_parameters(p) for p in parameters]
+            else:
+                parameters = _sqlite_parameters(parameters)
+        return statement, parameters
+
+
+def install(
+    llm_latency: Latency,
+    embed_latency: Latency,
+    pinecone_latency: Latency,
+    db_latency: Latency,
+    embedding_size: int = 1536,
+) -> None:
+    """
+    Swap the OpenAI, Pinecone and database clients used by the steps for the
+    stand-ins. Must run after ``steps`` is imported and before ``create_app``
+    builds the pipelines.
+    """
+    modules = {name: sys.modules[f"steps.{name}"] for name in (
+        "parse_query", "chat_llm", "single_call", "embed_query", "pinecone",
+    )}
+
+    def build_parse_llm(model: str = "gpt-4"):
+        return FakeChatModel(latency=llm_latency, respond=parse_response)
+
+    modules["parse_query"].llm = build_parse_llm()
+    modules["parse_query"].build_llm = build_parse_llm
+
+    def build_llm(model: str = "gpt-4"):
+        return FakeChatModel(latency=llm_latency, respond=feedback_response)
+
+    modules["chat_llm"].build_llm = build_llm
+    modules["single_call"].build_llm = build_llm
+
+    modules["embed_query"].embeddings = FakeEmbeddings(embed_latency, size=embedding_size)
+
+    fake_pinecone, fake_pinecone_asyncio = fake_pinecone_classes(pinecone_latency)
+    modules["pinecone"].Pinecone = fake_pinecone
+    modules["pinecone"].PineconeAsyncio = fake_pinecone_asyncio
+
+    sys.modules["steps.database"].database.add_engine_hook(lambda engine: prepare_engine(engine, db_latency))
@@ -0,0 +1,168 @@
+"""
+Compare the per-insert cost of literal SQL, as the database steps used to
+build it with str.format, against the bound-parameter statements they use
+now.
+
+Run from the api/ directory against a scratch Postgres with the schema from
+db/usery_query.sql::
+
+    python -m bench.inserts --database-uri postgresql://localhost/prompy --inserts 2000
+
+Each statement a request writes is timed in both forms: run_query's insert,
+query_feedback's feedback_response insert and the combined write-behind
+insert. Literal SQL differs with every request, so Postgres parses and
+plans it every time. With psycopg the bound form becomes a prepared
+statement once it has run --prepare-threshold times on a connection and is
+only executed from then on; psycopg2 binds on the client, so it shows the
+cost of the text alone.
+
+Every insert runs in a transaction that is rolled back, so the tables are
+left as they were (their id sequences still advance).
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from bench.run import git_commit, make_prompts, percentiles
+
+# Named parameters, but not the :: of a Postgres cast
+_PARAMETER = re.compile(r"(?<!:):(\w+)")
+
+SCORE_BREAKDOWN = {
+    "total_score": 13,
+    "max_possible_score": 19,
+    "percentage_score": 68.42,
+    "score_by_field": {
+        "task": 4, "role": 3, "context": 0, "rules": 3, "examples": 0, "format": 0, "word_count": 3,
+    },
+}
+
+
+def literal(value: Any) -> str:
+    """Render a value the way the old str.format templates did."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, list):
+        return f"ARRAY[{', '.join(literal(v) for v in value)}]::TEXT[]"
+    escaped = str(value).replace("'", "''")
+    return f"'{escaped}'"
+
+
+def inline(statement, params: Dict[str, Any]) -> str:
+    """``statement`` with its parameters written into the SQL text."""
+    return _PARAMETER.sub(lambda m: literal(params[m.group(1)]), statement.text)
+
+
+def run(connection, statement, params: Dict[str, Any], bound: bool):
+    if bound:
+        return connection.execute(statement, params)
+    return connection.exec_driver_sql(inline(statement, params))
+
+
+def measure(database, inserts: int, warmup: int, bound: bool) -> Dict[str, Any]:
+    from bench.fakes import FEEDBACK
+    from steps.db_query import INSERT_QUERY, query_params
+    from steps.db_query_feedback import FEEDBACK_RESPONSE, INSERT_QUERY_WITH_FEEDBACK, feedback_params
+    from steps.local_parse import local_parse
+
+    timings: Dict[str, List[float]] = {"run_query": [], "feedback_response": [], "write_behind": []}
+
+    def timed(kind: str, connection, statement, params: Dict[str, Any], keep: bool):
+        start = time.perf_counter()
+        result = run(connection, statement, params, bound)
+        result = result.scalar() if result.returns_rows else None
+        if keep:
+            timings[kind].append((time.perf_counter() - start) * 1000)
+        return result
+
+    with database.connect() as connection:
+        for i, prompt in enumerate(make_prompts(warmup + inserts)):
+            keep = i >= warmup
+            parsed_response = {"user_query": prompt, **local_parse(prompt).flags}
+            params = query_params(parsed_response, SCORE_BREAKDOWN)
+            feedback = feedback_params(dict(FEEDBACK, score=SCORE_BREAKDOWN["total_score"]))
+
+            with connection.begin() as transaction:
+                version_id = timed("run_query", connection, INSERT_QUERY, params, keep)
+                timed(
+                    "feedback_response",
+                    connection,
+                    FEEDBACK_RESPONSE,
+                    dict(feedback, user_query_version_id=version_id),
+                    keep,
+                )
+                transaction.rollback()
+
+            with connection.begin() as transaction:
+                timed("write_behind", connection, INSERT_QUERY_WITH_FEEDBACK, {**params, **feedback}, keep)
+                transaction.rollback()
+
+    return {kind: {**percentiles(values), "mean": round(sum(values) / len(values), 3)} for kind, values in timings.items()}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-uri", default=os.environ.get("SUPABASE_URI"))
+    parser.add_argument("--inserts", type=int, default=1000, help="Timed requests per driver and form")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--drivers", nargs="+", choices=["psycopg", "psycopg2"], default=["psycopg", "psycopg2"])
+    parser.add_argument("--prepare-threshold", type=int, default=5)
+    parser.add_argument("--output", default="bench-inserts.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> Dict[str, Any]:
+    args = parse_args(argv)
+    if not args.database_uri or not args.database_uri.startswith(("postgresql", "postgres")):
+        raise SystemExit("bench.inserts needs a Postgres --database-uri")
+
+    # The steps read this at import time
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    from steps.database import Database
+
+    results = {}
+    for driver in args.drivers:
+        database = Database(
+            pool_size=1,
+            max_overflow=0,
+            driver=driver,
+            prepare_threshold=args.prepare_threshold,
+            uri=args.database_uri,
+        )
+        results[driver] = {
+            form: measure(database, args.inserts, args.warmup, bound=form == "bound")
+            for form in ("literal", "bound")
+        }
+        database.engine().dispose()
+
+        for kind in ("run_query", "feedback_response", "write_behind"):
+            literal_ms, bound_ms = (results[driver][form][kind]["p50"] for form in ("literal", "bound"))
+            print(
+                f"{driver:<9} {kind:<18} literal p50={literal_ms}ms bound p50={bound_ms}ms "
+                f"bound/literal={bound_ms / literal_ms:.2f}",
+                file=sys.stderr,
+            )
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "database_uri")},
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    main()
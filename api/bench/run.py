@@ -0,0 +1,338 @@
+"""
+Benchmark the /api/chat pipeline offline.
+
+Run from the api/ directory::
+
+    python -m bench.run --concurrency 1 4 16 --requests 200 --output bench.json
+
+Every OpenAI, Pinecone and Postgres call goes to a local stand-in with the
+configured latency (see bench.fakes). The database defaults to a throwaway
+SQLite file; pass --database-uri to use a local Postgres with the schema
+from db/usery_query.sql instead.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+TASKS = [
+    "Write a short story about {topic}",
+    "Summarize the main arguments for and against {topic}",
+    "Explain {topic} to a ten year old",
+    "Create a study plan for learning about {topic}",
+    "Draft an email to my team about {topic}",
+]
+EXTRAS = [
+    "",
+    " You are an experienced teacher.",
+    " Keep it under 200 words.",
+    " Format the answer as bullet points.",
+    " For example, start with a question.",
+    " I am preparing a workshop for beginners, so avoid jargon.",
+]
+TOPICS = [
+    "renewable energy", "the French revolution", "sourdough baking", "black holes",
+    "remote work", "public transport", "machine learning", "coral reefs",
+]
+
+
+def make_prompts(count: int, offset: int = 0) -> List[str]:
+    """Distinct prompts, so the result and semantic caches see realistic misses."""
+    prompts = []
+    for i in range(offset, offset + count):
+        task = TASKS[i % len(TASKS)].format(topic=TOPICS[(i // len(TASKS)) % len(TOPICS)])
+        extra = EXTRAS[(i // 7) % len(EXTRAS)]
+        prompts.append(f"{task}.{extra} (request {i})")
+    return prompts
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p99": None}
+    p50, p99 = np.percentile(np.asarray(values, dtype=np.float64), [50, 99])
+    return {"p50": round(float(p50), 3), "p99": round(float(p99), 3)}
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if name and duration:
+            stages[name] = float(duration)
+    return stages
+
+
+class Sample:
+    def __init__(self, status: int, body: Any, latency_ms: float, stages: Dict[str, float]):
+        self.ok = status == 200
+        self.error = None if self.ok else (body or {}).get("message", f"HTTP {status}")
+        self.latency_ms = latency_ms
+        self.stages = stages
+
+
+def wsgi_driver(app) -> Callable[[List[str], int], List[Sample]]:
+    """Send requests from a pool of threads, as a threaded WSGI server would."""
+    local = threading.local()
+
+    def send(prompt: str) -> Sample:
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        start = time.perf_counter()
+        response = client.post(
+            "/api/chat", json={"prompt": prompt}, base_url="https://localhost"
+        )
+        latency_ms = (time.perf_counter() - start) * 1000
+        return Sample(
+            response.status_code,
+            response.get_json(silent=True),
+            latency_ms,
+            parse_server_timing(response.headers.get("Server-Timing")),
+        )
+
+    def drive(prompts: List[str], concurrency: int) -> List[Sample]:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(send, prompts))
+
+    return drive
+
+
+def asgi_driver(app) -> Callable[[List[str], int], List[Sample]]:
+    """Keep ``concurrency`` requests in flight on one event loop."""
+    import httpx
+    from app.asgi import create_asgi_app
+
+    asgi_app = create_asgi_app(app)
+
+    async def run(prompts: List[str], concurrency: int) -> List[Sample]:
+        semaphore = asyncio.Semaphore(concurrency)
+        transport = httpx.ASGITransport(app=asgi_app)
+
+        async with httpx.AsyncClient(transport=transport, base_url="https://bench") as client:
+            async def send(prompt: str) -> Sample:
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.post("/api/chat", json={"prompt": prompt})
+                    latency_ms = (time.perf_counter() - start) * 1000
+                    return Sample(
+                        response.status_code,
+                        response.json() if response.headers.get("content-type") == "application/json" else None,
+                        latency_ms,
+                        parse_server_timing(response.headers.get("server-timing")),
+                    )
+
+            try:
+                return await asyncio.gather(*(send(p) for p in prompts))
+            finally:
+                # Each run has its own event loop, so close the asyncio pool opened on it
+                await app.extensions["database"].aclose()
+
+    def drive(prompts: List[str], concurrency: int) -> List[Sample]:
+        return asyncio.run(run(prompts, concurrency))
+
+    return drive
+
+
+def measure_level(drive, concurrency: int, requests: int, memory_requests: int, offset: int) -> Dict[str, Any]:
+    prompts = make_prompts(requests, offset)
+
+    start = time.perf_counter()
+    samples = drive(prompts, concurrency)
+    elapsed = time.perf_counter() - start
+
+    ok = [s for s in samples if s.ok]
+    stage_names = sorted({name for s in ok for name in s.stages})
+    result = {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "error_messages": sorted({s.error for s in samples if not s.ok})[:5],
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(ok) / elapsed, 3) if elapsed else None,
+        "latency_ms": percentiles([s.latency_ms for s in ok]),
+        "stages_ms": {
+            name: percentiles([s.stages[name] for s in ok if name in s.stages])
+            for name in stage_names
+        },
+    }
+
+    if memory_requests:
+        # A separate pass, since tracing allocations slows every request down
+        prompts = make_prompts(memory_requests, offset + requests)
+        gc.collect()
+        tracemalloc.start()
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        drive(prompts, concurrency)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["memory"] = {
+            "requests": memory_requests,
+            "peak_bytes": peak - baseline,
+            "peak_bytes_per_in_flight_request": (peak - baseline) // concurrency,
+            "retained_bytes_per_request": (current - baseline) // memory_requests,
+        }
+
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--memory-requests", type=int, default=20, help="0 skips the memory pass")
+    parser.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi")
+    parser.add_argument("--pipeline", choices=["default", "single_call"], default="default")
+    parser.add_argument("--persistence-mode", choices=["sync", "write_behind"], default="sync")
+    parser.add_argument(
+        "--db-backend", choices=["sync", "async"], default="sync", help="async only changes the asgi server"
+    )
+    parser.add_argument("--parse-mode", choices=["llm", "local", "shadow"], default="llm")
+    parser.add_argument("--result-cache-size", type=int, default=0)
+    parser.add_argument("--semantic-cache-size", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Seconds per chat completion")
+    parser.add_argument("--embed-latency", type=float, default=0.1)
+    parser.add_argument("--pinecone-latency", type=float, default=0.05)
+    parser.add_argument("--db-latency", type=float, default=0.002, help="Seconds per SQL statement")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-uri", help="Defaults to a temporary SQLite file")
+    parser.add_argument(
+        "--retrieval-backend", choices=["pinecone", "local"], default="pinecone",
+        help="local searches a generated in-process index instead of the fake Pinecone",
+    )
+    parser.add_argument("--local-index-size", type=int, default=1000)
+    parser.add_argument("--llm-tail", type=float, default=0.0, help="Fraction of LLM calls that are 10x slower")
+    parser.add_argument("--hedge", action="store_true", help="Hedge LLM calls slower than their p95")
+    parser.add_argument("--context-token-budget", type=int, default=0, help="0 leaves the context untrimmed")
+    parser.add_argument("--embed-coalesce-window-ms", type=float, default=0, help="0 leaves coalescing off")
+    parser.add_argument("--embed-dimensions", type=int, default=0, help="0 keeps the native 1536")
+    parser.add_argument("--output", default="bench-results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> Dict[str, Any]:
+    args = parse_args(argv)
+
+    # The steps read these at import time
+    os.environ["OPENAI_API_KEY"] = "sk-bench"
+    os.environ["PINECONE_API_KEY"] = "bench"
+    os.environ["PINECONE_INDEX_NAME"] = "bench"
+    tmpdir = tempfile.TemporaryDirectory()
+    if args.database_uri:
+        os.environ["SUPABASE_URI"] = args.database_uri
+    else:
+        os.environ["SUPABASE_URI"] = f"sqlite:///{os.path.join(tmpdir.name, 'bench.db')}"
+
+    import steps  # noqa: F401
+    from bench.fakes import Latency, install, write_fake_local_index
+    from config import TestingConfig
+
+    install(
+        llm_latency=Latency(args.llm_latency, args.jitter, args.seed, tail=args.llm_tail),
+        embed_latency=Latency(args.embed_latency, args.jitter, args.seed + 1),
+        pinecone_latency=Latency(args.pinecone_latency, args.jitter, args.seed + 2),
+        db_latency=Latency(args.db_latency, args.jitter, args.seed + 3),
+    )
+
+    local_index_path = os.path.join(tmpdir.name, "local_index")
+    if args.retrieval_backend == "local":
+        write_fake_local_index(
+            local_index_path, args.local_index_size, dimension=args.embed_dimensions or 1536
+        )
+
+    class BenchConfig(TestingConfig):
+        PIPELINE = args.pipeline
+        PERSISTENCE_MODE = args.persistence_mode
+        DB_BACKEND = args.db_backend
+        PARSE_MODE = args.parse_mode
+        RESULT_CACHE_SIZE = args.result_cache_size
+        SEMANTIC_CACHE_SIZE = args.semantic_cache_size
+        RETRIEVAL_BACKEND = args.retrieval_backend
+        LOCAL_INDEX_PATH = local_index_path
+        EMBED_DIMENSIONS = args.embed_dimensions
+        EMBED_COALESCE_WINDOW_MS = args.embed_coalesce_window_ms
+        CONTEXT_TOKEN_BUDGET = args.context_token_budget
+        LLM_HEDGE = args.hedge
+        # A fresh on-disk tier, so earlier runs don't turn misses into hits
+        EMBED_CACHE_PATH = os.path.join(tmpdir.name, "embedding_cache.sqlite3")
+
+    from app import create_app
+
+    app = create_app(BenchConfig)
+    app.logger.disabled = True
+    for limiter in app.extensions.get("limiter", ()):
+        # The per-minute limits on /api/chat would cap the benchmark
+        limiter.enabled = False
+    drive = wsgi_driver(app) if args.server == "wsgi" else asgi_driver(app)
+
+    drive(make_prompts(args.warmup, offset=10**6), 1)
+
+    levels = []
+    offset = 0
+    for concurrency in args.concurrency:
+        level = measure_level(drive, concurrency, args.requests, args.memory_requests, offset)
+        offset += args.requests + args.memory_requests
+        levels.append(level)
+        print(
+            f"concurrency={concurrency:<4} rps={level['requests_per_second']:<9} "
+            f"p50={level['latency_ms']['p50']}ms p99={level['latency_ms']['p99']}ms "
+            f"errors={level['errors']}",
+            file=sys.stderr,
+        )
+
+    write_behind = app.extensions.get("write_behind")
+    if write_behind is not None:
+        write_behind.close()
+
+    stats = app.extensions["stats"]()
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": {
+            key: value for key, value in vars(args).items() if key not in ("output", "database_uri")
+        },
+        "database": "external" if args.database_uri else "sqlite",
+        "levels": levels,
+        # Cache, coalescer and queue counters accumulated over the whole run
+        "app_stats": {key: value for key, value in stats.items() if key != "stages"},
+        # LLM and context token counts, by stage
+        "tokens": stats["stages"]["tokens"],
+    }
+
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+    tmpdir.cleanup()
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,76 @@ import os
 class Config:
   OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
   PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
+  # "default" (separate parse and feedback LLM calls) or "single_call"
+  PIPELINE = os.environ.get("PIPELINE", "default")
+  # "sync" writes on the request path, "write_behind" queues for a background flusher
+  PERSISTENCE_MODE = os.environ.get("PERSISTENCE_MODE", "sync")
+  WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get("WRITE_BEHIND_QUEUE_SIZE", 1000))
+  WRITE_BEHIND_BATCH_SIZE = int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", 50))
+  WRITE_BEHIND_FLUSH_INTERVAL = float(os.environ.get("WRITE_BEHIND_FLUSH_INTERVAL", 0.5))
+  # Whole-pipeline result cache, disabled when the size is 0 (the default)
+  RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 0))
+  RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", 3600))
+  # Reuse chat_llm feedback for near-duplicate prompts, disabled when the size is 0 (the default);
+  # a hit serves feedback written for a different, if similar, prompt
+  SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", 0))
+  SEMANTIC_CACHE_MAX_DISTANCE = float(os.environ.get("SEMANTIC_CACHE_MAX_DISTANCE", 0.03))
+  # "llm", "local" (rule-based with LLM fallback) or "shadow" (LLM, compared against local)
+  PARSE_MODE = os.environ.get("PARSE_MODE", "llm")
+  PARSE_LOCAL_THRESHOLD = float(os.environ.get("PARSE_LOCAL_THRESHOLD", 0.75))
+  # Pinecone connection pool, created once per worker process
+  PINECONE_POOL_SIZE = int(os.environ.get("PINECONE_POOL_SIZE", 10))
+  PINECONE_POOL_THREADS = int(os.environ.get("PINECONE_POOL_THREADS", 1))
+  PINECONE_KEEPALIVE_IDLE = int(os.environ.get("PINECONE_KEEPALIVE_IDLE", 60))
+  # Query the index once at startup so the first request finds an open connection
+  PINECONE_WARMUP = os.environ.get("PINECONE_WARMUP", "false").lower() == "true"
+  # Model of each LLM step, a fallback for when it fails, and a deadline in seconds (0 for none)
+  PARSE_MODEL = os.environ.get("PARSE_MODEL", "gpt-4")
+  PARSE_FALLBACK_MODEL = os.environ.get("PARSE_FALLBACK_MODEL", "")
+  PARSE_DEADLINE_SECONDS = float(os.environ.get("PARSE_DEADLINE_SECONDS", 0))
+  CHAT_MODEL = os.environ.get("CHAT_MODEL", "gpt-4")
+  CHAT_FALLBACK_MODEL = os.environ.get("CHAT_FALLBACK_MODEL", "")
+  CHAT_DEADLINE_SECONDS = float(os.environ.get("CHAT_DEADLINE_SECONDS", 0))
+  # Send a duplicate request (to the fallback, if any) once a call outlasts the recent p95
+  LLM_HEDGE = os.environ.get("LLM_HEDGE", "false").lower() == "true"
+  LLM_HEDGE_MIN_DELAY_MS = float(os.environ.get("LLM_HEDGE_MIN_DELAY_MS", 250))
+  # Shortened summary embeddings (text-embedding-3 supports e.g. 512 or 256), native size when 0;
+  # must match the dimension of the Pinecone index
+  EMBED_DIMENSIONS = int(os.environ.get("EMBED_DIMENSIONS", 0))
+  # Batch embed_query calls arriving within the window into one request, disabled when 0;
+  # every request waits out the window, so it only pays off when many are in flight at once
+  EMBED_COALESCE_WINDOW_MS = float(os.environ.get("EMBED_COALESCE_WINDOW_MS", 0))
+  EMBED_COALESCE_MAX_BATCH = int(os.environ.get("EMBED_COALESCE_MAX_BATCH", 64))
+  # Summary embeddings cached in memory and, when a path is given (e.g. data/embedding_cache.sqlite3),
+  # in a SQLite file shared by the workers on a host
+  EMBED_CACHE_SIZE = int(os.environ.get("EMBED_CACHE_SIZE", 4096))
+  EMBED_CACHE_PATH = os.environ.get("EMBED_CACHE_PATH", "")
+  # Token budget for the retrieved documents in the chat_llm prompt, disabled when 0 (the default,
+  # until trimming is shown not to hurt feedback quality); chunks more similar than
+  # CONTEXT_MAX_SIMILARITY (word shingle Jaccard) to a better match are dropped
+  CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 0))
+  CONTEXT_MAX_SIMILARITY = float(os.environ.get("CONTEXT_MAX_SIMILARITY", 0.8))
+  # Connection pool of the engine the database steps share, created in each worker process;
+  # connections idle longer than DB_POOL_RECYCLE seconds are replaced, and pre-ping tests each checkout
+  DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+  DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+  DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+  DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+  DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+  # Driver for postgresql:// URIs ("psycopg2", or "psycopg" which also enables COPY for write-behind batches);
+  # psycopg prepares a statement once it has run DB_PREPARE_THRESHOLD times on a connection, never when
+  # negative (the default). Only set it on direct connections: behind Supabase's pooler (port 6543) or
+  # PgBouncer in transaction mode it fails with "prepared statement already exists"
+  DB_DRIVER = os.environ.get("DB_DRIVER", "psycopg2")
+  DB_PREPARE_THRESHOLD = int(os.environ.get("DB_PREPARE_THRESHOLD", -1))
+  # "sync", or "async" for run_query and query_feedback to await an asyncio engine (psycopg) on the
+  # ASGI server instead of running the synchronous one in a thread
+  DB_BACKEND = os.environ.get("DB_BACKEND", "sync")
+  # "pinecone", or "local" to search an exported copy of the index in process
+  RETRIEVAL_BACKEND = os.environ.get("RETRIEVAL_BACKEND", "pinecone")
+  LOCAL_INDEX_PATH = os.environ.get(
+    "LOCAL_INDEX_PATH", os.path.join(os.path.dirname(__file__), "data", "local_index")
+  )
 
 class DevelopmentConfig(Config):
   ENV = os.environ.get("FLASK_ENV", "development")
@@ -1,21 +1,73 @@
 from .chat_llm import chat_llm
-from .embed_query import embed_query
+from .embed_query import embed_query, configure_embeddings
 from .parse_query import parse_query
 from .user_query import clean_user_query
-from .pinecone import pinecone_query
+from .pinecone import pinecone_query, configure_pinecone
+from .retrieval import RetrievalBackend, LocalIndexBackend
+from .embedding_coalescer import EmbeddingCoalescer
+from .embedding_cache import EmbeddingCache
+from .context_assembler import ContextAssembler
+from .model_router import ModelRoute, ModelRouter
 from .score_query import score_query
+from .database import configure_database
 from .db_query import run_query
 from .db_query_feedback import query_feedback
 from .summarize_query import summarize_query
+from .write_behind import WriteBehindQueue
+from .result_cache import ResultCache
+from .semantic_cache import SemanticCache
+from .local_parse import ParseAgreement, local_parse
+from .chat_llm import prompt_version
+from .db_query_feedback import write_pending
+from .bulk_load import copy_pending, copy_stats, load_results
+from .instrumentation import metrics, start_request, stage_timer, timed
+from .pipeline import (
+    PipelineRegistry,
+    StreamingPipeline,
+    build_default_pipeline,
+    build_single_call_pipeline,
+    DEFAULT_PIPELINE,
+    SINGLE_CALL_PIPELINE,
+)
 
 __all__ = [
     "chat_llm",
     "embed_query",
+    "configure_embeddings",
     "parse_query",
     "clean_user_query",
     "pinecone_query",
+    "configure_pinecone",
+    "RetrievalBackend",
+    "LocalIndexBackend",
+    "EmbeddingCoalescer",
+    "EmbeddingCache",
+    "ContextAssembler",
+    "ModelRoute",
+    "ModelRouter",
     "score_query",
+    "configure_database",
     "run_query",
     "summarize_query",
-    "query_feedback"
+    "query_feedback",
+    "PipelineRegistry",
+    "build_default_pipeline",
+    "DEFAULT_PIPELINE",
+    "StreamingPipeline",
+    "build_single_call_pipeline",
+    "SINGLE_CALL_PIPELINE",
+    "WriteBehindQueue",
+    "write_pending",
+    "copy_pending",
+    "copy_stats",
+    "load_results",
+    "ResultCache",
+    "prompt_version",
+    "SemanticCache",
+    "ParseAgreement",
+    "local_parse",
+    "metrics",
+    "start_request",
+    "stage_timer",
+    "timed",
 ]
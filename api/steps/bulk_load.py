@@ -0,0 +1,191 @@
+import json
+import logging
+import threading
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
+
+from sqlalchemy import text
+
+from .database import database
+from .db_query import query_params
+from .db_query_feedback import feedback_params, write_pending
+from .instrumentation import stage_timer
+from .write_behind import PendingWrite
+
+logger = logging.getLogger(__name__)
+
+# Smaller write-behind batches are cheaper as chained INSERTs than as four
+# COPYs plus the id allocation
+COPY_MIN_RECORDS = 16
+
+# Ids of the rows other rows point at are taken from their sequences up
+# front; scores and feedback_response get theirs from the column default
+ALLOCATE_IDS = text("""
+  SELECT
+    nextval(pg_get_serial_sequence('user_query', 'id')),
+    nextval(pg_get_serial_sequence('user_query_version', 'id'))
+  FROM generate_series(1, :count)
+""")
+
+USER_QUERY_COLUMNS = ("id", "created_by")
+USER_QUERY_VERSION_COLUMNS = (
+    "id", "user_query", "task", "role", "context", "rules", "examples", "format", "user_query_id",
+)
+SCORES_COLUMNS = (
+    "total_score",
+    "max_possible_score",
+    "percentage_score",
+    "task_score",
+    "role_score",
+    "context_score",
+    "rules_score",
+    "examples_score",
+    "format_score",
+    "word_count_score",
+    "user_query_version_id",
+)
+FEEDBACK_RESPONSE_COLUMNS = ("improvements", "score", "strengths", "tags", "user_query_version_id")
+
+# Write-behind batches copy_pending wrote with COPY, and those COPY rejected
+_counters = {"copy_batches": 0, "copy_fallbacks": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(name: str) -> None:
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def copy_stats() -> Dict[str, int]:
+    with _counters_lock:
+        return dict(_counters)
+
+
+def supports_copy(connection) -> bool:
+    """COPY is streamed through psycopg (3); other drivers use the chained INSERTs."""
+    return connection.dialect.driver == "psycopg"
+
+
+def _copy(cursor, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> None:
+    with stage_timer(f"db.copy.{table}"):
+        with cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+
+
+def copy_records(records: Sequence[PendingWrite], connection) -> List[int]:
+    """
+    Write the rows of many requests with one COPY per table, inside the
+    caller's transaction on a psycopg connection. Records without feedback
+    get no feedback_response row.
+
+    Returns:
+        The user_query_version id of each record
+    """
+    if not records:
+        return []
+
+    with stage_timer("db.allocate_ids"):
+        ids = connection.execute(ALLOCATE_IDS, {"count": len(records)}).all()
+
+    users, versions, scores, feedback = [], [], [], []
+    for record, (user_query_id, version_id) in zip(records, ids):
+        params = query_params(record.parsed_response, record.score_breakdown)
+        params.update(id=version_id, user_query_id=user_query_id, user_query_version_id=version_id)
+        users.append((user_query_id, params["created_by"]))
+        versions.append(tuple(params[column] for column in USER_QUERY_VERSION_COLUMNS))
+        scores.append(tuple(params[column] for column in SCORES_COLUMNS))
+        if record.feedback is not None:
+            row = dict(feedback_params(record.feedback), user_query_version_id=version_id)
+            feedback.append(tuple(row[column] for column in FEEDBACK_RESPONSE_COLUMNS))
+
+    cursor = connection.connection.cursor()
+    try:
+        _copy(cursor, "user_query", USER_QUERY_COLUMNS, users)
+        _copy(cursor, "user_query_version", USER_QUERY_VERSION_COLUMNS, versions)
+        _copy(cursor, "scores", SCORES_COLUMNS, scores)
+        _copy(cursor, "feedback_response", FEEDBACK_RESPONSE_COLUMNS, feedback)
+    finally:
+        cursor.close()
+
+    return [version_id for _, version_id in ids]
+
+
+def _copy_batch(records: List[PendingWrite], what: str) -> bool:
+    """Write records with COPY in one transaction; False where the driver can't or COPY fails."""
+    connection = database.connect()
+    try:
+        if not supports_copy(connection):
+            return False
+        try:
+            with connection.begin():
+                copy_records(records, connection)
+        except Exception:
+            # Usually a schema or type mismatch, which the INSERTs may report per record
+            logger.exception("COPY of %d %s failed, falling back to INSERTs", len(records), what)
+            _count("copy_fallbacks")
+            return False
+        _count("copy_batches")
+        return True
+    finally:
+        connection.close()
+
+
+def copy_pending(records: List[PendingWrite]) -> int:
+    """
+    write_pending for the write-behind flusher: a batch of COPY_MIN_RECORDS
+    or more is written with COPY in one transaction. Smaller batches, other
+    drivers and a batch COPY rejects go to write_pending.
+
+    Returns:
+        Number of records that could not be written
+    """
+    if len(records) >= COPY_MIN_RECORDS and _copy_batch(records, "write-behind records"):
+        return 0
+    return write_pending(records)
+
+
+def record_from_result(result: Dict[str, Any]) -> PendingWrite:
+    """A pipeline result, with parsed_response, score_breakdown and feedback, as a PendingWrite."""
+    record = PendingWrite(
+        parsed_response=result["parsed_response"],
+        score_breakdown=result["score_breakdown"],
+    )
+    record.feedback = result.get("feedback")
+    return record
+
+
+def _batches(results: Iterable[Dict[str, Any]], size: int) -> Iterator[List[PendingWrite]]:
+    results = iter(results)
+    while True:
+        batch = [record_from_result(result) for result in islice(results, size)]
+        if not batch:
+            return
+        yield batch
+
+
+def load_results(results: Iterable[Dict[str, Any]], batch_size: int = 10000) -> int:
+    """
+    Bulk-load pipeline results, for backfills and traffic replay, committing
+    every ``batch_size`` records. Uses COPY on psycopg and the chained
+    INSERTs of write_pending elsewhere, or for a batch COPY rejects, where a
+    failed batch is retried record by record.
+
+    Returns:
+        Number of records written
+    """
+    written = 0
+    for batch in _batches(results, batch_size):
+        if _copy_batch(batch, "loaded results"):
+            written += len(batch)
+        else:
+            written += len(batch) - write_pending(batch)
+    return written
+
+
+def read_results(path: str) -> Iterator[Dict[str, Any]]:
+    """Pipeline results from a JSON Lines file, one per line."""
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
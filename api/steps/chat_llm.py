@@ -1,26 +1,51 @@
 import os
 import json
+import hashlib
 import yaml
-from typing import Dict, Any
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
 import pathlib
 from flask import current_app
 from langchain_openai import ChatOpenAI
 from langchain_core.runnables import RunnableLambda, RunnableSequence
 from langchain_core.prompts import (
     ChatPromptTemplate,
+    PromptTemplate,
     SystemMessagePromptTemplate,
     HumanMessagePromptTemplate,
 )
 
+from .feedback_stream import FeedbackStreamParser
+from .semantic_cache import SemanticCache, signature
+from .instrumentation import TokenUsageHandler
+from .model_router import ModelRouter
+
 # Constants
 BASE_DIR = pathlib.Path(__file__).parent.parent
 CONFIG_PATH = os.path.join(BASE_DIR, 'config', 'system_prompt.yaml')
 
+def layout_prompt(static: str, dynamic: Optional[str]) -> str:
+    """
+    Join a system prompt's static instructions and its per-request context,
+    static first, so every request shares the same prompt prefix and the
+    provider can serve it from its prompt cache.
+    """
+    variables = PromptTemplate.from_template(static).input_variables
+    if variables:
+        raise ValueError(f"Static prompt segment uses per-request variables: {variables}")
+    if not dynamic:
+        return static
+    return f"{static.rstrip()}\n\n{dynamic}"
+
 def load_config() -> tuple[str, Dict[str, Any]]:
     """Load system prompt and variables from YAML config file."""
     with open(CONFIG_PATH) as file:
         config = yaml.safe_load(file)
-        return config['prompt'], config.get('variables', {})
+        return layout_prompt(config['prompt'], config.get('prompt_context')), config.get('variables', {})
+
+def prompt_version() -> str:
+    """Short content hash of the system prompt config, used to key cached results."""
+    with open(CONFIG_PATH, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()[:12]
 
 def log_response(response: str) -> None:
     """Log the response content for debugging purposes."""
@@ -50,7 +75,6 @@ def transform_input(input_dict: Dict[str, Any]) -> Dict[str, Any]:
     return transformed
 
 def format_llm_response(input_dict: Dict[str, Any], response: str) -> Dict[str, Any]:
-    user_query_version_id = input_dict.get("user_query_version_id")
     """
     Format the LLM response into a structured dictionary.
     
@@ -71,41 +95,91 @@ def format_llm_response(input_dict: Dict[str, Any], response: str) -> Dict[str,
             "tags": []
         }
     
+    return format_parsed_response(input_dict, parsed_response)
+
+def format_parsed_response(input_dict: Dict[str, Any], parsed_response: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape an already parsed LLM response into the /api/chat feedback dictionary."""
     return {
         "score": input_dict.get("score", 0),
         "strengths": parsed_response.get("strengths", []),
         "improvements": parsed_response.get("improvements", []),
         "tags": parsed_response.get("tags", []),
-        "versionId": user_query_version_id
+        "versionId": input_dict.get("user_query_version_id")
     }
 
-def chat_llm() -> RunnableSequence:
-    """
-    Create a chat LLM chain for processing and formatting responses.
-    
-    Returns:
-        RunnableSequence combining input transformation and LLM processing
-    """
-    # Load configuration
-    system_prompt, _ = load_config()
-    
-    # Initialize LLM
-    llm = ChatOpenAI(
-        model="gpt-4",
+def build_llm(model: str = "gpt-4") -> ChatOpenAI:
+    """Create the chat model used for feedback generation."""
+    return ChatOpenAI(
+        model=model,
         temperature=0.7,
         api_key=os.environ.get("OPENAI_API_KEY"),
+        # Report usage, including cached prompt tokens, on streamed responses too
+        stream_usage=True,
     )
-    
-    # Create prompt template
-    prompt = ChatPromptTemplate(
+
+def build_prompt() -> ChatPromptTemplate:
+    """Create the feedback prompt template from the system prompt config."""
+    system_prompt, _ = load_config()
+
+    return ChatPromptTemplate(
         [
             SystemMessagePromptTemplate.from_template(system_prompt),
             HumanMessagePromptTemplate.from_template("{parsed_response}"),
         ]
     )
+
+def semantic_lookup(semantic_cache: Optional[SemanticCache], input_dict: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return cached feedback for a near-duplicate of this (transformed) request."""
+    embedding = input_dict.get("embedding")
+    if semantic_cache is None or embedding is None:
+        return None
+
+    sig = signature(input_dict.get("parsed_response") or {}, input_dict.get("score", 0))
+    return semantic_cache.lookup(embedding, sig)
+
+def semantic_store(semantic_cache: Optional[SemanticCache], input_dict: Dict[str, Any], result: Dict[str, Any]) -> None:
+    """Remember the feedback generated for this (transformed) request."""
+    embedding = input_dict.get("embedding")
+    if semantic_cache is None or embedding is None:
+        return
+
+    # Don't reuse a failed LLM parse, which comes back with empty lists
+    if not (result.get("strengths") or result.get("improvements")):
+        return
+
+    sig = signature(input_dict.get("parsed_response") or {}, input_dict.get("score", 0))
+    semantic_cache.add(
+        embedding,
+        sig,
+        {key: result.get(key, []) for key in ("strengths", "improvements", "tags")},
+    )
+
+def build_model(router: Optional[ModelRouter], name: str = "chat_llm") -> Any:
+    """The feedback model, routed when a model router is given."""
+    return build_llm() if router is None else router.model(name, build_llm)
+
+def chat_llm(semantic_cache: Optional[SemanticCache] = None, router: Optional[ModelRouter] = None) -> RunnableSequence:
+    """
+    Create a chat LLM chain for processing and formatting responses.
+
+    Args:
+        semantic_cache: Optional store of earlier feedback; a near-duplicate
+            request with the same component flags and score reuses it
+            instead of calling the LLM
+        router: Picks the model, deadline and hedging for the LLM call
+    
+    Returns:
+        RunnableSequence combining input transformation and LLM processing
+    """
+    llm = build_model(router)
+    prompt = build_prompt()
     
     # Create processing chain
     def process_response(input_dict: Dict[str, Any]) -> Dict[str, Any]:
+        cached = semantic_lookup(semantic_cache, input_dict)
+        if cached is not None:
+            return format_parsed_response(input_dict, cached)
+
         # Format messages
         formatted_prompt = prompt.format_messages(**input_dict)
 
@@ -113,11 +187,69 @@ def chat_llm() -> RunnableSequence:
         response = llm.invoke(formatted_prompt)
         
         # Format and return response
-        return format_llm_response(input_dict, response.content)
+        result = format_llm_response(input_dict, response.content)
+        semantic_store(semantic_cache, input_dict, result)
+        return result
+
+    async def aprocess_response(input_dict: Dict[str, Any]) -> Dict[str, Any]:
+        cached = semantic_lookup(semantic_cache, input_dict)
+        if cached is not None:
+            return format_parsed_response(input_dict, cached)
+
+        formatted_prompt = prompt.format_messages(**input_dict)
+
+        response = await llm.ainvoke(formatted_prompt)
+
+        result = format_llm_response(input_dict, response.content)
+        semantic_store(semantic_cache, input_dict, result)
+        return result
+
+    async def atransform_input(input_dict: Dict[str, Any]) -> Dict[str, Any]:
+        return transform_input(input_dict)
     
     # Combine transform and processing steps
-    transform_step = RunnableLambda(transform_input)
-    llm_chain = RunnableLambda(process_response)
+    transform_step = RunnableLambda(transform_input, afunc=atransform_input)
+    llm_chain = RunnableLambda(process_response, afunc=aprocess_response)
     full_chain = transform_step | llm_chain
     
     return full_chain
+
+def chat_llm_stream(semantic_cache: Optional[SemanticCache] = None, router: Optional[ModelRouter] = None) -> Callable[[Dict[str, Any]], Iterator[Tuple[str, Any]]]:
+    """
+    Create a streaming variant of chat_llm.
+
+    Returns:
+        Generator function yielding ("strengths" | "improvements" | "tags", item)
+        pairs as the LLM produces them, followed by a final ("feedback", dict)
+        pair in the same shape chat_llm returns
+    """
+    llm = build_model(router)
+    prompt = build_prompt()
+
+    def stream_response(input_dict: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+        transformed = transform_input(input_dict)
+
+        cached = semantic_lookup(semantic_cache, transformed)
+        if cached is not None:
+            for key in ("strengths", "improvements", "tags"):
+                for item in cached[key]:
+                    yield key, item
+            yield "feedback", format_parsed_response(transformed, cached)
+            return
+
+        formatted_prompt = prompt.format_messages(**transformed)
+
+        parser = FeedbackStreamParser()
+        config = {"callbacks": [TokenUsageHandler("chat_llm")]}
+        for chunk in llm.stream(formatted_prompt, config):
+            for key, item in parser.feed(chunk.content):
+                yield key, item
+
+        if not parser.started:
+            current_app.logger.error("Failed to parse LLM response as JSON")
+
+        result = format_parsed_response(transformed, parser.result())
+        semantic_store(semantic_cache, transformed, result)
+        yield "feedback", result
+
+    return stream_response
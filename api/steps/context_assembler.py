@@ -0,0 +1,177 @@
+import logging
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import tiktoken
+from flask import current_app
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+
+from .instrumentation import metrics
+
+SEPARATOR = "\n\n"
+
+# load_encoder also runs at startup, outside any app context
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+# Roughly one token per four characters of a word, or per punctuation mark
+_APPROXIMATE_TOKEN = re.compile(r"\s*\w{1,4}|\s*[^\w\s]|\s+")
+
+
+class ApproximateEncoder:
+    """
+    Stand-in for a tiktoken encoding when the real one can't be loaded (its
+    BPE file is downloaded on first use). Counts are close enough to keep
+    the prompt within budget, and decode(encode(text)) == text.
+    """
+
+    name = "approximate"
+
+    def encode(self, text: str) -> List[str]:
+        return _APPROXIMATE_TOKEN.findall(text)
+
+    def decode(self, tokens: Sequence[str]) -> str:
+        return "".join(tokens)
+
+
+def _shingles(text: str, size: int) -> Set[Tuple[str, ...]]:
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(a: Set[Tuple[str, ...]], b: Set[Tuple[str, ...]]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _truncate(encoder: Any, text: str, tokens: Sequence[Any], room: int) -> str:
+    cut = encoder.decode(tokens[:room])
+    # A byte-level token boundary can fall inside a multi-byte character,
+    # which decodes to U+FFFD; end at the last whole character instead
+    while cut.endswith("\ufffd") and not text.startswith(cut):
+        cut = cut[:-1]
+    return cut
+
+
+class ContextAssembler:
+    """
+    Build the ``{documents}`` context for chat_llm from the retrieved chunks,
+    which arrive best match first. A chunk whose word shingles overlap an
+    earlier one's by ``max_similarity`` (Jaccard) or more is dropped as a
+    near-duplicate. Chunks are then taken in order until ``max_tokens`` is
+    reached; the chunk that crosses the budget is cut short, provided at
+    least ``min_tokens`` of it fit, and the rest are left out.
+
+    Tokens are counted with the tiktoken encoding of ``model`` unless an
+    ``encoder`` (anything with encode and decode) is given.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 1000,
+        max_similarity: float = 0.8,
+        shingle_size: int = 3,
+        min_tokens: int = 32,
+        model: str = "gpt-4",
+        encoder: Optional[Any] = None,
+    ):
+        self.max_tokens = max_tokens
+        self.max_similarity = max_similarity
+        self.shingle_size = shingle_size
+        self.min_tokens = min_tokens
+        self.model = model
+        self._encoder = encoder
+        self._lock = threading.Lock()
+
+    def load_encoder(self) -> Any:
+        """The encoder, loading the tiktoken encoding the first time."""
+        if self._encoder is None:
+            with self._lock:
+                if self._encoder is None:
+                    try:
+                        self._encoder = tiktoken.encoding_for_model(self.model)
+                    except Exception:
+                        logger.warning(
+                            "No tiktoken encoding for %s, budgeting context with approximate token counts",
+                            self.model,
+                            exc_info=True,
+                        )
+                        self._encoder = ApproximateEncoder()
+        return self._encoder
+
+    def assemble(self, texts: Sequence[str]) -> Tuple[List[Tuple[int, str]], Dict[str, int]]:
+        """
+        Return (position, text) of the chunks to include, in their original
+        order, and counts of what was left out and the tokens saved.
+        """
+        encoder = self.load_encoder()
+        separator_tokens = len(encoder.encode(SEPARATOR))
+
+        unique: List[int] = []
+        seen: List[Set[Tuple[str, ...]]] = []
+        for position, text in enumerate(texts):
+            shingles = _shingles(text, self.shingle_size)
+            if any(_jaccard(shingles, other) >= self.max_similarity for other in seen):
+                continue
+            unique.append(position)
+            seen.append(shingles)
+
+        kept: List[Tuple[int, str]] = []
+        used = 0
+        truncated = 0
+        for position in unique:
+            tokens = encoder.encode(texts[position])
+            separator = separator_tokens if kept else 0
+            if used + separator + len(tokens) <= self.max_tokens:
+                kept.append((position, texts[position]))
+                used += separator + len(tokens)
+                continue
+
+            room = self.max_tokens - used - separator
+            if room >= self.min_tokens:
+                kept.append((position, _truncate(encoder, texts[position], tokens, room)))
+                used += separator + room
+                truncated = 1
+            break
+
+        original = len(encoder.encode(SEPARATOR.join(texts))) if texts else 0
+        return kept, {
+            "documents": len(texts),
+            "duplicates": len(texts) - len(unique),
+            "dropped": len(unique) - len(kept),
+            "truncated": truncated,
+            "tokens": used,
+            "tokens_saved": max(original - used, 0),
+        }
+
+    def apply(self, d: dict) -> dict:
+        documents: List[Document] = d.get("pinecone_results") or []
+        kept, stats = self.assemble([doc.page_content for doc in documents])
+
+        d["pinecone_results"] = [
+            Document(page_content=text, metadata=documents[position].metadata)
+            for position, text in kept
+        ]
+        d["context"] = SEPARATOR.join(text for _, text in kept)
+        d["context_stats"] = stats
+
+        metrics.add_tokens(
+            "assemble_context",
+            {"context_tokens": stats["tokens"], "context_tokens_saved": stats["tokens_saved"]},
+        )
+        current_app.logger.debug(f"Assembled context: {stats}")
+        return d
+
+
+def assemble_context(assembler: ContextAssembler) -> RunnableLambda:
+    """Trim the retrieved documents to the assembler's token budget."""
+
+    async def aassemble(d: dict) -> dict:
+        return assembler.apply(d)
+
+    return RunnableLambda(assembler.apply, afunc=aassemble)
@@ -0,0 +1,265 @@
+import asyncio
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import URL, Connection, Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from .instrumentation import metrics, stage_timer
+
+
+class Database:
+    """
+    The one SQLAlchemy engine the database steps share in a worker process.
+
+    Created lazily from SUPABASE_URI on first use, so nothing is connected
+    before gunicorn forks. A forked worker drops the parent's pooled
+    connections without closing them (they belong to the parent) and opens
+    its own. Hooks added with add_engine_hook run on every engine created,
+    e.g. to add event listeners.
+
+    A postgresql:// URI without a driver uses ``driver``. With psycopg (3)
+    a statement run ``prepare_threshold`` times on a connection becomes a
+    server-side prepared statement, so Postgres plans it once per
+    connection. None (the default) turns that off, as PgBouncer and
+    Supabase's pooler in transaction mode need; set it only for direct
+    connections.
+
+    With ``backend="async"`` the steps' async paths await an asyncio engine
+    (psycopg, or aiosqlite for SQLite) from async_engine() instead of
+    running the synchronous one in a thread. It has a pool of its own, with
+    the same settings, per event loop, as its connections belong to the
+    loop that opened them. Hooks are given its sync_engine.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        pool_timeout: float = 30,
+        pool_recycle: int = 1800,
+        pool_pre_ping: bool = True,
+        driver: str = "psycopg2",
+        prepare_threshold: Optional[int] = None,
+        backend: str = "sync",
+        uri: Optional[str] = None,
+    ):
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_recycle = pool_recycle
+        self.pool_pre_ping = pool_pre_ping
+        self.driver = driver
+        self.prepare_threshold = prepare_threshold
+        self.backend = backend
+        self.uri = uri
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._engine: Optional[Engine] = None
+        self._async_engines: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncEngine]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._hooks: List[Callable[[Engine], None]] = []
+
+    def configure(
+        self,
+        pool_size: int,
+        max_overflow: int,
+        pool_timeout: float,
+        pool_recycle: int,
+        pool_pre_ping: bool,
+        driver: str = "psycopg2",
+        prepare_threshold: Optional[int] = None,
+        backend: str = "sync",
+    ) -> None:
+        with self._lock:
+            self.pool_size = pool_size
+            self.max_overflow = max_overflow
+            self.pool_timeout = pool_timeout
+            self.pool_recycle = pool_recycle
+            self.pool_pre_ping = pool_pre_ping
+            self.driver = driver
+            self.prepare_threshold = prepare_threshold
+            self.backend = backend
+            if self._engine is not None and self._pid == os.getpid():
+                self._engine.dispose()
+            self._engine = None
+            # Any asyncio engines are left to close with their event loops
+            self._async_engines = weakref.WeakKeyDictionary()
+
+    def add_engine_hook(self, hook: Callable[[Engine], None]) -> None:
+        with self._lock:
+            self._hooks.append(hook)
+            engine = self._engine
+        if engine is not None:
+            hook(engine)
+
+    def url(self, asynchronous: bool = False) -> URL:
+        url = make_url(self.uri or os.environ.get("SUPABASE_URI"))
+        if url.get_backend_name() in ("postgresql", "postgres") and (asynchronous or "+" not in url.drivername):
+            # psycopg2 has no asyncio support, psycopg has both
+            url = url.set(drivername=f"postgresql+{'psycopg' if asynchronous else self.driver}")
+        elif url.get_backend_name() == "sqlite" and asynchronous:
+            url = url.set(drivername="sqlite+aiosqlite")
+        return url
+
+    def _engine_options(self, url: URL, poolclass) -> Dict[str, Any]:
+        options: Dict[str, Any] = {
+            "pool_pre_ping": self.pool_pre_ping,
+            "pool_recycle": self.pool_recycle,
+        }
+        if url.get_driver_name() == "psycopg":
+            options["connect_args"] = {"prepare_threshold": self.prepare_threshold}
+        # An in-memory SQLite database lives in a single connection, so it
+        # keeps SQLAlchemy's default pool
+        if url.get_backend_name() != "sqlite" or url.database not in (None, "", ":memory:"):
+            options.update(
+                poolclass=poolclass,
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_timeout=self.pool_timeout,
+            )
+        return options
+
+    def _create_engine(self) -> Engine:
+        url = self.url()
+        engine = create_engine(url, **self._engine_options(url, QueuePool))
+        for hook in self._hooks:
+            hook(engine)
+        return engine
+
+    def _create_async_engine(self) -> AsyncEngine:
+        url = self.url(asynchronous=True)
+        engine = create_async_engine(url, **self._engine_options(url, AsyncAdaptedQueuePool))
+        for hook in self._hooks:
+            hook(engine.sync_engine)
+        return engine
+
+    def _check_fork(self) -> None:
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                if self._engine is not None:
+                    # Inherited from the parent process: forget its connections
+                    # without closing them under the parent
+                    self._engine.dispose(close=False)
+                    self._engine = None
+                self._async_engines = weakref.WeakKeyDictionary()
+                self._pid = os.getpid()
+
+    def engine(self) -> Engine:
+        self._check_fork()
+        if self._engine is not None:
+            return self._engine
+
+        with self._lock:
+            if self._engine is None:
+                self._engine = self._create_engine()
+            return self._engine
+
+    def async_engine(self) -> AsyncEngine:
+        """The asyncio engine of the running event loop."""
+        self._check_fork()
+        loop = asyncio.get_running_loop()
+        engine = self._async_engines.get(loop)
+        if engine is None:
+            # Nothing awaits in between, so no other task on this loop can race us
+            engine = self._async_engines[loop] = self._create_async_engine()
+        return engine
+
+    def connect(self) -> Connection:
+        """Check a connection out of the pool, timing the wait as db.pool_checkout."""
+        engine = self.engine()
+        with stage_timer("db.pool_checkout"):
+            return engine.connect()
+
+    async def aconnect(self) -> AsyncConnection:
+        """Check a connection out of this event loop's asyncio pool, timing the wait as db.pool_checkout."""
+        engine = self.async_engine()
+        with stage_timer("db.pool_checkout"):
+            return await engine.connect()
+
+    async def aclose(self) -> None:
+        """Close the asyncio engine of the running event loop, if one was opened."""
+        engine = self._async_engines.pop(asyncio.get_running_loop(), None)
+        if engine is not None:
+            await engine.dispose()
+
+    def _pool_stats(self, pools: List[Any]) -> Dict[str, Any]:
+        size = sum(pool.size() for pool in pools)
+        capacity = size + self.max_overflow * len(pools)
+        checked_out = sum(pool.checkedout() for pool in pools)
+        return {
+            "size": size,
+            "max_overflow": self.max_overflow,
+            "idle": sum(pool.checkedin() for pool in pools),
+            "checked_out": checked_out,
+            "overflow": sum(max(pool.overflow(), 0) for pool in pools),
+            "saturation": checked_out / capacity if capacity else 0.0,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Usage of the synchronous pool and, under "async", of the asyncio
+        pools of all event loops together.
+        """
+        engine = self._engine if self._pid == os.getpid() else None
+        pool = engine.pool if engine is not None else None
+        if not isinstance(pool, QueuePool):
+            stats = {"pool": type(pool).__name__ if pool is not None else None}
+        else:
+            stats = {"pool": type(pool).__name__, **self._pool_stats([pool])}
+
+        stats["backend"] = self.backend
+        async_pools = [
+            engine.sync_engine.pool
+            for engine in list(self._async_engines.values())
+            if isinstance(engine.sync_engine.pool, QueuePool)
+        ]
+        if self._pid == os.getpid() and async_pools:
+            stats["async"] = {"engines": len(async_pools), **self._pool_stats(async_pools)}
+        return stats
+
+
+database = Database()
+
+
+def _gauge(name: str, combine: Callable) -> float:
+    # Of the synchronous and asyncio pools together
+    stats = database.stats()
+    return combine(pool.get(name, 0) for pool in (stats, stats.get("async", {})))
+
+
+metrics.add_gauge(
+    "prompy_db_pool_checked_out",
+    "Database connections currently checked out of the pool.",
+    lambda: _gauge("checked_out", sum),
+)
+metrics.add_gauge(
+    "prompy_db_pool_saturation",
+    "Share of the pool's connections, overflow included, that are checked out.",
+    lambda: _gauge("saturation", max),
+)
+
+
+def configure_database(
+    pool_size: int,
+    max_overflow: int,
+    pool_timeout: float,
+    pool_recycle: int,
+    pool_pre_ping: bool,
+    driver: str = "psycopg2",
+    prepare_threshold: Optional[int] = None,
+    backend: str = "sync",
+) -> Database:
+    """Set the connection pool the database steps use in this process."""
+    database.configure(
+        pool_size, max_overflow, pool_timeout, pool_recycle, pool_pre_ping, driver, prepare_threshold, backend
+    )
+    return database
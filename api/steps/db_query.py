@@ -1,43 +1,45 @@
-import os
+import asyncio
+from typing import Optional
 from flask import current_app
 from langchain_core.runnables import RunnableLambda
-from langchain_community.utilities import SQLDatabase
-from sqlalchemy import text
-
-db = SQLDatabase.from_uri(os.environ.get("SUPABASE_URI"))
-
-user_query_template = """
-  INSERT INTO user_query(
-    created_by
-  ) VALUES (
-    '{created_by}'
-  ) RETURNING id;
-"""
-
-user_query_version_template = """
-    INSERT INTO user_query_version(
-        user_query,
-        task,
-        role,
-        context,
-        rules,
-        examples,
-        format,
-        user_query_id
+from sqlalchemy import TextClause, text
+
+from .database import database
+from .instrumentation import stage_timer
+from .write_behind import PendingWrite, WriteBehindQueue
+
+# The three rows of one prompt in a single round trip: each INSERT takes
+# the id RETURNING'd by the one before it. Further CTEs, such as the
+# feedback_response row, can be added before the final SELECT.
+insert_query_ctes = """
+  WITH new_user_query AS (
+    INSERT INTO user_query (
+      created_by
     ) VALUES (
-        '{user_query}',
-        {task},
-        {role},
-        {context},
-        {rules},
-        {examples},
-        {format},
-        {user_query_id}
-    ) RETURNING id;
-"""
-
-scores_insert_template = """
-  INSERT INTO scores (
+      :created_by
+    ) RETURNING id
+  ), new_version AS (
+    INSERT INTO user_query_version (
+      user_query,
+      task,
+      role,
+      context,
+      rules,
+      examples,
+      format,
+      user_query_id
+    ) VALUES (
+      :user_query,
+      :task,
+      :role,
+      :context,
+      :rules,
+      :examples,
+      :format,
+      (SELECT id FROM new_user_query)
+    ) RETURNING id
+  ), new_scores AS (
+    INSERT INTO scores (
       total_score,
       max_possible_score,
       percentage_score,
@@ -49,102 +51,123 @@ scores_insert_template = """
       format_score,
       word_count_score,
       user_query_version_id
-  ) VALUES (
-      {total_score},
-      {max_possible_score},
-      {percentage_score},
-      {task_score},
-      {role_score},
-      {context_score},
-      {rules_score},
-      {examples_score},
-      {format_score},
-      {word_count_score},
-      {user_query_version_id}
-  ) RETURNING id;
-"""
-
-
-def insert_user_query(query: dict, connection):
+    ) VALUES (
+      :total_score,
+      :max_possible_score,
+      :percentage_score,
+      :task_score,
+      :role_score,
+      :context_score,
+      :rules_score,
+      :examples_score,
+      :format_score,
+      :word_count_score,
+      (SELECT id FROM new_version)
+    )
+  )"""
+
+# Bound parameters, so every request sends the same SQL text and the driver
+# can prepare it once per connection
+INSERT_QUERY = text(insert_query_ctes + "\n  SELECT id FROM new_version;")
+
+
+def query_params(parsed_response: dict, score_breakdown: dict) -> dict:
+    score_by_field = score_breakdown.get("score_by_field")
+    return {
+        "created_by": "Prompy",
+        "user_query": parsed_response.get("user_query"),
+        "task": parsed_response.get("task"),
+        "role": parsed_response.get("role"),
+        "context": parsed_response.get("context"),
+        "rules": parsed_response.get("rules"),
+        "examples": parsed_response.get("examples"),
+        "format": parsed_response.get("format"),
+        "total_score": score_breakdown.get("total_score"),
+        "max_possible_score": score_breakdown.get("max_possible_score"),
+        "percentage_score": score_breakdown.get("percentage_score"),
+        "task_score": score_by_field.get("task"),
+        "role_score": score_by_field.get("role"),
+        "context_score": score_by_field.get("context"),
+        "rules_score": score_by_field.get("rules"),
+        "examples_score": score_by_field.get("examples"),
+        "format_score": score_by_field.get("format"),
+        "word_count_score": score_by_field.get("word_count"),
+    }
+
+
+def run_query(write_behind: Optional[WriteBehindQueue] = None) -> RunnableLambda:
+    if write_behind is not None:
+        return RunnableLambda(_defer_query, afunc=_adefer_query)
+    return RunnableLambda(_run_query, afunc=_arun_query)
+
+
+def insert_query_rows(
+    parsed_response: dict,
+    score_breakdown: dict,
+    connection,
+    statement: TextClause = INSERT_QUERY,
+    **params,
+):
+    """
+    Insert the user_query, user_query_version and scores rows for one
+    prompt in one statement. ``statement`` may add CTEs of its own, which
+    take their values from ``params``.
+
+    Returns:
+        The id of the user_query_version row
+    """
     try:
-        sql = user_query_template.format(created_by=query.get("created_by"))
-        result = connection.execute(text(sql))
-        return result.scalar() 
+        with stage_timer("db.insert_query"):
+            result = connection.execute(statement, {**query_params(parsed_response, score_breakdown), **params})
+        return result.scalar()
     except Exception as e:
-        raise Exception("Failed to insert into user_query table: " + str(e))
+        raise Exception("Failed to insert into user_query tables: " + str(e))
 
 
-def insert_user_query_version(query: dict, connection, user_query_id):
+async def ainsert_query_rows(
+    parsed_response: dict,
+    score_breakdown: dict,
+    connection,
+    statement: TextClause = INSERT_QUERY,
+    **params,
+):
+    """insert_query_rows on an asyncio connection."""
     try:
-        sql = user_query_version_template.format(
-            user_query=query.get("user_query"),
-            task=str(query.get("task")),
-            role=str(query.get("role")),
-            context=str(query.get("context")),
-            rules=str(query.get("rules")),
-            examples=str(query.get("examples")),
-            format=str(query.get("format")),
-            user_query_id=user_query_id,
-        )
-        result = connection.execute(text(sql))
-        return result.scalar() 
+        with stage_timer("db.insert_query"):
+            result = await connection.execute(statement, {**query_params(parsed_response, score_breakdown), **params})
+        return result.scalar()
     except Exception as e:
-        raise Exception("Failed to insert into user_query_version table: " + str(e))
+        raise Exception("Failed to insert into user_query tables: " + str(e))
 
 
-def insert_scores_query(query: dict, connection, user_query_version_id):
-    score_by_field = query.get("score_by_field")
-    try:
-        sql = scores_insert_template.format(
-            total_score=query.get("total_score"),
-            max_possible_score=str(query.get("max_possible_score")),
-            percentage_score=str(query.get("percentage_score")),
-            task_score=str(score_by_field.get("task")),
-            role_score=str(score_by_field.get("role")),
-            context_score=str(score_by_field.get("context")),
-            rules_score=str(score_by_field.get("rules")),
-            examples_score=str(score_by_field.get("examples")),
-            format_score=str(score_by_field.get("format")),
-            word_count_score=str(score_by_field.get("word_count")),
-            user_query_version_id=user_query_version_id,
-        )
-        result = connection.execute(text(sql))
-        return result.scalar()  
-    except Exception as e:
-        raise Exception("Failed to insert into scores table: " + str(e))
+def _defer_query(d: dict):
+    # Write-behind mode: query_feedback queues these rows with the feedback
+    d["user_query_version_id"] = PendingWrite(
+        parsed_response=d.get("parsed_response"),
+        score_breakdown=d.get("score_breakdown"),
+    )
+    return d
 
 
-def run_query() -> RunnableLambda:
-    return RunnableLambda(lambda input: _run_query(input))
+async def _adefer_query(d: dict):
+    return _defer_query(d)
 
 
 def _run_query(d: dict):
-    connection = db._engine.connect()
+    connection = database.connect()
     transaction = connection.begin()
 
     try:
-        parsed_response = d.get("parsed_response")
-        score_breakdown = d.get("score_breakdown")
-
-        user_query_id = insert_user_query(
-            query={"created_by": "Prompy"}, connection=connection
-        )
-
-        user_query_version_id = insert_user_query_version(
-            query=parsed_response,
-            connection=connection,
-            user_query_id=user_query_id,
-        )
-
-        insert_scores_query(
-            query=score_breakdown,
+        user_query_version_id = insert_query_rows(
+            parsed_response=d.get("parsed_response"),
+            score_breakdown=d.get("score_breakdown"),
             connection=connection,
-            user_query_version_id=user_query_version_id,
         )
 
         d["user_query_version_id"] = user_query_version_id
 
-        transaction.commit()
+        with stage_timer("db.commit"):
+            transaction.commit()
         return d
 
     except Exception as e:
@@ -153,3 +176,30 @@ def _run_query(d: dict):
         raise Exception("Failed inserting into db: " + str(e))
     finally:
         connection.close()
+
+
+async def _arun_query(d: dict):
+    if database.backend != "async":
+        # The synchronous engine would block the event loop, so run it in a thread
+        return await asyncio.to_thread(_run_query, d)
+
+    connection = await database.aconnect()
+    transaction = await connection.begin()
+
+    try:
+        d["user_query_version_id"] = await ainsert_query_rows(
+            parsed_response=d.get("parsed_response"),
+            score_breakdown=d.get("score_breakdown"),
+            connection=connection,
+        )
+
+        with stage_timer("db.commit"):
+            await transaction.commit()
+        return d
+
+    except Exception as e:
+        await transaction.rollback()
+        current_app.logger.exception(e)
+        raise Exception("Failed inserting into db: " + str(e))
+    finally:
+        await connection.close()
@@ -1,69 +1,92 @@
+import asyncio
 import json
-import os
+import logging
+from typing import List, Optional
 from flask import current_app
 from langchain_core.runnables import RunnableLambda
 from sqlalchemy import text
-from langchain_community.utilities import SQLDatabase
 
-db = SQLDatabase.from_uri(os.environ.get("SUPABASE_URI"))
+from .database import database
+from .db_query import INSERT_QUERY, insert_query_ctes, insert_query_rows
+from .instrumentation import stage_timer
+from .write_behind import PendingWrite, WriteBehindQueue
 
-query_feedback_template = """
-    INSERT INTO feedback_response (
+FEEDBACK_RESPONSE = text("""
+  INSERT INTO feedback_response (
       improvements,
       score,
       strengths,
       tags,
       user_query_version_id
   ) VALUES (
-      ARRAY{improvements}::TEXT[],
-      {score},
-      ARRAY{strengths}::TEXT[],
-      ARRAY{tags}::TEXT[],
-      {user_query_version_id}
+      CAST(:improvements AS TEXT[]),
+      :score,
+      CAST(:strengths AS TEXT[]),
+      CAST(:tags AS TEXT[]),
+      :user_query_version_id
   );
-"""
+""")
 
+# run_query's insert with the feedback_response row as a fourth CTE, for
+# write-behind mode where the feedback is known by the time rows are written
+INSERT_QUERY_WITH_FEEDBACK = text(insert_query_ctes + """, new_feedback AS (
+    INSERT INTO feedback_response (
+      improvements,
+      score,
+      strengths,
+      tags,
+      user_query_version_id
+    ) VALUES (
+      CAST(:improvements AS TEXT[]),
+      :score,
+      CAST(:strengths AS TEXT[]),
+      CAST(:tags AS TEXT[]),
+      (SELECT id FROM new_version)
+    )
+  )
+  SELECT id FROM new_version;""")
 
-def query_feedback():
-    return RunnableLambda(lambda input: insert_response(response=input))
+# write_pending runs on the write-behind flusher thread, outside any app context
+logger = logging.getLogger(__name__)
 
 
-def format_query(template: str, data: dict, user_query_version_id: int = 1) -> str:
-    def to_sql_array(values):
-        escaped_values = []
-        for v in values:
-            escaped = v.replace("'", "''")  # Escape single quotes
-            escaped_values.append(f"'{escaped}'")
-        return f"[{', '.join(escaped_values)}]"
+def query_feedback(write_behind: Optional[WriteBehindQueue] = None):
+    if write_behind is not None:
+        async def aqueue_response(response: dict):
+            return queue_response(response, write_behind)
 
-    improvements = to_sql_array(data["improvements"])
-    strengths = to_sql_array(data["strengths"])
-    tags = to_sql_array(data["tags"])
-    score = data["score"]
+        return RunnableLambda(
+            lambda input: queue_response(response=input, write_behind=write_behind),
+            afunc=aqueue_response,
+        )
 
-    return template.format(
-        improvements=improvements,
-        strengths=strengths,
-        tags=tags,
-        score=score,
-        user_query_version_id=user_query_version_id,
+    return RunnableLambda(
+        lambda input: insert_response(response=input),
+        afunc=ainsert_response,
     )
 
 
+def feedback_params(data: dict) -> dict:
+    # The driver binds the lists as Postgres arrays, no quoting needed
+    return {
+        "improvements": list(data["improvements"]),
+        "score": data["score"],
+        "strengths": list(data["strengths"]),
+        "tags": list(data["tags"]),
+    }
+
+
 def insert_response(response: dict):
     version_id = response.pop("versionId")
-    query = format_query(
-        template=query_feedback_template,
-        data=response,
-        user_query_version_id=version_id,
-    )
+    params = dict(feedback_params(response), user_query_version_id=version_id)
 
-    connection = db._engine.connect()
+    connection = database.connect()
     transaction = connection.begin()
 
     try:
-        connection.execute(text(query))
-        transaction.commit()
+        with stage_timer("db.feedback_response"):
+            connection.execute(FEEDBACK_RESPONSE, params)
+            transaction.commit()
     except Exception as e:
         current_app.logger.exception(e)
         transaction.rollback()
@@ -72,3 +95,98 @@ def insert_response(response: dict):
         connection.close()
 
     return response
+
+
+async def ainsert_response(response: dict):
+    if database.backend != "async":
+        # The synchronous engine would block the event loop, so run it in a thread
+        return await asyncio.to_thread(insert_response, response)
+
+    version_id = response.pop("versionId")
+    params = dict(feedback_params(response), user_query_version_id=version_id)
+
+    connection = await database.aconnect()
+    transaction = await connection.begin()
+
+    try:
+        with stage_timer("db.feedback_response"):
+            await connection.execute(FEEDBACK_RESPONSE, params)
+            await transaction.commit()
+    except Exception as e:
+        current_app.logger.exception(e)
+        await transaction.rollback()
+        raise Exception("Failed to insert into response table:")
+    finally:
+        await connection.close()
+
+    return response
+
+
+def queue_response(response: dict, write_behind: WriteBehindQueue):
+    pending = response.pop("versionId")
+    if not isinstance(pending, PendingWrite):
+        raise Exception("Write-behind mode expects run_query to defer its rows")
+
+    pending.feedback = dict(response)
+
+    if not write_behind.submit(pending):
+        # Queue is full or shutting down, so write on the request path instead
+        failed = write_pending([pending])
+        if failed:
+            raise Exception("Failed to insert into response table:")
+
+    return response
+
+
+def _insert_pending(record: PendingWrite, connection):
+    if record.feedback is None:
+        # Replayed results may come without feedback, leaving only run_query's rows
+        insert_query_rows(record.parsed_response, record.score_breakdown, connection)
+        return
+
+    # One statement writes all four rows of the request
+    insert_query_rows(
+        parsed_response=record.parsed_response,
+        score_breakdown=record.score_breakdown,
+        connection=connection,
+        statement=INSERT_QUERY_WITH_FEEDBACK,
+        **feedback_params(record.feedback),
+    )
+
+
+def write_pending(records: List[PendingWrite]) -> int:
+    """
+    Write a batch of deferred requests in a single transaction, falling back
+    to one transaction per record if the batch fails so that one bad row
+    doesn't take the rest of the batch with it.
+
+    Returns:
+        Number of records that could not be written
+    """
+    connection = database.connect()
+
+    try:
+        try:
+            with connection.begin():
+                for record in records:
+                    _insert_pending(record, connection)
+            return 0
+        except Exception:
+            logger.exception("Write-behind batch of %d records failed", len(records))
+            if len(records) == 1:
+                return 1
+
+        failed = 0
+        for record in records:
+            try:
+                with connection.begin():
+                    _insert_pending(record, connection)
+            except Exception:
+                logger.exception(
+                    "Write-behind record for %r lost",
+                    record.parsed_response.get("user_query"),
+                )
+                failed += 1
+        return failed
+    finally:
+        connection.close()
@@ -1,4 +1,7 @@
 import os
+from typing import Optional, Sequence
+
+import numpy as np
 from flask import current_app
 from langchain_openai import OpenAIEmbeddings
 from langchain_core.runnables import RunnableLambda
@@ -9,25 +12,83 @@ embeddings = OpenAIEmbeddings(
 )
 
 
+def default_embeddings():
+    """The embeddings client embed_query uses when no other embedder is given."""
+    return embeddings
+
+
+def configure_embeddings(dimensions: Optional[int] = None) -> None:
+    """
+    Ask the model for ``dimensions``-long vectors instead of its native size.
+    text-embedding-3 models shorten their output natively, so the vectors
+    stay comparable; the Pinecone index must have the same dimension.
+    """
+    # Leave clients that don't support shortening alone unless asked to shorten
+    if dimensions or getattr(embeddings, "dimensions", None):
+        embeddings.dimensions = dimensions or None
+
+
+def as_vector(vector: Sequence[float]) -> np.ndarray:
+    """
+    The pipeline's representation of an embedding: one read-only float32
+    array rather than a list of boxed floats, so it can be shared between
+    steps and caches without copying. Convert with ``tolist()`` only where
+    an API needs JSON.
+    """
+    array = np.asarray(vector, dtype=np.float32)
+    if array.flags.writeable:
+        array = array.copy() if array is vector else array
+        array.setflags(write=False)
+    return array
+
+
 def log_response(res):
     current_app.logger.debug(res)
 
 
-def embed_query() -> RunnableLambda:
-    return RunnableLambda(lambda input: _embed(input))
+def embed_query(embedder=None) -> RunnableLambda:
+    """
+    Embed the summary. ``embedder`` replaces the OpenAI embeddings client, for
+    example with an EmbeddingCoalescer that batches concurrent requests.
+    """
+    if embedder is None:
+        return RunnableLambda(_embed, afunc=_aembed)
+
+    async def aembed(d: dict):
+        return await _aembed(d, embedder)
+
+    return RunnableLambda(lambda d: _embed(d, embedder), afunc=aembed)
+
+
+def _get_summary(d: dict) -> str:
+    parsed_response = d.get("parsed_response")
 
+    if "user_query" not in parsed_response:
+        raise Exception("EmbedUserQueryException")
 
-def _embed(d: dict):
+    return d.get("summary")
+
+
+def _embed(d: dict, embedder=None):
     try:
-        parsed_response = d.get("parsed_response")
-        summary = d.get("summary")
+        summary = _get_summary(d)
+
+        vector = (embedder or embeddings).embed_query(summary)
+
+        d["embedding"] = as_vector(vector)
+
+        return d
+    except Exception as e:
+        raise Exception(f"EmbedUserQueryException: {e}")
 
-        if "user_query" not in parsed_response:
-            raise Exception("EmbedUserQueryException")
 
-        vector = embeddings.embed_query(summary)
+async def _aembed(d: dict, embedder=None):
+    try:
+        summary = _get_summary(d)
+
+        vector = await (embedder or embeddings).aembed_query(summary)
 
-        d["embedding"] = vector
+        d["embedding"] = as_vector(vector)
 
         return d
     except Exception as e:
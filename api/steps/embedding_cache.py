@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from .embed_query import as_vector, default_embeddings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+  key TEXT PRIMARY KEY,
+  model TEXT NOT NULL,
+  dimension INTEGER NOT NULL,
+  vector BLOB NOT NULL,
+  created_at REAL NOT NULL
+)
+"""
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache in front of the embeddings client. Tier 1 is an in-memory
+    LRU; tier 2 is a SQLite file of float32 blobs that survives restarts and
+    is shared by the workers on a host. Both are keyed by a hash of the model
+    (and its output dimensions) and the text, so changing the model never
+    serves vectors from the old one. Vectors are returned as shared,
+    read-only float32 arrays.
+
+    ``embedder`` is what a miss falls through to, for example an
+    EmbeddingCoalescer; it defaults to the embeddings client embed_query uses.
+    ``model`` names the vectors it returns, and defaults to that client's
+    model. With no ``path`` only the in-memory tier is used.
+    """
+
+    def __init__(
+        self,
+        embedder=None,
+        maxsize: int = 4096,
+        path: Optional[str] = None,
+        model: Optional[str] = None,
+    ):
+        self.embedder = embedder
+        self.model = model
+        self.maxsize = maxsize
+        self.path = path
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "disk_errors": 0}
+
+    def _inner(self):
+        return self.embedder if self.embedder is not None else default_embeddings()
+
+    def _model(self) -> str:
+        if self.model is not None:
+            return self.model
+        client = default_embeddings()
+        return f"{getattr(client, 'model', '')}:{getattr(client, 'dimensions', None) or ''}"
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self._model()}\0{text}".encode("utf-8")).hexdigest()
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per process; SQLite connections must not cross a fork
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(_SCHEMA)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def _get_memory(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+            return vector
+
+    def _get_disk(self, key: str) -> Optional[np.ndarray]:
+        row = None
+        if self.path is not None:
+            # The disk tier has a lock of its own, so a slow read never holds up memory hits
+            with self._disk_lock:
+                try:
+                    row = self._db().execute(
+                        "SELECT vector FROM embeddings WHERE key = ?", (key,)
+                    ).fetchone()
+                except sqlite3.Error:
+                    with self._lock:
+                        self._counters["disk_errors"] += 1
+
+        with self._lock:
+            if row is None:
+                self._counters["misses"] += 1
+                return None
+            vector = np.frombuffer(row[0], dtype=np.float32)
+            self._remember(key, vector)
+            self._counters["disk_hits"] += 1
+            return vector
+
+    def _set_memory(self, key: str, vector: Sequence[float]) -> np.ndarray:
+        vector = as_vector(vector)
+        with self._lock:
+            self._remember(key, vector)
+        return vector
+
+    def _set_disk(self, key: str, vector: np.ndarray) -> None:
+        if self.path is None:
+            return
+        with self._disk_lock:
+            try:
+                with self._db() as db:
+                    db.execute(
+                        "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)",
+                        (key, self._model(), len(vector), vector.tobytes(), time.time()),
+                    )
+            except sqlite3.Error:
+                with self._lock:
+                    self._counters["disk_errors"] += 1
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        vector = self._get_memory(key)
+        if vector is None:
+            vector = self._get_disk(key)
+        return vector
+
+    def set(self, key: str, vector: Sequence[float]) -> np.ndarray:
+        vector = self._set_memory(key, vector)
+        self._set_disk(key, vector)
+        return vector
+
+    def embed_query(self, text: str) -> np.ndarray:
+        key = self.key(text)
+        vector = self.get(key)
+        if vector is None:
+            vector = self.set(key, self._inner().embed_query(text))
+        return vector
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        # SQLite reads and commits (with their busy wait) run in a thread,
+        # never on the event loop; the memory tier is looked up inline
+        key = self.key(text)
+        vector = self._get_memory(key)
+        if vector is None:
+            if self.path is None:
+                vector = self._get_disk(key)
+            else:
+                vector = await asyncio.to_thread(self._get_disk, key)
+        if vector is None:
+            vector = self._set_memory(key, await self._inner().aembed_query(text))
+            if self.path is not None:
+                await asyncio.to_thread(self._set_disk, key, vector)
+        return vector
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+            lookups = hits + self._counters["misses"]
+            return dict(
+                self._counters,
+                memory_size=len(self._memory),
+                maxsize=self.maxsize,
+                hit_ratio=hits / lookups if lookups else 0.0,
+                disk_hit_ratio=self._counters["disk_hits"] / lookups if lookups else 0.0,
+            )
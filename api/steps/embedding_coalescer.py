@@ -0,0 +1,188 @@
+import asyncio
+import bisect
+import os
+import threading
+import weakref
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .embed_query import as_vector, default_embeddings
+
+# Upper bounds of the reported batch size distribution
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class _Batch:
+    def __init__(self, full):
+        self.texts: List[str] = []
+        self.futures: List[Any] = []
+        self.full = full
+
+    def add(self, text: str, future) -> int:
+        self.texts.append(text)
+        self.futures.append(future)
+        return len(self.texts)
+
+
+class EmbeddingCoalescer:
+    """
+    Gathers embed_query calls that arrive within ``window`` seconds of each
+    other, up to ``max_batch`` of them, and sends them to the embeddings API
+    as one embed_documents request, handing each caller its vector as a
+    read-only float32 array.
+
+    The first caller of a batch leads it: it waits out the window (or until
+    the batch fills up), makes the request and resolves everyone's future.
+    Nothing runs in the background, so there is no thread to restart after
+    a fork. Threads and each event loop gather separate batches.
+
+    ``embeddings`` defaults to the model embed_query uses, looked up at
+    request time.
+    """
+
+    def __init__(self, embeddings=None, window: float = 0.005, max_batch: int = 64):
+        self.embeddings = embeddings
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._open: Optional[_Batch] = None
+        self._aopen: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _Batch]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._sizes = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self._counters = {"requests": 0, "batches": 0, "texts_sent": 0, "errors": 0, "max_batch_size": 0}
+
+    def _model(self):
+        if self.embeddings is not None:
+            return self.embeddings
+        return default_embeddings()
+
+    def _check_fork(self) -> None:
+        # A batch being gathered when the process forked has no leader in the child
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._open = None
+            self._aopen = weakref.WeakKeyDictionary()
+
+    def _join(self, text: str, make_batch, future, loop=None):
+        with self._lock:
+            self._check_fork()
+            batch = self._open if loop is None else self._aopen.get(loop)
+            leader = batch is None
+            if leader:
+                batch = make_batch()
+                if loop is None:
+                    self._open = batch
+                else:
+                    self._aopen[loop] = batch
+
+            if batch.add(text, future) >= self.max_batch:
+                self._close(batch, loop)
+                batch.full.set()
+            return batch, leader
+
+    def _close(self, batch: _Batch, loop=None) -> None:
+        if loop is None:
+            if self._open is batch:
+                self._open = None
+        elif self._aopen.get(loop) is batch:
+            del self._aopen[loop]
+
+    def _unique(self, batch: _Batch) -> List[str]:
+        # Identical summaries in one batch are only embedded once
+        return list(dict.fromkeys(batch.texts))
+
+    def _resolve(self, batch: _Batch, unique: List[str], vectors: List[List[float]]) -> None:
+        by_text = {text: as_vector(vector) for text, vector in zip(unique, vectors)}
+        for text, future in zip(batch.texts, batch.futures):
+            if not future.done():
+                future.set_result(by_text[text])
+        self._record(batch, unique)
+
+    def _fail(self, batch: _Batch, error: BaseException) -> None:
+        for future in batch.futures:
+            if not future.done():
+                future.set_exception(error)
+        with self._lock:
+            self._counters["errors"] += 1
+
+    def _abandon(self, batch: _Batch, own, loop=None) -> None:
+        # Whatever stopped the leader (cancellation included), the callers
+        # that joined its batch must not wait for it forever
+        with self._lock:
+            self._close(batch, loop)
+        if not all(future.done() for future in batch.futures):
+            own.cancel()
+            self._fail(batch, RuntimeError("Embedding batch abandoned by its leader"))
+
+    def _record(self, batch: _Batch, unique: List[str]) -> None:
+        with self._lock:
+            size = len(batch.texts)
+            self._counters["requests"] += size
+            self._counters["batches"] += 1
+            self._counters["texts_sent"] += len(unique)
+            self._counters["max_batch_size"] = max(self._counters["max_batch_size"], size)
+            self._sizes[bisect.bisect_left(BATCH_SIZE_BUCKETS, size)] += 1
+
+    def embed_query(self, text: str) -> np.ndarray:
+        future: Future = Future()
+        batch, leader = self._join(text, lambda: _Batch(threading.Event()), future)
+
+        if leader:
+            try:
+                batch.full.wait(self.window)
+                with self._lock:
+                    self._close(batch)
+
+                unique = self._unique(batch)
+                try:
+                    vectors = self._model().embed_documents(unique)
+                except Exception as e:
+                    self._fail(batch, e)
+                else:
+                    self._resolve(batch, unique, vectors)
+            finally:
+                self._abandon(batch, future)
+
+        return future.result()
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch, leader = self._join(text, lambda: _Batch(asyncio.Event()), future, loop)
+
+        if leader:
+            try:
+                try:
+                    await asyncio.wait_for(batch.full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+                with self._lock:
+                    self._close(batch, loop)
+
+                unique = self._unique(batch)
+                try:
+                    vectors = await self._model().aembed_documents(unique)
+                except Exception as e:
+                    self._fail(batch, e)
+                else:
+                    self._resolve(batch, unique, vectors)
+            finally:
+                self._abandon(batch, future, loop)
+
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            batches = self._counters["batches"]
+            labels = [f"<={bound}" for bound in BATCH_SIZE_BUCKETS] + [f">{BATCH_SIZE_BUCKETS[-1]}"]
+            return dict(
+                self._counters,
+                window_seconds=self.window,
+                max_batch=self.max_batch,
+                mean_batch_size=self._counters["requests"] / batches if batches else 0.0,
+                batch_sizes=dict(zip(labels, self._sizes)),
+            )
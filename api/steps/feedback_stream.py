@@ -0,0 +1,98 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class FeedbackStreamParser:
+    """
+    Incremental parser for the chat_llm JSON response.
+
+    Characters are fed in as the LLM produces them and every string item of a
+    top-level array (``strengths``, ``improvements``, ``tags``) is returned as
+    soon as its closing quote arrives, instead of waiting for the whole
+    document to be available to ``json.loads``. Anything outside the top-level
+    object, such as a stray ```json fence, is ignored.
+    """
+
+    def __init__(self):
+        self.values: Dict[str, Any] = {}
+        self.started = False
+        self.done = False
+        self._stack: List[str] = []
+        self._key: Optional[str] = None
+        self._expect_key = False
+        self._in_string = False
+        self._escape = False
+        self._buffer: List[str] = []
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """Consume a chunk of text, returning the (key, item) pairs it completed."""
+        items = []
+
+        for ch in chunk:
+            if self.done:
+                break
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    self._buffer.append(ch)
+                elif ch == "\\":
+                    self._escape = True
+                    self._buffer.append(ch)
+                elif ch == '"':
+                    self._in_string = False
+                    item = self._end_string()
+                    if item is not None:
+                        items.append(item)
+                else:
+                    self._buffer.append(ch)
+                continue
+
+            if ch == '"' and self._stack:
+                self._in_string = True
+                self._buffer = []
+            elif ch == "{":
+                self.started = True
+                self._stack.append(ch)
+                if len(self._stack) == 1:
+                    self._expect_key = True
+            elif ch == "[":
+                if not self._stack:
+                    continue
+                self._stack.append(ch)
+                if self._stack == ["{", "["] and self._key is not None:
+                    self.values[self._key] = []
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                    if not self._stack:
+                        self.done = True
+            elif ch == "," and self._stack == ["{"]:
+                self._expect_key = True
+
+        return items
+
+    def result(self) -> Dict[str, Any]:
+        """Return everything parsed so far in the shape json.loads would give."""
+        return dict(self.values)
+
+    def _end_string(self) -> Optional[Tuple[str, str]]:
+        raw = "".join(self._buffer)
+        try:
+            value = json.loads(f'"{raw}"', strict=False)
+        except json.JSONDecodeError:
+            value = raw
+
+        if self._stack == ["{"]:
+            if self._expect_key:
+                self._key = value
+                self._expect_key = False
+            else:
+                self.values[self._key] = value
+            return None
+
+        if self._stack == ["{", "["] and self._key is not None:
+            self.values.setdefault(self._key, []).append(value)
+            return (self._key, value)
+
+        return None
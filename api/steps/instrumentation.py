@@ -0,0 +1,258 @@
+import bisect
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+# Upper bounds, in seconds, of the exported latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class RequestTimings:
+    """Stage durations and token counts collected while serving one request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, float] = {}
+        self.tokens: Dict[str, int] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_tokens(self, usage: Dict[str, int]) -> None:
+        with self._lock:
+            for key, value in usage.items():
+                self.tokens[key] = self.tokens.get(key, 0) + value
+
+    def server_timing(self) -> str:
+        """Format the stage durations as a Server-Timing header value."""
+        with self._lock:
+            return ", ".join(
+                f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()
+            )
+
+
+# The collector for the request being served. Worker threads started by
+# RunnableParallel copy the context, so they add to the same collector.
+_current: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+def start_request() -> RequestTimings:
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def current_request() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+class LatencyHistogram:
+    """
+    Cumulative-bucket histogram for export, plus a window of recent samples
+    from which p50/p95/p99 are computed exactly.
+    """
+
+    def __init__(self, window: int = 2048):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.recent: deque = deque(maxlen=window)
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+        if error:
+            self.errors += 1
+
+    def quantiles(self) -> Dict[float, float]:
+        if not self.recent:
+            return {}
+        values = np.percentile(np.fromiter(self.recent, dtype=np.float64), [q * 100 for q in QUANTILES])
+        return dict(zip(QUANTILES, values.tolist()))
+
+
+class Metrics:
+    """Process-wide per-stage latency, error and LLM token usage metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, LatencyHistogram] = {}
+        self._tokens: Dict[Tuple[str, str], int] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def add_gauge(self, name: str, help: str, read: Callable[[], float]) -> None:
+        """Export the value ``read`` returns at scrape time as gauge ``name``."""
+        with self._lock:
+            self._gauges[name] = (help, read)
+
+    def observe(self, stage: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            histogram = self._stages.setdefault(stage, LatencyHistogram())
+            histogram.observe(seconds, error)
+
+        timings = current_request()
+        if timings is not None:
+            timings.add(stage, seconds)
+
+    def add_tokens(self, stage: str, usage: Dict[str, int]) -> None:
+        with self._lock:
+            for kind, value in usage.items():
+                key = (stage, kind)
+                self._tokens[key] = self._tokens.get(key, 0) + value
+
+        timings = current_request()
+        if timings is not None:
+            timings.add_tokens(usage)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": h.count,
+                    "errors": h.errors,
+                    "sum_seconds": h.sum,
+                    **{f"p{int(q * 100)}": v for q, v in h.quantiles().items()},
+                }
+                for stage, h in self._stages.items()
+            }
+            tokens: Dict[str, Dict[str, int]] = {}
+            for (stage, kind), value in self._tokens.items():
+                tokens.setdefault(stage, {})[kind] = value
+            return {"stages": stages, "tokens": tokens}
+
+    def render_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines: List[str] = [
+            "# HELP prompy_stage_duration_seconds Wall time of each pipeline stage.",
+            "# TYPE prompy_stage_duration_seconds histogram",
+        ]
+
+        with self._lock:
+            stages = list(self._stages.items())
+            tokens = list(self._tokens.items())
+            gauges = list(self._gauges.items())
+
+            for stage, h in stages:
+                cumulative = 0
+                for bound, count in zip(BUCKETS, h.counts):
+                    cumulative += count
+                    lines.append(
+                        f'prompy_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}'
+                    )
+                lines.append(f'prompy_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'prompy_stage_duration_seconds_sum{{stage="{stage}"}} {h.sum}')
+                lines.append(f'prompy_stage_duration_seconds_count{{stage="{stage}"}} {h.count}')
+
+            lines += [
+                "# HELP prompy_stage_duration_quantile_seconds Recent p50/p95/p99 wall time of each pipeline stage.",
+                "# TYPE prompy_stage_duration_quantile_seconds gauge",
+            ]
+            for stage, h in stages:
+                for q, value in h.quantiles().items():
+                    lines.append(
+                        f'prompy_stage_duration_quantile_seconds{{stage="{stage}",quantile="{q}"}} {value}'
+                    )
+
+            lines += [
+                "# HELP prompy_stage_errors_total Failed runs of each pipeline stage.",
+                "# TYPE prompy_stage_errors_total counter",
+            ]
+            for stage, h in stages:
+                lines.append(f'prompy_stage_errors_total{{stage="{stage}"}} {h.errors}')
+
+            lines += [
+                "# HELP prompy_llm_tokens_total LLM tokens used by each pipeline stage.",
+                "# TYPE prompy_llm_tokens_total counter",
+            ]
+            for (stage, kind), value in tokens:
+                lines.append(f'prompy_llm_tokens_total{{stage="{stage}",kind="{kind}"}} {value}')
+
+        # Read outside the lock, the callbacks may take locks of their own
+        for name, (help, read) in gauges:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {read()}"]
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time a block of code, such as a single database round trip, as a stage."""
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        metrics.observe(stage, time.perf_counter() - start, error)
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """Record the token usage reported by every LLM call made inside a stage."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        usage: Dict[str, int] = {}
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage_metadata = getattr(message, "usage_metadata", None) or {}
+                for kind in ("input_tokens", "output_tokens", "total_tokens"):
+                    if usage_metadata.get(kind):
+                        usage[kind] = usage.get(kind, 0) + usage_metadata[kind]
+                # Prompt tokens the provider served from its prompt cache
+                details = usage_metadata.get("input_token_details") or {}
+                if details.get("cache_read"):
+                    usage["cached_input_tokens"] = usage.get("cached_input_tokens", 0) + details["cache_read"]
+
+        if not usage and response.llm_output:
+            token_usage = response.llm_output.get("token_usage") or {}
+            for kind, name in (
+                ("input_tokens", "prompt_tokens"),
+                ("output_tokens", "completion_tokens"),
+                ("total_tokens", "total_tokens"),
+            ):
+                if token_usage.get(name):
+                    usage[kind] = token_usage[name]
+            details = token_usage.get("prompt_tokens_details") or {}
+            if details.get("cached_tokens"):
+                usage["cached_input_tokens"] = details["cached_tokens"]
+
+        if usage:
+            metrics.add_tokens(self.stage, usage)
+
+
+def timed(stage: str, runnable: Runnable) -> Runnable:
+    """Wrap a pipeline step so its wall time, errors and token usage are recorded."""
+    inner = runnable.with_config(callbacks=[TokenUsageHandler(stage)])
+
+    def run(d: Any, config: RunnableConfig) -> Any:
+        with stage_timer(stage):
+            return inner.invoke(d, config)
+
+    async def arun(d: Any, config: RunnableConfig) -> Any:
+        with stage_timer(stage):
+            return await inner.ainvoke(d, config)
+
+    return RunnableLambda(run, afunc=arun, name=stage)
@@ -0,0 +1,180 @@
+import re
+import threading
+from typing import Any, Dict
+
+COMPONENTS = ("task", "role", "context", "rules", "examples", "format")
+
+_TASK_VERBS = (
+    "write|create|generate|summari[sz]e|explain|list|give|draft|translate|analy[sz]e|"
+    "make|design|suggest|describe|compare|rewrite|review|plan|build|outline|help|tell|"
+    "find|classify|extract|brainstorm|edit|answer"
+)
+
+
+def _terms(alternatives: str) -> str:
+    # Whole-term match that also works for terms ending in punctuation ("rules:")
+    return rf"\b(?:{alternatives})(?!\w)"
+
+
+# (strong, weak) evidence for each component. A strong match is taken as
+# the component being present with high confidence, a weak one with less.
+_PATTERNS = {
+    "task": (
+        rf"(?:^|[.!?:]\s+)\s*(?:please\s+)?{_terms(_TASK_VERBS)}"
+        + "|" + _terms(r"i want you to|i need you to|your task is|can you|could you|would you"),
+        _terms(_TASK_VERBS) + r"|\?",
+    ),
+    "role": (
+        _terms(
+            r"you are|you're|act as|acting as|pretend to be|pretend you are|imagine you are|"
+            r"take on the role|assume the role|your role is|role:"
+        ),
+        _terms(
+            r"as an? (?:expert|professional|teacher|tutor|coach|senior|experienced)|"
+            r"as an? \w+ (?:expert|writer|engineer|consultant|analyst|developer|scientist|editor|marketer)"
+        ),
+    ),
+    "context": (
+        _terms(
+            r"context:|background:|i am (?:a|an|working|writing|trying|building)|"
+            r"i'm (?:a|an|working|writing|trying|building)|we are|"
+            r"my (?:team|company|business|class|students|audience|project|goal)|"
+            r"our (?:team|company|business|audience|product)|the audience is|for my|for our"
+        ),
+        _terms(r"because|currently|so that|in order to|since|my|our|audience|beginners?"),
+    ),
+    "rules": (
+        _terms(
+            r"must|must not|do not|don't|never|always|avoid|no more than|at most|at least|"
+            r"make sure|ensure|rules:|constraints?:|limit(?:ed)? to|without using"
+        ),
+        _terms(r"should|shouldn't|only|keep it|under \d+|less than|fewer than|maximum|minimum"),
+    ),
+    "examples": (
+        _terms(
+            r"for example|for instance|e\.g\.|example:|examples:|here is an example|"
+            r"here are some examples|sample:|input:|output:"
+        ),
+        _terms(r"such as|like this|similar to|examples?|samples?"),
+    ),
+    "format": (
+        _terms(
+            r"format|formatted|bullet points?|bullets?|numbered list|table|json|markdown|csv|yaml|"
+            r"headings?|in \d+ (?:words|sentences|paragraphs|bullets|points|lines)|"
+            r"one paragraph|step[- ]by[- ]step|outline"
+        ),
+        _terms(r"list|paragraphs?|sections?|short|brief|concise|tone|style|length"),
+    ),
+}
+
+_COMPILED = {
+    key: (re.compile(strong, re.IGNORECASE | re.MULTILINE), re.compile(weak, re.IGNORECASE))
+    for key, (strong, weak) in _PATTERNS.items()
+}
+
+STRONG_CONFIDENCE = 0.9
+WEAK_CONFIDENCE = 0.6
+
+
+class LocalParse:
+    """Result of the rule-based detector, with a confidence per component."""
+
+    def __init__(self, user_query: str, flags: Dict[str, bool], confidence: Dict[str, float]):
+        self.user_query = user_query
+        self.flags = flags
+        self.confidence = confidence
+
+    def is_confident(self, threshold: float) -> bool:
+        return min(self.confidence.values()) >= threshold
+
+    @property
+    def parsed_response(self) -> Dict[str, Any]:
+        """The same shape parse_query's LLM path produces."""
+        return {
+            "user_query": self.user_query,
+            **self.flags,
+            "word_count": len(self.user_query.split()),
+        }
+
+
+def local_parse(user_query: str) -> LocalParse:
+    """
+    Classify the prompt components with keyword/regex features.
+
+    A component with strong evidence is present with high confidence and one
+    with only weak evidence is present with low confidence. With no evidence
+    it is absent, with a confidence that falls as the prompt gets longer,
+    since long prompts are where components tend to be implicit.
+    """
+    word_count = len(user_query.split())
+    absent_confidence = 0.9 if word_count < 40 else 0.75 if word_count < 120 else 0.6
+
+    flags = {}
+    confidence = {}
+    for key in COMPONENTS:
+        strong, weak = _COMPILED[key]
+        if strong.search(user_query):
+            flags[key], confidence[key] = True, STRONG_CONFIDENCE
+        elif weak.search(user_query):
+            flags[key], confidence[key] = True, WEAK_CONFIDENCE
+        else:
+            flags[key], confidence[key] = False, absent_confidence
+
+    return LocalParse(user_query, flags, confidence)
+
+
+class ParseAgreement:
+    """
+    Running agreement between the local detector and the LLM, per component,
+    collected whenever both have classified the same prompt. Used to decide
+    whether the local fast path is safe to switch on.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.compared = 0
+        self.fast_path = 0
+        self.fallbacks = 0
+        self._components = {
+            key: {"agree": 0, "local_only": 0, "llm_only": 0} for key in COMPONENTS
+        }
+
+    def record_fast_path(self) -> None:
+        with self._lock:
+            self.fast_path += 1
+
+    def record(self, local: LocalParse, llm_parsed: Dict[str, Any], fallback: bool = False) -> None:
+        with self._lock:
+            self.compared += 1
+            if fallback:
+                self.fallbacks += 1
+            for key in COMPONENTS:
+                local_flag = bool(local.flags[key])
+                llm_flag = bool(llm_parsed.get(key))
+                if local_flag == llm_flag:
+                    self._components[key]["agree"] += 1
+                elif local_flag:
+                    self._components[key]["local_only"] += 1
+                else:
+                    self._components[key]["llm_only"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            components = {}
+            for key, counts in self._components.items():
+                components[key] = dict(
+                    counts,
+                    agreement=counts["agree"] / self.compared if self.compared else None,
+                )
+            min_agreement = min(
+                (c["agreement"] for c in components.values() if c["agreement"] is not None),
+                default=None,
+            )
+            return {
+                "compared": self.compared,
+                "fast_path": self.fast_path,
+                "fallbacks": self.fallbacks,
+                "min_component_agreement": min_agreement,
+                "components": components,
+            }
+
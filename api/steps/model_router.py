@@ -0,0 +1,338 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from .instrumentation import LatencyHistogram
+
+# Recent primary latencies the hedge delay is computed from
+HEDGE_WINDOW = 256
+# Samples needed before the p95 is trusted; until then requests aren't hedged
+HEDGE_MIN_SAMPLES = 20
+
+
+def _submit(pool: ThreadPoolExecutor, fn: Callable, *args: Any, **kwargs: Any) -> Future:
+    # Carry the request's context, such as its timings collector, into the pool thread
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class ModelRoute:
+    """
+    How one LLM step picks its model. ``secondary`` answers when the primary
+    fails and, with ``hedge``, also gets a duplicate request once the
+    primary has taken longer than its recent p95 (never sooner than
+    ``min_hedge_delay`` seconds). Without a secondary the duplicate goes to
+    the primary model. ``deadline`` bounds the whole step, in seconds.
+
+    A call that misses its deadline, or a hedge that loses, can't be
+    interrupted and keeps its pool thread until the model answers. Each step
+    has a pool of its own, so a stalled model only delays its own step, but
+    enough stalled calls to fill that pool will make its later calls miss
+    their deadline while they wait for a thread.
+    """
+
+    def __init__(
+        self,
+        primary: str = "gpt-4",
+        secondary: Optional[str] = None,
+        deadline: Optional[float] = None,
+        hedge: bool = False,
+        min_hedge_delay: float = 0.25,
+    ):
+        self.primary = primary
+        self.secondary = secondary or None
+        self.deadline = deadline or None
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+
+
+class _RouteState:
+    """Counters and recent primary latencies of one step, kept across pipeline rebuilds."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = LatencyHistogram(window=HEDGE_WINDOW)
+        self.counters = {
+            "calls": 0,
+            "errors": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "failovers": 0,
+            "deadline_exceeded": 0,
+        }
+
+
+class RoutedModel(Runnable):
+    """
+    Chat model stand-in that sends each call to the route's models. Calls are
+    made with the caller's config, so token usage callbacks still see them.
+    A hedged request that loses keeps running on the sync path (there is no
+    way to interrupt it) and is cancelled on the async path.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        route: ModelRoute,
+        primary: Runnable,
+        secondary: Optional[Runnable],
+        router: "ModelRouter",
+        state: Optional[_RouteState] = None,
+    ):
+        self.name = name
+        self.route = route
+        self.primary = primary
+        self.secondary = secondary
+        self.router = router
+        self.state = state or _RouteState()
+
+    def _count(self, *names: str) -> None:
+        with self.state.lock:
+            for name in names:
+                self.state.counters[name] += 1
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait for the primary before hedging, None until enough calls were seen."""
+        if not self.route.hedge:
+            return None
+        with self.state.lock:
+            if len(self.state.latency.recent) < HEDGE_MIN_SAMPLES:
+                return None
+            p95 = self.state.latency.quantiles()[0.95]
+        return max(p95, self.route.min_hedge_delay)
+
+    def _backup(self) -> Runnable:
+        return self.secondary if self.secondary is not None else self.primary
+
+    def _observe(self, start: float) -> None:
+        # Every completed primary call counts towards its p95, even one a hedge beat
+        with self.state.lock:
+            self.state.latency.observe(time.perf_counter() - start)
+
+    def _call_primary(self, input: Any, config: Optional[RunnableConfig], **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        result = self.primary.invoke(input, config, **kwargs)
+        self._observe(start)
+        return result
+
+    async def _acall_primary(self, input: Any, config: Optional[RunnableConfig], **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        result = await self.primary.ainvoke(input, config, **kwargs)
+        self._observe(start)
+        return result
+
+    def _backup_label(self, error: Optional[BaseException], pending: set, hedge_at: Optional[float], now: float) -> Optional[str]:
+        """Whether to send the backup request now, and why: "failover" or "hedge"."""
+        if error is not None and not pending and self.secondary is not None:
+            label = "failover"
+        elif pending and hedge_at is not None and now >= hedge_at:
+            label = "hedge"
+        else:
+            return None
+        self._count("failovers" if label == "failover" else "hedged")
+        return label
+
+    def _deadline_exceeded(self) -> TimeoutError:
+        self._count("deadline_exceeded", "errors")
+        return TimeoutError(f"{self.name} exceeded its {self.route.deadline}s deadline")
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        self._count("calls")
+
+        start = time.monotonic()
+        deadline = start + self.route.deadline if self.route.deadline else None
+        hedge_delay = self.hedge_delay()
+        hedge_at = start + hedge_delay if hedge_delay is not None else None
+
+        if deadline is None and hedge_at is None:
+            # Nothing to race against, so call on the caller's thread
+            try:
+                return self._call_primary(input, config, **kwargs)
+            except Exception:
+                if self.secondary is None:
+                    self._count("errors")
+                    raise
+                self._count("failovers")
+                try:
+                    return self.secondary.invoke(input, config, **kwargs)
+                except Exception:
+                    self._count("errors")
+                    raise
+
+        pool = self.router.executor(self.name)
+        labels: Dict[Future, str] = {_submit(pool, self._call_primary, input, config, **kwargs): "primary"}
+        pending = set(labels)
+        backed_up = False
+        error: Optional[BaseException] = None
+
+        try:
+            while True:
+                wakeups = [t for t in (deadline, None if backed_up else hedge_at) if t is not None]
+                timeout = max(min(wakeups) - time.monotonic(), 0) if wakeups else None
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if labels[future] == "hedge":
+                        self._count("hedge_wins")
+                    return result
+
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    raise self._deadline_exceeded()
+
+                label = None if backed_up else self._backup_label(error, pending, hedge_at, now)
+                if label is not None:
+                    future = _submit(pool, self._backup().invoke, input, config, **kwargs)
+                    labels[future] = label
+                    pending.add(future)
+                    backed_up = True
+
+                if not pending:
+                    self._count("errors")
+                    raise error
+        finally:
+            # Calls still queued for a thread are dropped; running ones can't be
+            for future in pending:
+                future.cancel()
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        self._count("calls")
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + self.route.deadline if self.route.deadline else None
+        hedge_delay = self.hedge_delay()
+        hedge_at = start + hedge_delay if hedge_delay is not None else None
+
+        labels: Dict[asyncio.Task, str] = {
+            asyncio.ensure_future(self._acall_primary(input, config, **kwargs)): "primary"
+        }
+        pending = set(labels)
+        backed_up = False
+        error: Optional[BaseException] = None
+
+        try:
+            while True:
+                wakeups = [t for t in (deadline, None if backed_up else hedge_at) if t is not None]
+                timeout = max(min(wakeups) - loop.time(), 0) if wakeups else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if labels[task] == "hedge":
+                        self._count("hedge_wins")
+                    return result
+
+                now = loop.time()
+                if deadline is not None and now >= deadline:
+                    raise self._deadline_exceeded()
+
+                label = None if backed_up else self._backup_label(error, pending, hedge_at, now)
+                if label is not None:
+                    task = asyncio.ensure_future(self._backup().ainvoke(input, config, **kwargs))
+                    labels[task] = label
+                    pending.add(task)
+                    backed_up = True
+
+                if not pending:
+                    self._count("errors")
+                    raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        """
+        Stream from the primary, switching to the secondary if the primary
+        fails before its first chunk. Streams aren't hedged or given a
+        deadline, since the first chunk already arrives early.
+        """
+        self._count("calls")
+        started = False
+        try:
+            for chunk in self.primary.stream(input, config, **kwargs):
+                started = True
+                yield chunk
+            return
+        except Exception:
+            if started or self.secondary is None:
+                self._count("errors")
+                raise
+
+        self._count("failovers")
+        yield from self.secondary.stream(input, config, **kwargs)
+
+
+class ModelRouter:
+    """
+    Builds the RoutedModel of each LLM step from its ModelRoute, using the
+    step's own factory (model name to runnable) so the model keeps the
+    step's settings, such as structured output. Steps without a route of
+    their own use ``default``. Each step's concurrent calls share a thread
+    pool of ``max_workers`` threads, recreated in a forked worker.
+    """
+
+    def __init__(self, routes: Optional[Dict[str, ModelRoute]] = None, default: Optional[ModelRoute] = None, max_workers: int = 32):
+        self.routes = routes or {}
+        self.default = default or ModelRoute()
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._states: Dict[str, _RouteState] = {}
+        self._pools: Dict[str, ThreadPoolExecutor] = {}
+        self._pid: Optional[int] = None
+
+    def route(self, name: str) -> ModelRoute:
+        return self.routes.get(name, self.default)
+
+    def model(self, name: str, factory: Callable[[str], Runnable]) -> RoutedModel:
+        route = self.route(name)
+        with self._lock:
+            state = self._states.setdefault(name, _RouteState())
+        return RoutedModel(
+            name,
+            route,
+            factory(route.primary),
+            factory(route.secondary) if route.secondary else None,
+            self,
+            state,
+        )
+
+    def executor(self, name: str) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pools = {}
+                self._pid = os.getpid()
+            if name not in self._pools:
+                self._pools[name] = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"model-router-{name}")
+            return self._pools[name]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            states = list(self._states.items())
+        stats = {}
+        for name, state in states:
+            route = self.route(name)
+            with state.lock:
+                p95 = state.latency.quantiles().get(0.95)
+                stats[name] = dict(
+                    state.counters,
+                    primary=route.primary,
+                    secondary=route.secondary,
+                    deadline_seconds=route.deadline,
+                    primary_p95_seconds=p95,
+                )
+        return stats
@@ -11,15 +11,24 @@ from langchain_core.prompts import (
 from langchain_core.runnables import RunnableLambda
 from langchain_core.runnables import RunnableSequence
 from langchain_core.output_parsers import StrOutputParser
+from typing import Optional
 
+from .local_parse import ParseAgreement, local_parse
+from .model_router import ModelRouter
 
-llm = ChatOpenAI(
-    model="gpt-4",
-    temperature=0.7,
-    api_key=os.environ.get("OPENAI_API_KEY"),
-    top_p=1.0,
-    # prediction ?
-)
+
+def build_llm(model: str = "gpt-4") -> ChatOpenAI:
+    """Create the chat model that parses the prompt's components."""
+    return ChatOpenAI(
+        model=model,
+        temperature=0.7,
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        top_p=1.0,
+        # prediction ?
+    )
+
+
+llm = build_llm()
 
 code = """
   {{
@@ -79,7 +88,32 @@ def handle_response(chat_response):
     return {"parsed_response": parsed_response}
 
 
-def parse_query() -> RunnableSequence:
+async def ahandle_exception(d: dict):
+    return handle_exception(d)
+
+
+async def ahandle_response(chat_response):
+    return handle_response(chat_response)
+
+
+def parse_query(
+    mode: str = "llm",
+    threshold: float = 0.75,
+    agreement: Optional[ParseAgreement] = None,
+    router: Optional[ModelRouter] = None,
+) -> RunnableSequence:
+    """
+    Create the parse step.
+
+    Args:
+        mode: "llm" always asks GPT-4. "local" uses the rule-based detector
+            and only asks GPT-4 when any component's confidence is below
+            ``threshold``. "shadow" asks GPT-4 but also runs the detector so
+            the agreement report fills up before "local" is switched on.
+        threshold: Minimum per-component confidence for the local fast path
+        agreement: Collects local vs LLM agreement whenever both ran
+        router: Picks the model, deadline and hedging for the LLM call
+    """
     prompt = ChatPromptTemplate(
         [
             SystemMessagePromptTemplate.from_template(system_prompt),
@@ -87,10 +121,55 @@ def parse_query() -> RunnableSequence:
         ]
     )
 
-    return (
+    model = llm if router is None else router.model("parse_query", build_llm)
+
+    llm_chain = (
         prompt
-        | llm
+        | model
         | StrOutputParser()
-        | RunnableLambda(lambda chat_response: handle_response(chat_response))
-        | RunnableLambda(lambda query: handle_exception(query))
+        | RunnableLambda(handle_response, afunc=ahandle_response)
+        | RunnableLambda(handle_exception, afunc=ahandle_exception)
     )
+
+    if mode == "llm":
+        return llm_chain
+
+    if mode not in ("local", "shadow"):
+        raise ValueError(f"Unknown parse mode: {mode}")
+
+    def local_result(d: dict):
+        clean_query = d.get("clean_query")
+        if not clean_query:
+            return None, None
+
+        local = local_parse(clean_query)
+        if mode == "local" and local.is_confident(threshold):
+            if agreement is not None:
+                agreement.record_fast_path()
+            return local, {"parsed_response": local.parsed_response}
+
+        return local, None
+
+    def compare(local, result: dict):
+        if agreement is not None and local is not None:
+            agreement.record(local, result["parsed_response"], fallback=mode == "local")
+
+    def route(d: dict):
+        local, result = local_result(d)
+        if result is not None:
+            return result
+
+        result = llm_chain.invoke(d)
+        compare(local, result)
+        return result
+
+    async def aroute(d: dict):
+        local, result = local_result(d)
+        if result is not None:
+            return result
+
+        result = await llm_chain.ainvoke(d)
+        compare(local, result)
+        return result
+
+    return RunnableLambda(route, afunc=aroute)
@@ -1,60 +1,217 @@
+import asyncio
 import os
+import socket
+import threading
+import weakref
+from typing import Any, Dict, Optional
 from langchain_core.runnables import RunnableLambda
 from langchain_core.documents import Document
 from flask import current_app
-from pinecone import Pinecone
+from pinecone import Pinecone, PineconeAsyncio
+
+from .retrieval import PineconeBackend, RetrievalBackend
+
+
+def _keep_alive_options(idle: int, interval: int = 60, count: int = 4):
+    # TCP keep-alive on pooled connections so idle ones aren't dropped by
+    # NAT/load balancers between requests
+    options = [
+        (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options += [
+            (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count),
+        ]
+    return options
+
+
+class IndexHandle:
+    """
+    One Pinecone client and index handle per worker process, so requests
+    reuse pooled keep-alive connections to the index host instead of paying
+    client setup and a TLS handshake each time.
+
+    Created lazily on first use and again after a fork, since the parent's
+    sockets must not be shared with a child. The asyncio index is kept per
+    event loop, as its HTTP session is bound to the loop it was created on.
+    """
+
+    def __init__(self, pool_size: int = 10, pool_threads: int = 1, keep_alive_idle: int = 60):
+        self.pool_size = pool_size
+        self.pool_threads = pool_threads
+        self.keep_alive_idle = keep_alive_idle
+        # Resolved lazily for the asyncio client, which addresses indexes by host
+        self.host = os.environ.get("PINECONE_INDEX_HOST")
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._index = None
+        self._async_indexes: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def configure(self, pool_size: int, pool_threads: int, keep_alive_idle: int) -> None:
+        with self._lock:
+            self.pool_size = pool_size
+            self.pool_threads = pool_threads
+            self.keep_alive_idle = keep_alive_idle
+            self._index = None
+
+    def _check_fork(self) -> None:
+        # Drop handles inherited from the parent process
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._index = None
+                self._async_indexes = weakref.WeakKeyDictionary()
+                self._pid = os.getpid()
+
+    def index(self):
+        self._check_fork()
+        if self._index is not None:
+            return self._index
+
+        with self._lock:
+            if self._index is None:
+                pc = Pinecone(
+                    api_key=os.environ.get("PINECONE_API_KEY"),
+                    pool_threads=self.pool_threads,
+                )
+                pc.openapi_config.socket_options = _keep_alive_options(self.keep_alive_idle)
+                self._index = pc.Index(
+                    os.environ.get("PINECONE_INDEX_NAME"),
+                    pool_threads=self.pool_threads,
+                    connection_pool_maxsize=self.pool_size,
+                )
+            return self._index
+
+    async def aindex(self):
+        self._check_fork()
+        loop = asyncio.get_running_loop()
+        index = self._async_indexes.get(loop)
+        if index is not None:
+            return index
+
+        pc = PineconeAsyncio(api_key=os.environ.get("PINECONE_API_KEY"))
+        try:
+            if self.host is None:
+                description = await pc.describe_index(os.environ.get("PINECONE_INDEX_NAME"))
+                self.host = description.host
+            index = pc.IndexAsyncio(host=self.host, connection_pool_maxsize=self.pool_size)
+        finally:
+            await pc.close()
+
+        # Another request on this loop may have opened one in the meantime
+        existing = self._async_indexes.setdefault(loop, index)
+        if existing is not index:
+            await index.close()
+        return existing
+
+    async def aclose(self) -> None:
+        """Close the asyncio index of the running event loop, if one was opened."""
+        index = self._async_indexes.pop(asyncio.get_running_loop(), None)
+        if index is not None:
+            await index.close()
+
+    def warm_up(self) -> Dict[str, Any]:
+        """
+        Open the pooled connection and run one query so the first request
+        doesn't pay for the TLS handshake. Returns the index stats.
+        """
+        index = self.index()
+        stats = index.describe_index_stats()
+        dimension = stats.dimension
+        index.query(vector=[1.0] + [0.0] * (dimension - 1), top_k=1)
+        return {"dimension": dimension, "total_vector_count": stats.total_vector_count}
+
+
+index_handle = IndexHandle()
+default_backend = PineconeBackend(index_handle)
+
+
+def configure_pinecone(pool_size: int, pool_threads: int, keep_alive_idle: int) -> IndexHandle:
+    """Set the connection pool used by pinecone_query in this process."""
+    index_handle.configure(pool_size, pool_threads, keep_alive_idle)
+    return index_handle
 
 def log_response(res):
     current_app.logger.debug(res)
 
-def pinecone_query():
-    return RunnableLambda(_query_pinecone)
+def pinecone_query(backend: Optional[RetrievalBackend] = None):
+    """
+    Retrieve the documents closest to the prompt embedding. Uses the pooled
+    Pinecone index unless another backend, such as LocalIndexBackend, is given.
+    """
+    backend = backend or default_backend
 
-def _query_pinecone(d: dict):
+    def query(d: dict):
+        return _query_pinecone(d, backend)
+
+    async def aquery(d: dict):
+        return await _aquery_pinecone(d, backend)
+
+    return RunnableLambda(query, afunc=aquery)
+
+def _validate_input(d: dict):
+    embedding = d.get("embedding")
+    if embedding is None:
+        raise Exception("Missing 'embedding' in input dictionary")
+
+    parsed_response = d.get("parsed_response")
+    if parsed_response is None:
+        raise Exception("Missing 'parsed_response' in input dictionary")
+
+    return embedding
+
+def _apply_matches(d: dict, query_response):
+    # Convert Pinecone matches to LangChain Document objects
+    results = []
+    for match in query_response.matches:
+        if match.metadata and 'text' in match.metadata:
+            doc = Document(
+                page_content=match.metadata.get('text', ''),
+                metadata={k: v for k, v in match.metadata.items() if k != 'text'}
+            )
+            results.append(doc)
+
+    # Format the results for the next step
+    context = "\n\n".join([doc.page_content for doc in results])
+
+    log_response(f"Found {len(results)} relevant documents")
+
+    d["pinecone_results"] = results
+    d["context"] = context
+    return d
+
+def _log_error(e: Exception):
+    current_app.logger.error(f"Pinecone error details: {str(e)}")
+    current_app.logger.error(f"Error type: {type(e).__name__}")
+
+def _query_pinecone(d: dict, backend: RetrievalBackend = default_backend):
     try:
-            
-        embedding = d.get("embedding")
-        if embedding is None:
-            raise Exception("Missing 'embedding' in input dictionary")
-            
-        parsed_response = d.get("parsed_response")
-        if parsed_response is None:
-            raise Exception("Missing 'parsed_response' in input dictionary")
-
-        # Initialize Pinecone client using the new API
-        pc = Pinecone(api_key=os.environ.get("PINECONE_API_KEY"))
-        
-        # Get a reference to the index
-        index = pc.Index(os.environ.get("PINECONE_INDEX_NAME"))
-        
-        # Query Pinecone directly with the embedding
-        query_response = index.query(
-            vector=embedding,
-            top_k=3,
-            include_metadata=True
-        )
-        
-        # Convert Pinecone matches to LangChain Document objects
-        results = []
-        for match in query_response.matches:
-            if match.metadata and 'text' in match.metadata:
-                doc = Document(
-                    page_content=match.metadata.get('text', ''),
-                    metadata={k: v for k, v in match.metadata.items() if k != 'text'}
-                )
-                results.append(doc)
-                
-        # Format the results for the next step
-        context = "\n\n".join([doc.page_content for doc in results])
-        
-        log_response(f"Found {len(results)} relevant documents from Pinecone")
-
-        d["pinecone_results"] = results
-        d["context"] = context
-        return d
-        
+        embedding = _validate_input(d)
+
+        # Query the index directly with the embedding
+        query_response = backend.query(embedding, top_k=3)
+
+        return _apply_matches(d, query_response)
+
+    except Exception as e:
+        _log_error(e)
+        raise Exception(f"PineconeQueryException: {str(e)}")
+
+async def _aquery_pinecone(d: dict, backend: RetrievalBackend = default_backend):
+    try:
+        embedding = _validate_input(d)
+
+        query_response = await backend.aquery(embedding, top_k=3)
+
+        return _apply_matches(d, query_response)
+
     except Exception as e:
-        current_app.logger.error(f"Pinecone error details: {str(e)}")
-        current_app.logger.error(f"Error type: {type(e).__name__}")
+        _log_error(e)
         raise Exception(f"PineconeQueryException: {str(e)}")
-    
\ No newline at end of file
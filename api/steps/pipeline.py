@@ -0,0 +1,272 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from langchain_core.runnables import Runnable, RunnableLambda, RunnableParallel
+
+from .user_query import clean_user_query
+from .parse_query import parse_query
+from .summarize_query import summarize_query
+from .score_query import score_query
+from .db_query import run_query
+from .embed_query import embed_query
+from .pinecone import pinecone_query
+from .retrieval import RetrievalBackend
+from .context_assembler import ContextAssembler, assemble_context
+from .model_router import ModelRouter
+from .chat_llm import chat_llm, chat_llm_stream, transform_input
+from .db_query_feedback import query_feedback
+from .write_behind import WriteBehindQueue
+from .result_cache import ResultCache
+from .semantic_cache import SemanticCache
+from .local_parse import ParseAgreement
+from .single_call import prepare_single_call, review_query, format_review
+from .instrumentation import stage_timer, timed
+
+DEFAULT_PIPELINE = "default"
+SINGLE_CALL_PIPELINE = "single_call"
+
+
+def _fork(d: dict) -> dict:
+    # Each branch gets its own copy so the steps' in-place writes don't race
+    return dict(d)
+
+
+async def _afork(d: dict) -> dict:
+    return _fork(d)
+
+
+def _join(branches: dict) -> dict:
+    d = branches["retrieval"]
+    d["user_query_version_id"] = branches["persistence"]["user_query_version_id"]
+    return d
+
+
+async def _ajoin(branches: dict) -> dict:
+    return _join(branches)
+
+
+def persist_and_retrieve(persistence: Runnable, retrieval: Runnable) -> Runnable:
+    """
+    Run the Postgres writes and the embedding/vector search side by side and
+    join their outputs, since retrieval only needs the summary and not the
+    user_query_version_id the writes produce.
+    """
+    fork = RunnableLambda(_fork, afunc=_afork)
+
+    return RunnableParallel(
+        persistence=fork | persistence,
+        retrieval=fork | retrieval,
+    ) | RunnableLambda(_join, afunc=_ajoin)
+
+
+def retrieval_steps(
+    retrieval_backend: Optional[RetrievalBackend] = None,
+    embedder: Optional[Any] = None,
+    context_assembler: Optional[ContextAssembler] = None,
+) -> Runnable:
+    """Embed the summary, find the closest documents and, optionally, trim them to a token budget."""
+    steps = (
+        timed("embed_query", embed_query(embedder))
+        | timed("pinecone_query", pinecone_query(retrieval_backend))
+    )
+    if context_assembler is not None:
+        steps = steps | timed("assemble_context", assemble_context(context_assembler))
+    return steps
+
+
+def build_default_pipeline(
+    write_behind: Optional[WriteBehindQueue] = None,
+    result_cache: Optional[ResultCache] = None,
+    semantic_cache: Optional[SemanticCache] = None,
+    parse_mode: str = "llm",
+    parse_threshold: float = 0.75,
+    parse_agreement: Optional[ParseAgreement] = None,
+    retrieval_backend: Optional[RetrievalBackend] = None,
+    embedder: Optional[Any] = None,
+    context_assembler: Optional[ContextAssembler] = None,
+    model_router: Optional[ModelRouter] = None,
+) -> Runnable:
+    """
+    Build the standard /api/chat step chain. With a write-behind queue the
+    database writes are queued for the background flusher instead of being
+    made on the request path, and with a result cache repeated prompts are
+    answered without running anything after clean_user_query. A semantic
+    cache lets chat_llm reuse feedback given to a near-duplicate prompt.
+    See parse_query for the parse modes. Retrieval goes to Pinecone unless
+    another retrieval backend is given, and ``embedder`` stands in for the
+    OpenAI embeddings client (see embed_query). A context assembler keeps
+    the retrieved documents within a token budget, and a model router
+    picks the model, deadline and hedging of each LLM call.
+    """
+    steps = (
+        timed("parse_query", parse_query(parse_mode, parse_threshold, parse_agreement, model_router))
+        | timed("summarize_query", summarize_query())
+        | timed("score_query", score_query())
+        | persist_and_retrieve(
+            timed("run_query", run_query(write_behind)),
+            retrieval_steps(retrieval_backend, embedder, context_assembler),
+        )
+        | timed("chat_llm", chat_llm(semantic_cache, model_router))
+        | timed("query_feedback", query_feedback(write_behind))
+    )
+
+    if result_cache is not None:
+        steps = result_cache.wrap(steps)
+
+    return timed("clean_user_query", clean_user_query()) | steps
+
+
+def build_single_call_pipeline(
+    write_behind: Optional[WriteBehindQueue] = None,
+    result_cache: Optional[ResultCache] = None,
+    retrieval_backend: Optional[RetrievalBackend] = None,
+    embedder: Optional[Any] = None,
+    context_assembler: Optional[ContextAssembler] = None,
+    model_router: Optional[ModelRouter] = None,
+) -> Runnable:
+    """
+    Build the /api/chat chain that makes one LLM call instead of two: a
+    structured-output request returns the component flags together with the
+    feedback, and score_query then computes the score locally. Retrieval
+    embeds the prompt itself, since the summary needs the flags.
+    """
+    steps = (
+        prepare_single_call()
+        | retrieval_steps(retrieval_backend, embedder, context_assembler)
+        | timed("review_query", review_query(model_router))
+        | timed("score_query", score_query())
+        | timed("run_query", run_query(write_behind))
+        | format_review()
+        | timed("query_feedback", query_feedback(write_behind))
+    )
+
+    if result_cache is not None:
+        steps = result_cache.wrap(steps)
+
+    return timed("clean_user_query", clean_user_query()) | steps
+
+
+class StreamingPipeline:
+    """
+    The /api/chat pipeline split at the points where a streaming response
+    can emit something: the score is known once score_query has run, the
+    feedback items arrive while chat_llm is generating, and persistence is
+    left until after the stream has been delivered.
+    """
+
+    def __init__(
+        self,
+        write_behind: Optional[WriteBehindQueue] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        parse_mode: str = "llm",
+        parse_threshold: float = 0.75,
+        parse_agreement: Optional[ParseAgreement] = None,
+        retrieval_backend: Optional[RetrievalBackend] = None,
+        embedder: Optional[Any] = None,
+        context_assembler: Optional[ContextAssembler] = None,
+        model_router: Optional[ModelRouter] = None,
+    ):
+        self.scoring = (
+            timed("clean_user_query", clean_user_query())
+            | timed("parse_query", parse_query(parse_mode, parse_threshold, parse_agreement, model_router))
+            | timed("summarize_query", summarize_query())
+            | timed("score_query", score_query())
+        )
+        self.retrieval = retrieval_steps(retrieval_backend, embedder, context_assembler)
+        self.feedback = chat_llm_stream(semantic_cache, model_router)
+        self.persistence = timed("run_query", run_query(write_behind))
+        self.feedback_persistence = timed("query_feedback", query_feedback(write_behind))
+
+    def events(self, query: str, state: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+        """
+        Yield (event, payload) pairs for a prompt. The scored pipeline dict and
+        the final feedback are left in ``state`` for ``persist``.
+        """
+        d = self.scoring.invoke({"input": query})
+        yield "score", {"score": transform_input(d)["score"]}
+
+        d = self.retrieval.invoke(d)
+        state["pipeline"] = d
+
+        # Includes the time the client takes to read each event
+        with stage_timer("chat_llm"):
+            for key, value in self.feedback(d):
+                if key == "feedback":
+                    state["feedback"] = value
+                    value = {k: v for k, v in value.items() if k != "versionId"}
+                yield key, value
+
+    def persist(self, state: Dict[str, Any]) -> None:
+        """Write the query, scores and feedback of a completed stream."""
+        d = self.persistence.invoke(state["pipeline"])
+        feedback = dict(state["feedback"], versionId=d["user_query_version_id"])
+        self.feedback_persistence.invoke(feedback)
+
+
+class CompiledPipeline:
+    """A built pipeline plus the bookkeeping needed to report on its reuse."""
+
+    def __init__(self, name: str, runnable: Any, build_seconds: float):
+        self.name = name
+        self.runnable = runnable
+        self.build_seconds = build_seconds
+        self.uses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "build_seconds": self.build_seconds,
+            "uses": self.uses,
+            # Time that would have been spent rebuilding the chain per request
+            "saved_seconds": self.build_seconds * max(self.uses - 1, 0),
+        }
+
+
+class PipelineRegistry:
+    """
+    Holds one compiled pipeline per variant name so the step chain, prompt
+    templates and LLM clients are built once per process rather than once
+    per request.
+    """
+
+    def __init__(self):
+        self._builders: Dict[str, Callable[[], Any]] = {}
+        self._compiled: Dict[str, CompiledPipeline] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, builder: Callable[[], Any]) -> None:
+        with self._lock:
+            self._builders[name] = builder
+            self._compiled.pop(name, None)
+
+    def names(self) -> list[str]:
+        return list(self._builders)
+
+    def build(self, name: str) -> CompiledPipeline:
+        with self._lock:
+            compiled = self._compiled.get(name)
+            if compiled is not None:
+                return compiled
+
+            if name not in self._builders:
+                raise KeyError(f"Unknown pipeline: {name}")
+
+            start = time.perf_counter()
+            runnable = self._builders[name]()
+            compiled = CompiledPipeline(name, runnable, time.perf_counter() - start)
+            self._compiled[name] = compiled
+            return compiled
+
+    def build_all(self) -> None:
+        for name in self.names():
+            self.build(name)
+
+    def get(self, name: str = DEFAULT_PIPELINE) -> Any:
+        compiled = self.build(name)
+        with self._lock:
+            compiled.uses += 1
+        return compiled.runnable
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: c.stats() for name, c in self._compiled.items()}
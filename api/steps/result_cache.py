@@ -0,0 +1,100 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from langchain_core.runnables import Runnable, RunnableLambda
+
+
+def normalize_query(clean_query: str) -> str:
+    """Collapse whitespace so trivially different pastes share a cache entry."""
+    return " ".join(clean_query.split())
+
+
+class ResultCache:
+    """
+    LRU cache with a TTL for whole-pipeline results, keyed on the cleaned
+    prompt and the system prompt version so a prompt change never serves
+    feedback generated under the old instructions.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, version: str = ""):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = version
+        self._entries: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def key(self, clean_query: str) -> str:
+        payload = f"{self.version}\0{normalize_query(clean_query)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+
+            expires_at, result = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._counters["expirations"] += 1
+                self._counters["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return copy.deepcopy(result)
+
+    def set(self, key: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return dict(
+                self._counters,
+                size=len(self._entries),
+                maxsize=self.maxsize,
+                hit_ratio=self._counters["hits"] / lookups if lookups else 0.0,
+            )
+
+    def wrap(self, runnable: Runnable) -> Runnable:
+        """
+        Put the cache in front of a runnable that takes the clean_user_query
+        output. On a hit the runnable, and with it every LLM, embedding,
+        Pinecone and database call, is skipped.
+        """
+
+        def cacheable(result: Dict[str, Any]) -> bool:
+            # Don't pin a failed LLM parse, which comes back with empty lists
+            return bool(result.get("strengths") or result.get("improvements"))
+
+        def lookup(d: Dict[str, Any]) -> Dict[str, Any]:
+            key = self.key(d["clean_query"])
+            result = self.get(key)
+            if result is None:
+                result = runnable.invoke(d)
+                if cacheable(result):
+                    self.set(key, result)
+            return result
+
+        async def alookup(d: Dict[str, Any]) -> Dict[str, Any]:
+            key = self.key(d["clean_query"])
+            result = self.get(key)
+            if result is None:
+                result = await runnable.ainvoke(d)
+                if cacheable(result):
+                    self.set(key, result)
+            return result
+
+        return RunnableLambda(lookup, afunc=alookup)
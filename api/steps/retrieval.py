@@ -0,0 +1,198 @@
+import json
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+
+class Match:
+    """One retrieved document, in the shape of a Pinecone query match."""
+
+    def __init__(self, id: str, score: float, metadata: Optional[Dict[str, Any]] = None):
+        self.id = id
+        self.score = score
+        self.metadata = metadata
+
+    def __repr__(self) -> str:
+        return f"Match(id={self.id!r}, score={self.score:.4f})"
+
+
+class QueryResult:
+    def __init__(self, matches: List[Match]):
+        self.matches = matches
+
+
+class RetrievalBackend(ABC):
+    """
+    Where pinecone_query finds the documents closest to the prompt embedding.
+    Implementations return an object with a ``matches`` list whose items
+    carry ``id``, ``score`` and ``metadata``, as a Pinecone query does.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def query(self, embedding: Sequence[float], top_k: int) -> Any:
+        ...
+
+    @abstractmethod
+    async def aquery(self, embedding: Sequence[float], top_k: int) -> Any:
+        ...
+
+
+class PineconeBackend(RetrievalBackend):
+    """
+    Query the Pinecone index through a pooled, per-process index handle.
+    The client serialises vectors to JSON, so this is where the pipeline's
+    float32 array becomes a list.
+    """
+
+    name = "pinecone"
+
+    def __init__(self, handle):
+        self.handle = handle
+
+    @staticmethod
+    def _values(embedding: Sequence[float]) -> List[float]:
+        return np.asarray(embedding, dtype=np.float32).tolist()
+
+    def query(self, embedding: Sequence[float], top_k: int) -> Any:
+        return self.handle.index().query(
+            vector=self._values(embedding), top_k=top_k, include_metadata=True
+        )
+
+    async def aquery(self, embedding: Sequence[float], top_k: int) -> Any:
+        index = await self.handle.aindex()
+        return await index.query(
+            vector=self._values(embedding), top_k=top_k, include_metadata=True
+        )
+
+
+class LocalIndexBackend(RetrievalBackend):
+    """
+    Exact nearest-neighbour search over an exported copy of the index, held
+    in process. Embeddings are stored L2-normalised in a float32 .npy file
+    that is memory-mapped, so cosine similarity is one matrix-vector product
+    and worker processes share the pages through the OS cache. Metadata is
+    one JSON object per line, in the same row order.
+    """
+
+    name = "local"
+
+    def __init__(self, path: str):
+        self.path = path
+        # Read every file from the directory ``path`` points at now, even if
+        # write_local_index swaps in a new one meanwhile
+        root = os.path.realpath(path)
+
+        with open(os.path.join(root, MANIFEST_FILE)) as file:
+            self.manifest = json.load(file)
+
+        self.embeddings = np.load(os.path.join(root, EMBEDDINGS_FILE), mmap_mode="r")
+
+        self.ids: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        with open(os.path.join(root, METADATA_FILE)) as file:
+            for line in file:
+                record = json.loads(line)
+                self.ids.append(record["id"])
+                self.metadata.append(record.get("metadata") or {})
+
+        if self.embeddings.ndim != 2 or self.embeddings.shape[0] != len(self.ids):
+            raise ValueError(
+                f"Local index at {path} has {self.embeddings.shape[0]} embeddings "
+                f"but {len(self.ids)} metadata records"
+            )
+
+    @property
+    def dimension(self) -> int:
+        return int(self.embeddings.shape[1])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def query(self, embedding: Sequence[float], top_k: int) -> QueryResult:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        if vector.shape[0] != self.dimension:
+            raise ValueError(
+                f"Embedding has {vector.shape[0]} dimensions, the local index {self.dimension}"
+            )
+
+        norm = np.linalg.norm(vector)
+        if norm == 0 or len(self) == 0:
+            return QueryResult([])
+
+        scores = self.embeddings @ (vector / norm)
+        top_k = min(top_k, len(self))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+
+        return QueryResult(
+            [Match(self.ids[i], float(scores[i]), dict(self.metadata[i])) for i in best]
+        )
+
+    async def aquery(self, embedding: Sequence[float], top_k: int) -> QueryResult:
+        # In memory, so nothing to wait on
+        return self.query(embedding, top_k)
+
+
+def write_local_index(
+    path: str,
+    ids: Sequence[str],
+    embeddings: Any,
+    metadata: Iterable[Optional[Dict[str, Any]]],
+    **manifest: Any,
+) -> Dict[str, Any]:
+    """
+    Write an index in the LocalIndexBackend format. The files are written to
+    a new directory next to ``path``, and ``path`` is a symlink that is
+    repointed at it with one atomic rename, so a running worker never sees
+    a half-written or missing index. The directory it pointed at before is
+    then removed.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+        raise ValueError("Expected one embedding row per id")
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = matrix / norms
+
+    manifest = dict(manifest, count=len(ids), dimension=int(matrix.shape[1]), normalized=True)
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f".{os.path.basename(path)}-", dir=parent)
+
+    np.save(os.path.join(staging, EMBEDDINGS_FILE), matrix)
+    with open(os.path.join(staging, METADATA_FILE), "w") as file:
+        for id, meta in zip(ids, metadata):
+            file.write(json.dumps({"id": id, "metadata": meta or {}}) + "\n")
+    with open(os.path.join(staging, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file, indent=2)
+
+    _swap(path, staging)
+    return manifest
+
+
+def _swap(path: str, directory: str) -> None:
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+
+    link = f"{directory}.link"
+    os.symlink(os.path.basename(directory), link)
+    if os.path.isdir(path) and not os.path.islink(path):
+        # An index written as a plain directory can't be replaced by a
+        # symlink in one step; move it aside this once
+        previous = f"{directory}.old"
+        os.rename(path, previous)
+    os.replace(link, path)
+
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
@@ -20,7 +20,7 @@ def get_word_count_score(query_word_count, weight):
 
 
 def score_query() -> RunnableLambda:
-    return RunnableLambda(lambda input: _score(input))
+    return RunnableLambda(_score, afunc=_ascore)
 
 
 def _score(d: dict):
@@ -76,3 +76,7 @@ def _score(d: dict):
     except Exception as e:
         current_app.logger.exception(e)
         raise e
+
+
+async def _ascore(d: dict):
+    return _score(d)
@@ -0,0 +1,100 @@
+import copy
+import threading
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+COMPONENTS = ("task", "role", "context", "rules", "examples", "format")
+
+
+def signature(parsed_response: Dict[str, Any], score: int) -> int:
+    """Pack the component flags and the 0-10 score bucket into one integer."""
+    bits = 0
+    for i, key in enumerate(COMPONENTS):
+        if parsed_response.get(key):
+            bits |= 1 << i
+    return bits | (int(score) << len(COMPONENTS))
+
+
+class SemanticCache:
+    """
+    Fixed-capacity, in-process store of chat_llm feedback indexed by the
+    summary embedding. A lookup returns the feedback of the most similar
+    earlier request whose component flags and score bucket match, provided
+    it is within ``max_distance`` cosine distance.
+
+    Embeddings are kept L2-normalised in a float32 matrix so a lookup is a
+    single matrix-vector product. Once full, the oldest entry is overwritten.
+    """
+
+    def __init__(self, capacity: int = 2048, max_distance: float = 0.03):
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self._matrix: Optional[np.ndarray] = None
+        self._signatures = np.full(capacity, -1, dtype=np.int32)
+        self._values: list[Optional[Dict[str, Any]]] = [None] * capacity
+        self._next = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0}
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        return vector / norm
+
+    def lookup(self, embedding: Sequence[float], sig: int) -> Optional[Dict[str, Any]]:
+        vector = self._normalize(embedding)
+
+        with self._lock:
+            if (
+                vector is None
+                or self._size == 0
+                or self._matrix.shape[1] != vector.shape[0]
+            ):
+                self._counters["misses"] += 1
+                return None
+
+            similarities = self._matrix[: self._size] @ vector
+            similarities[self._signatures[: self._size] != sig] = -np.inf
+            best = int(np.argmax(similarities))
+
+            if similarities[best] < 1.0 - self.max_distance:
+                self._counters["misses"] += 1
+                return None
+
+            self._counters["hits"] += 1
+            return copy.deepcopy(self._values[best])
+
+    def add(self, embedding: Sequence[float], sig: int, value: Dict[str, Any]) -> None:
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                # First entry, or the embedding model changed dimensions
+                self._matrix = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+                self._signatures.fill(-1)
+                self._next = 0
+                self._size = 0
+
+            self._matrix[self._next] = vector
+            self._signatures[self._next] = sig
+            self._values[self._next] = copy.deepcopy(value)
+            self._next = (self._next + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+            self._counters["stores"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return dict(
+                self._counters,
+                size=self._size,
+                capacity=self.capacity,
+                hit_ratio=self._counters["hits"] / lookups if lookups else 0.0,
+            )
@@ -0,0 +1,109 @@
+from typing import Any, Dict, List, Optional
+
+import yaml
+from langchain_core.prompts import (
+    ChatPromptTemplate,
+    SystemMessagePromptTemplate,
+    HumanMessagePromptTemplate,
+)
+from langchain_core.runnables import RunnableLambda, RunnableSequence
+from pydantic import BaseModel, Field
+
+from .chat_llm import CONFIG_PATH, build_llm, format_parsed_response, layout_prompt, transform_input
+from .model_router import ModelRouter
+
+COMPONENTS = ("task", "role", "context", "rules", "examples", "format")
+
+
+class PromptReview(BaseModel):
+    """Components found in the user's prompt and Prompy's feedback on it."""
+
+    task: bool = Field(description="The prompt gives the LLM a task to complete")
+    role: bool = Field(description="The prompt gives the LLM a role to assume")
+    context: bool = Field(description="The prompt provides context or background")
+    rules: bool = Field(description="The prompt sets rules for the LLM to follow")
+    examples: bool = Field(description="The prompt includes examples")
+    format: bool = Field(description="The prompt specifies a response format")
+    strengths: List[str] = Field(description="Things Prompy loves about the prompt")
+    improvements: List[str] = Field(description="Friendly suggestions for improvement")
+    tags: List[str] = Field(description="1-3 short topic descriptors")
+
+
+def load_single_call_prompt() -> str:
+    """Load the combined parse-and-feedback system prompt from the YAML config."""
+    with open(CONFIG_PATH) as file:
+        config = yaml.safe_load(file)
+        return layout_prompt(config["single_call_prompt"], config.get("single_call_context"))
+
+
+def _prepare(d: dict):
+    # Retrieval runs before the components are known, so embed the prompt itself
+    clean_query = d.get("clean_query")
+    d["parsed_response"] = {
+        "user_query": clean_query,
+        "word_count": len(clean_query.split()),
+    }
+    d["summary"] = clean_query
+    return d
+
+
+async def _aprepare(d: dict):
+    return _prepare(d)
+
+
+def prepare_single_call() -> RunnableLambda:
+    """Shape the clean_user_query output for embed_query and pinecone_query."""
+    return RunnableLambda(_prepare, afunc=_aprepare)
+
+
+def _apply_review(d: dict, review: PromptReview):
+    values = review.model_dump()
+    d["parsed_response"].update({key: values[key] for key in COMPONENTS})
+    d["review"] = {key: values[key] for key in ("strengths", "improvements", "tags")}
+    return d
+
+
+def review_query(router: Optional[ModelRouter] = None) -> RunnableLambda:
+    """
+    Create the single structured-output LLM call that replaces the separate
+    parse_query and chat_llm calls. It fills in the component flags on
+    ``parsed_response`` and leaves the feedback in ``review``. A model
+    router picks the model, deadline and hedging for the call.
+    """
+    def build_review_llm(model: str = "gpt-4"):
+        return build_llm(model).with_structured_output(PromptReview, method="function_calling")
+
+    llm = build_review_llm() if router is None else router.model("review_query", build_review_llm)
+    prompt = ChatPromptTemplate(
+        [
+            SystemMessagePromptTemplate.from_template(load_single_call_prompt()),
+            HumanMessagePromptTemplate.from_template("{clean_query}"),
+        ]
+    )
+
+    def review(d: dict):
+        messages = prompt.format_messages(
+            documents=d.get("context", ""), clean_query=d["clean_query"]
+        )
+        return _apply_review(d, llm.invoke(messages))
+
+    async def areview(d: dict):
+        messages = prompt.format_messages(
+            documents=d.get("context", ""), clean_query=d["clean_query"]
+        )
+        return _apply_review(d, await llm.ainvoke(messages))
+
+    return RunnableLambda(review, afunc=areview)
+
+
+def _format(d: Dict[str, Any]) -> Dict[str, Any]:
+    return format_parsed_response(transform_input(d), d["review"])
+
+
+async def _aformat(d: Dict[str, Any]) -> Dict[str, Any]:
+    return _format(d)
+
+
+def format_review() -> RunnableSequence:
+    """Produce the same output shape as chat_llm from the single-call review."""
+    return RunnableLambda(_format, afunc=_aformat)
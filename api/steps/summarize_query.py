@@ -46,7 +46,7 @@ def _construct_summary(parsed_response: dict) -> str:
     return summary
 
 def summarize_query():
-    return RunnableLambda(_summarize)
+    return RunnableLambda(_summarize, afunc=_asummarize)
 
 def _summarize(d: dict):
     try:
@@ -69,4 +69,6 @@ def _summarize(d: dict):
         
     except Exception as e:
         raise Exception(f"SummarizeQueryException: {str(e)}")
-    
\ No newline at end of file
+
+async def _asummarize(d: dict):
+    return _summarize(d)
@@ -12,7 +12,7 @@ class UserQueryException(ValueError):
 
 
 def clean_user_query() -> RunnableLambda:
-    return RunnableLambda(lambda input: _clean_query(input))
+    return RunnableLambda(_clean_query, afunc=_aclean_query)
 
 
 def _clean_query(d: dict):
@@ -33,3 +33,7 @@ def _clean_query(d: dict):
         raise UserQueryException("Invalid user prompt")
 
     return {"clean_query": user_query}
+
+
+async def _aclean_query(d: dict):
+    return _clean_query(d)
@@ -0,0 +1,161 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+_STOP = object()
+
+
+class PendingWrite:
+    """
+    The rows one request needs persisted. In write-behind mode run_query
+    returns one of these in place of a database id, and query_feedback
+    attaches the feedback and queues it.
+    """
+
+    def __init__(self, parsed_response: dict, score_breakdown: dict):
+        self.parsed_response = parsed_response
+        self.score_breakdown = score_breakdown
+        self.feedback: Optional[dict] = None
+
+
+class WriteBehindQueue:
+    """
+    Bounded in-process queue drained by a background thread that hands
+    batches of PendingWrite records to ``write_batch``, one transaction per
+    batch. ``write_batch`` returns how many records it failed to write.
+
+    ``submit`` blocks for at most ``put_timeout`` seconds when the queue is
+    full and then returns False, leaving the caller to write synchronously.
+    That pushes the cost of a slow database back onto requests instead of
+    letting the backlog grow without bound.
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[List[PendingWrite]], int],
+        maxsize: int = 1000,
+        batch_size: int = 50,
+        flush_interval: float = 0.5,
+        put_timeout: float = 0.05,
+        logger=None,
+    ):
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.logger = logger
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._closed = False
+        self._counters = {
+            "submitted": 0,
+            "rejected": 0,
+            "written": 0,
+            "failed": 0,
+            "batches": 0,
+        }
+        atexit.register(self.close)
+
+    def _ensure_started(self) -> None:
+        # Started lazily, and again after a fork, since threads don't survive fork
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._pid is not None and self._pid != os.getpid():
+                # The parent's queued items belong to the parent
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="write-behind-flusher", daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, record: PendingWrite) -> bool:
+        """Queue a record, returning False if the caller must write it itself."""
+        if self._closed:
+            return False
+
+        self._ensure_started()
+
+        try:
+            self._queue.put(record, timeout=self.put_timeout)
+        except queue.Full:
+            self._count("rejected")
+            return False
+
+        self._count("submitted")
+        return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stop accepting records and wait for queued ones to be written."""
+        if self._closed:
+            return
+
+        self._closed = True
+        if self._thread is None or self._pid != os.getpid():
+            return
+
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            # The flusher is stuck with a full queue; give up rather than hang at exit
+            if self.logger is not None:
+                self.logger.error(
+                    "Write-behind flusher did not drain, %d records not written",
+                    self._queue.qsize(),
+                )
+            return
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._counters, queued=self._queue.qsize())
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += n
+
+    def _run(self) -> None:
+        stopping = False
+
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+
+    def _flush(self, batch: List[PendingWrite]) -> None:
+        try:
+            failed = self.write_batch(batch) or 0
+            self._count("written", len(batch) - failed)
+            self._count("failed", failed)
+        except Exception as e:
+            self._count("failed", len(batch))
+            if self.logger is not None:
+                self.logger.exception(e)
+        finally:
+            self._count("batches")
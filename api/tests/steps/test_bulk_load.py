@@ -0,0 +1,180 @@
+from unittest.mock import MagicMock, patch
+
+from api.steps.bulk_load import (
+    ALLOCATE_IDS,
+    COPY_MIN_RECORDS,
+    copy_pending,
+    copy_records,
+    copy_stats,
+    load_results,
+)
+from api.steps.db_query import INSERT_QUERY
+from api.steps.write_behind import PendingWrite
+
+FEEDBACK = {"improvements": ["Add a role"], "score": 7, "strengths": ["It's clear"], "tags": []}
+
+
+def _result(expected_score_output, feedback=FEEDBACK):
+    return {**expected_score_output, "feedback": feedback}
+
+
+def _record(expected_score_output, feedback=FEEDBACK):
+    record = PendingWrite(expected_score_output["parsed_response"], expected_score_output["score_breakdown"])
+    record.feedback = feedback
+    return record
+
+
+def _psycopg_connection(count):
+    """A connection whose COPYs are recorded as {table: [rows]}."""
+    connection = MagicMock()
+    connection.dialect.driver = "psycopg"
+    connection.execute.return_value.all.return_value = [(100 + i, 200 + i) for i in range(count)]
+
+    copied = {}
+
+    def copy(statement):
+        table = statement.split()[1]
+        block = MagicMock()
+        block.__enter__.return_value.write_row.side_effect = lambda row: copied.setdefault(table, []).append(row)
+        return block
+
+    connection.connection.cursor.return_value.copy.side_effect = copy
+    return connection, copied
+
+
+class TestCopyRecords:
+
+    def test_rows_are_copied_with_allocated_ids(self, expected_score_output):
+        """Test that one id allocation and one COPY per table write every record"""
+        connection, copied = _psycopg_connection(2)
+        records = [_record(expected_score_output), _record(expected_score_output, feedback=None)]
+
+        version_ids = copy_records(records, connection)
+
+        assert version_ids == [200, 201]
+        assert connection.execute.call_args.args == (ALLOCATE_IDS, {"count": 2})
+        assert copied["user_query"] == [(100, "Prompy"), (101, "Prompy")]
+        assert copied["user_query_version"][0] == (
+            200, "Create a prompt that helps summarize scientific papers", True, True, False, True, False, False, 100,
+        )
+        assert [row[-1] for row in copied["scores"]] == [200, 201]
+        assert copied["scores"][0][0] == 13
+        # The record without feedback gets no feedback_response row
+        assert copied["feedback_response"] == [(["Add a role"], 7, ["It's clear"], [], 200)]
+
+
+class TestCopyPending:
+
+    @patch("api.steps.bulk_load.write_pending", return_value=0)
+    @patch("api.steps.bulk_load.database")
+    def test_large_batches_use_copy(self, mock_database, mock_write_pending, expected_score_output):
+        """Test that a write-behind batch of COPY_MIN_RECORDS or more is copied"""
+        connection, copied = _psycopg_connection(COPY_MIN_RECORDS)
+        mock_database.connect.return_value = connection
+
+        assert copy_pending([_record(expected_score_output)] * COPY_MIN_RECORDS) == 0
+
+        assert len(copied["feedback_response"]) == COPY_MIN_RECORDS
+        mock_write_pending.assert_not_called()
+
+    @patch("api.steps.bulk_load.write_pending", return_value=0)
+    @patch("api.steps.bulk_load.database")
+    def test_small_batches_use_inserts(self, mock_database, mock_write_pending, expected_score_output):
+        """Test that a small batch skips the COPY overhead"""
+        records = [_record(expected_score_output)] * 2
+
+        assert copy_pending(records) == 0
+
+        mock_database.connect.assert_not_called()
+        mock_write_pending.assert_called_once_with(records)
+
+    @patch("api.steps.bulk_load.write_pending", return_value=1)
+    @patch("api.steps.bulk_load.database")
+    def test_rejected_copy_falls_back_to_inserts(self, mock_database, mock_write_pending, expected_score_output):
+        """Test that a batch COPY rejects is retried through write_pending"""
+        connection, _ = _psycopg_connection(COPY_MIN_RECORDS)
+        connection.connection.cursor.return_value.copy.side_effect = Exception("bad row")
+        mock_database.connect.return_value = connection
+        records = [_record(expected_score_output)] * COPY_MIN_RECORDS
+
+        fallbacks = copy_stats()["copy_fallbacks"]
+
+        with patch("api.steps.bulk_load.logger") as mock_logger:
+            assert copy_pending(records) == 1
+
+        mock_write_pending.assert_called_once_with(records)
+        connection.close.assert_called_once()
+        mock_logger.exception.assert_called_once()
+        assert copy_stats()["copy_fallbacks"] == fallbacks + 1
+
+
+class TestLoadResults:
+
+    @patch("api.steps.bulk_load.write_pending", return_value=0)
+    @patch("api.steps.bulk_load.database")
+    def test_results_are_copied_in_batches(self, mock_database, mock_write_pending, expected_score_output):
+        """Test that results are committed batch by batch"""
+        connections = []
+
+        def connect():
+            connection, copied = _psycopg_connection(2)
+            connections.append(copied)
+            return connection
+
+        mock_database.connect.side_effect = connect
+
+        written = load_results((_result(expected_score_output) for _ in range(5)), batch_size=2)
+
+        assert written == 5
+        assert [len(copied["user_query"]) for copied in connections] == [2, 2, 1]
+        mock_write_pending.assert_not_called()
+
+    @patch("api.steps.bulk_load.write_pending", return_value=1)
+    @patch("api.steps.bulk_load.database")
+    def test_other_drivers_use_inserts(self, mock_database, mock_write_pending, expected_score_output):
+        """Test that results are still loaded where COPY isn't available"""
+        mock_database.connect.return_value.dialect.driver = "pysqlite"
+
+        written = load_results([_result(expected_score_output)] * 3, batch_size=10)
+
+        assert written == 2
+        [call] = mock_write_pending.call_args_list
+        assert len(call.args[0]) == 3
+
+    @patch("api.steps.bulk_load.write_pending", return_value=1)
+    @patch("api.steps.bulk_load.database")
+    def test_rejected_copy_falls_back_to_inserts(self, mock_database, mock_write_pending, expected_score_output):
+        """Test that a batch COPY rejects is inserted instead and the count covers every batch"""
+        connections = []
+
+        def connect():
+            connection, _ = _psycopg_connection(2)
+            if not connections:
+                connection.connection.cursor.return_value.copy.side_effect = Exception("bad row")
+            connections.append(connection)
+            return connection
+
+        mock_database.connect.side_effect = connect
+        fallbacks = copy_stats()["copy_fallbacks"]
+
+        with patch("api.steps.bulk_load.logger") as mock_logger:
+            written = load_results((_result(expected_score_output) for _ in range(4)), batch_size=2)
+
+        assert written == 3
+        [call] = mock_write_pending.call_args_list
+        assert len(call.args[0]) == 2
+        assert all(connection.close.called for connection in connections)
+        mock_logger.exception.assert_called_once()
+        assert copy_stats()["copy_fallbacks"] == fallbacks + 1
+
+    @patch("api.steps.db_query_feedback.database")
+    @patch("api.steps.bulk_load.database")
+    def test_results_without_feedback_use_inserts(self, mock_database, mock_feedback_database, expected_score_output):
+        """Test that results without feedback still get their query and score rows on other drivers"""
+        mock_database.connect.return_value.dialect.driver = "pysqlite"
+        connection = mock_feedback_database.connect.return_value
+
+        written = load_results([_result(expected_score_output, feedback=None)] * 2, batch_size=10)
+
+        assert written == 2
+        assert [call.args[0] for call in connection.execute.call_args_list] == [INSERT_QUERY, INSERT_QUERY]
@@ -1,4 +1,13 @@
-from api.steps.chat_llm import chat_llm
+import pytest
+import yaml
+
+from api.steps.chat_llm import CONFIG_PATH, build_prompt, chat_llm, layout_prompt
+
+
+def load_prompt_segment(name):
+    with open(CONFIG_PATH) as file:
+        return yaml.safe_load(file)[name]
+
 
 class TestChatLLM:
     
@@ -12,4 +21,20 @@ class TestChatLLM:
         assert 'strengths' in result
         assert 'improvements' in result
         assert 'tags' in result
-        
\ No newline at end of file
+        
+    def test_system_prompt_starts_with_a_static_prefix(self):
+        """Test that per-request values come after the static instructions"""
+        prompt = build_prompt()
+        static = load_prompt_segment("prompt").replace("{{", "{").replace("}}", "}")
+
+        first = prompt.format_messages(score=2, documents="Give it a role.", parsed_response="{}")
+        second = prompt.format_messages(score=9, documents="Ask for a format.", parsed_response="{}")
+
+        assert first[0].content.startswith(static.rstrip())
+        assert second[0].content.startswith(static.rstrip())
+        assert first[0].content != second[0].content
+
+    def test_layout_rejects_variables_in_the_static_segment(self):
+        """Test that a per-request value can't be moved back into the prefix"""
+        with pytest.raises(ValueError):
+            layout_prompt("The prompt scored {score}.", "{documents}")
@@ -0,0 +1,114 @@
+from unittest.mock import patch
+
+from flask import Flask
+from langchain_core.documents import Document
+
+from api.steps.context_assembler import ApproximateEncoder, ContextAssembler
+
+
+class WordEncoder:
+    """One token per whitespace-separated word."""
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+class ByteEncoder:
+    """One token per UTF-8 byte, decoded like tiktoken does."""
+
+    name = "bytes"
+
+    def encode(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode(self, tokens):
+        return bytes(tokens).decode("utf-8", errors="replace")
+
+
+ROLE = "Give the model a role so it answers as an expert in the field would"
+ROLE_AGAIN = "Give the model a role so it answers as an expert in the field would."
+TASK = "State the task in one sentence before adding any context or rules"
+FORMAT = "Ask for a specific output format such as a list or a table of results"
+
+
+class TestContextAssembler:
+
+    def test_near_duplicates_are_dropped(self):
+        """Test that a chunk overlapping a better match is left out"""
+        assembler = ContextAssembler(max_tokens=100, encoder=WordEncoder())
+
+        kept, stats = assembler.assemble([ROLE, ROLE_AGAIN, TASK])
+
+        assert [position for position, _ in kept] == [0, 2]
+        assert stats["duplicates"] == 1
+        assert stats["tokens_saved"] == len(ROLE_AGAIN.split())
+
+    def test_budget_keeps_score_order_and_cuts_the_last_chunk(self):
+        """Test that chunks are taken best first until the budget runs out"""
+        assembler = ContextAssembler(max_tokens=20, min_tokens=4, encoder=WordEncoder())
+
+        kept, stats = assembler.assemble([ROLE, TASK, FORMAT])
+
+        assert [position for position, _ in kept] == [0, 1]
+        assert kept[0][1] == ROLE
+        assert kept[1][1] == " ".join(TASK.split()[:5])
+        assert stats["tokens"] == 20
+        assert stats["truncated"] == 1
+        assert stats["dropped"] == 1
+
+    def test_short_remainder_is_left_out(self):
+        """Test that a chunk is dropped rather than cut below min_tokens"""
+        assembler = ContextAssembler(max_tokens=16, min_tokens=4, encoder=WordEncoder())
+
+        kept, stats = assembler.assemble([ROLE, TASK])
+
+        assert [position for position, _ in kept] == [0]
+        assert stats["truncated"] == 0
+
+    def test_cut_never_splits_a_character(self):
+        """Test that a budget ending inside a multi-byte character cuts before it"""
+        assembler = ContextAssembler(max_tokens=4, min_tokens=1, encoder=ByteEncoder())
+
+        kept, _ = assembler.assemble(["café au lait"])
+
+        assert kept == [(0, "caf")]
+
+    def test_missing_tokenizer_falls_back_with_a_warning(self):
+        """Test that counting with the approximate encoder is logged as a warning"""
+        assembler = ContextAssembler(model="gpt-4")
+
+        with patch("api.steps.context_assembler.tiktoken.encoding_for_model", side_effect=OSError("offline")), \
+                patch("api.steps.context_assembler.logger") as mock_logger:
+            encoder = assembler.load_encoder()
+
+        assert isinstance(encoder, ApproximateEncoder)
+        mock_logger.warning.assert_called_once()
+
+    def test_apply_rebuilds_context_and_results(self):
+        """Test that the pipeline dict gets the trimmed context and documents"""
+        assembler = ContextAssembler(max_tokens=100, encoder=WordEncoder())
+        d = {
+            "pinecone_results": [
+                Document(page_content=ROLE, metadata={"source": "a"}),
+                Document(page_content=ROLE_AGAIN, metadata={"source": "b"}),
+                Document(page_content=TASK, metadata={"source": "c"}),
+            ]
+        }
+
+        with Flask(__name__).app_context():
+            d = assembler.apply(d)
+
+        assert d["context"] == f"{ROLE}\n\n{TASK}"
+        assert [doc.metadata["source"] for doc in d["pinecone_results"]] == ["a", "c"]
+        assert d["context_stats"]["documents"] == 3
+
+    def test_approximate_encoder_round_trips(self):
+        """Test that the fallback encoder decodes back to the original text"""
+        encoder = ApproximateEncoder()
+        tokens = encoder.encode(FORMAT)
+
+        assert encoder.decode(tokens) == FORMAT
+        assert len(FORMAT) / 6 < len(tokens) < len(FORMAT) / 2
@@ -0,0 +1,157 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+
+from api.steps.database import Database
+from api.steps.instrumentation import metrics
+
+
+def file_database(tmp_path, **kwargs):
+    return Database(uri=f"sqlite:///{tmp_path / 'test.db'}", **kwargs)
+
+
+class TestDatabase:
+
+    def test_engine_is_created_once_per_process(self, tmp_path):
+        """Test that repeated lookups share one engine"""
+        database = file_database(tmp_path)
+
+        assert database.engine() is database.engine()
+
+    def test_engine_uses_the_configured_pool(self, tmp_path):
+        """Test that the pool settings reach the engine's pool"""
+        database = file_database(tmp_path)
+        database.configure(pool_size=3, max_overflow=2, pool_timeout=5, pool_recycle=60, pool_pre_ping=True)
+
+        pool = database.engine().pool
+        assert isinstance(pool, QueuePool)
+        assert pool.size() == 3
+        assert pool._max_overflow == 2
+        assert pool._recycle == 60
+        assert pool._pre_ping
+
+    def test_in_memory_sqlite_keeps_its_default_pool(self):
+        """Test that an in-memory database isn't given a QueuePool"""
+        database = Database(uri="sqlite://")
+
+        with database.connect() as connection:
+            assert connection.execute(text("SELECT 1")).scalar() == 1
+        assert not isinstance(database.engine().pool, QueuePool)
+        assert database.stats() == {"pool": "SingletonThreadPool", "backend": "sync"}
+
+    def test_engine_is_recreated_after_fork(self, tmp_path):
+        """Test that a forked worker drops the parent's connections without closing them"""
+        database = file_database(tmp_path)
+        parent = database.engine()
+
+        with patch.object(parent, "dispose", wraps=parent.dispose) as dispose, \
+                patch("api.steps.database.os.getpid", return_value=-1):
+            child = database.engine()
+
+        assert child is not parent
+        dispose.assert_called_once_with(close=False)
+
+    def test_hooks_run_on_every_engine(self, tmp_path):
+        """Test that a hook sees the current engine and the ones created later"""
+        database = file_database(tmp_path)
+        first = database.engine()
+        hook = MagicMock()
+
+        database.add_engine_hook(hook)
+        database.configure(pool_size=2, max_overflow=0, pool_timeout=5, pool_recycle=60, pool_pre_ping=False)
+        second = database.engine()
+
+        assert [c.args[0] for c in hook.call_args_list] == [first, second]
+
+    def test_stats_report_pool_saturation(self, tmp_path):
+        """Test that checked out connections count towards saturation"""
+        database = file_database(tmp_path, pool_size=2, max_overflow=2)
+
+        with database.connect(), database.connect(), database.connect():
+            stats = database.stats()
+
+        assert stats["checked_out"] == 3
+        assert stats["overflow"] == 1
+        assert stats["saturation"] == 0.75
+        assert database.stats()["checked_out"] == 0
+
+    def test_checkout_wait_is_timed(self, tmp_path):
+        """Test that connect() records the pool checkout as a stage"""
+        database = file_database(tmp_path)
+        before = metrics.snapshot()["stages"].get("db.pool_checkout", {}).get("count", 0)
+
+        with database.connect():
+            pass
+
+        assert metrics.snapshot()["stages"]["db.pool_checkout"]["count"] == before + 1
+
+    def test_pool_gauges_are_exported(self):
+        """Test that the shared database's pool gauges appear in the Prometheus output"""
+        output = metrics.render_prometheus()
+
+        assert "# TYPE prompy_db_pool_checked_out gauge" in output
+        assert "# TYPE prompy_db_pool_saturation gauge" in output
+
+    def test_postgres_uri_gets_the_configured_driver(self):
+        """Test that a driverless postgresql:// URI uses the configured driver, an explicit one is kept"""
+        assert Database(uri="postgresql://u@localhost/prompy").url().drivername == "postgresql+psycopg2"
+        assert Database(uri="postgres://u@localhost/prompy", driver="psycopg").url().drivername == "postgresql+psycopg"
+        assert Database(uri="postgresql+psycopg2://u@localhost/prompy").url().drivername == "postgresql+psycopg2"
+
+    @patch("api.steps.database.create_engine")
+    def test_psycopg_prepares_statements(self, mock_create_engine):
+        """Test that the prepare threshold reaches psycopg"""
+        Database(uri="postgresql://u@localhost/prompy", driver="psycopg", prepare_threshold=3).engine()
+
+        _, kwargs = mock_create_engine.call_args
+        assert kwargs["connect_args"] == {"prepare_threshold": 3}
+        assert kwargs["pool_size"] == 5
+
+    @patch("api.steps.database.create_engine")
+    def test_psycopg_prepares_nothing_by_default(self, mock_create_engine):
+        """Test that prepared statements stay off, as transaction-mode poolers need"""
+        Database(uri="postgresql://u@localhost/prompy", driver="psycopg").engine()
+
+        _, kwargs = mock_create_engine.call_args
+        assert kwargs["connect_args"] == {"prepare_threshold": None}
+
+    def test_async_uri_uses_an_asyncio_driver(self):
+        """Test that the asyncio engine gets psycopg or aiosqlite, whatever the sync driver"""
+        database = Database(uri="postgresql+psycopg2://u@localhost/prompy")
+
+        assert database.url(asynchronous=True).drivername == "postgresql+psycopg"
+        assert Database(uri="sqlite:///x.db").url(asynchronous=True).drivername == "sqlite+aiosqlite"
+
+    @pytest.mark.asyncio
+    async def test_async_engine_is_kept_per_event_loop(self, tmp_path):
+        """Test that the asyncio pool is reused on its loop and reported in stats"""
+        database = file_database(tmp_path, backend="async")
+
+        connection = await database.aconnect()
+        try:
+            assert (await connection.execute(text("SELECT 1"))).scalar() == 1
+            assert database.stats()["async"]["checked_out"] == 1
+        finally:
+            await connection.close()
+
+        assert database.async_engine() is database.async_engine()
+        assert database.stats()["backend"] == "async"
+
+        await database.aclose()
+        assert "async" not in database.stats()
+
+    def test_each_event_loop_gets_its_own_async_engine(self, tmp_path):
+        """Test that an engine opened on one loop isn't handed to another"""
+        database = file_database(tmp_path, backend="async")
+
+        async def engine():
+            try:
+                return database.async_engine()
+            finally:
+                await database.aclose()
+
+        assert asyncio.run(engine()) is not asyncio.run(engine())
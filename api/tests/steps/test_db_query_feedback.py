@@ -0,0 +1,143 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from api.steps.db_query import INSERT_QUERY, _arun_query, _run_query
+from api.steps.db_query_feedback import (
+    FEEDBACK_RESPONSE,
+    INSERT_QUERY_WITH_FEEDBACK,
+    ainsert_response,
+    insert_response,
+    write_pending,
+)
+from api.steps.write_behind import PendingWrite
+
+FEEDBACK = {"improvements": ["Add a role"], "score": 7, "strengths": ["It's clear"], "tags": ["writing"]}
+
+
+def _statements(connection):
+    return [str(call.args[0]) for call in connection.execute.call_args_list]
+
+
+class TestRunQuery:
+
+    @patch("api.steps.db_query.database")
+    def test_rows_are_inserted_in_one_statement(self, mock_database, expected_score_output):
+        """Test that user_query, user_query_version and scores take a single round trip"""
+        connection = mock_database.connect.return_value
+        connection.execute.return_value.scalar.return_value = 42
+
+        result = _run_query(dict(expected_score_output))
+
+        assert result["user_query_version_id"] == 42
+        [call] = connection.execute.call_args_list
+        assert call.args[0] is INSERT_QUERY
+        assert call.args[1]["user_query"] == expected_score_output["parsed_response"]["user_query"]
+        assert call.args[1]["task"] is True
+        assert call.args[1]["word_count_score"] == 3
+        [statement] = _statements(connection)
+        assert "INSERT INTO user_query (" in statement
+        assert "FROM new_user_query" in statement
+        assert "INSERT INTO scores (" in statement
+        assert "FROM new_version" in statement
+        assert "feedback_response" not in statement
+        connection.begin.return_value.commit.assert_called_once()
+
+
+    @pytest.mark.asyncio
+    @patch("api.steps.db_query.database")
+    async def test_async_backend_awaits_the_insert(self, mock_database, expected_score_output):
+        """Test that DB_BACKEND=async awaits an asyncio connection instead of using a thread"""
+        mock_database.backend = "async"
+        connection = AsyncMock()
+        connection.execute.return_value = MagicMock(**{"scalar.return_value": 42})
+        mock_database.aconnect = AsyncMock(return_value=connection)
+
+        result = await _arun_query(dict(expected_score_output))
+
+        assert result["user_query_version_id"] == 42
+        assert connection.execute.await_args.args[0] is INSERT_QUERY
+        connection.begin.return_value.commit.assert_awaited_once()
+        connection.close.assert_awaited_once()
+        mock_database.connect.assert_not_called()
+
+
+class TestWritePending:
+
+    @patch("api.steps.db_query_feedback.database")
+    def test_feedback_is_folded_into_the_insert(self, mock_database, expected_score_output):
+        """Test that write-behind writes all four rows of a request in one statement"""
+        connection = mock_database.connect.return_value
+        records = []
+        for _ in range(3):
+            record = PendingWrite(
+                parsed_response=expected_score_output["parsed_response"],
+                score_breakdown=expected_score_output["score_breakdown"],
+            )
+            record.feedback = dict(FEEDBACK)
+            records.append(record)
+
+        assert write_pending(records) == 0
+
+        calls = connection.execute.call_args_list
+        assert len(calls) == 3
+        for call in calls:
+            # The same statement every time, with the lists bound as arrays
+            assert call.args[0] is INSERT_QUERY_WITH_FEEDBACK
+            assert call.args[1]["improvements"] == ["Add a role"]
+            assert call.args[1]["tags"] == ["writing"]
+        statement = str(INSERT_QUERY_WITH_FEEDBACK)
+        assert "INSERT INTO feedback_response (" in statement
+        assert "CAST(:improvements AS TEXT[])" in statement
+        assert statement.rstrip().endswith("SELECT id FROM new_version;")
+
+    @patch("api.steps.db_query_feedback.logger")
+    @patch("api.steps.db_query_feedback.database")
+    def test_failed_records_are_logged(self, mock_database, mock_logger, expected_score_output):
+        """Test that a failing batch and each record it loses are logged, not just counted"""
+        connection = mock_database.connect.return_value
+        connection.execute.side_effect = Exception("bad row")
+        record = PendingWrite(expected_score_output["parsed_response"], expected_score_output["score_breakdown"])
+        record.feedback = dict(FEEDBACK)
+
+        assert write_pending([record, record]) == 2
+
+        # The batch, then each record retried on its own
+        assert mock_logger.exception.call_count == 3
+
+
+class TestInsertResponse:
+
+    @patch("api.steps.db_query_feedback.database")
+    def test_quotes_are_bound_not_escaped(self, mock_database):
+        """Test that feedback text goes to the driver as parameters, whatever it contains"""
+        connection = mock_database.connect.return_value
+        response = dict(FEEDBACK, strengths=["It's 'quoted'"], versionId=9)
+
+        insert_response(response)
+
+        [call] = connection.execute.call_args_list
+        assert call.args[0] is FEEDBACK_RESPONSE
+        assert call.args[1] == {
+            "improvements": ["Add a role"],
+            "score": 7,
+            "strengths": ["It's 'quoted'"],
+            "tags": ["writing"],
+            "user_query_version_id": 9,
+        }
+
+    @pytest.mark.asyncio
+    @patch("api.steps.db_query_feedback.database")
+    async def test_async_backend_awaits_the_insert(self, mock_database):
+        """Test that DB_BACKEND=async writes the feedback on an asyncio connection"""
+        mock_database.backend = "async"
+        connection = AsyncMock()
+        mock_database.aconnect = AsyncMock(return_value=connection)
+
+        response = await ainsert_response(dict(FEEDBACK, versionId=9))
+
+        assert "versionId" not in response
+        assert connection.execute.await_args.args[0] is FEEDBACK_RESPONSE
+        assert connection.execute.await_args.args[1]["user_query_version_id"] == 9
+        connection.begin.return_value.commit.assert_awaited_once()
+        mock_database.connect.assert_not_called()
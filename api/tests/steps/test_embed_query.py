@@ -1,4 +1,6 @@
+import numpy as np
 import pytest
+from unittest.mock import patch, AsyncMock
 from langchain_core.runnables import RunnableLambda
 
 from api.steps.embed_query import embed_query
@@ -34,3 +36,28 @@ class TestEmbedQuery:
         
         # Verify the result matches the expected dictionary structure
         assert "embedding" in result
+
+    @pytest.mark.asyncio
+    @patch("api.steps.embed_query.embeddings")
+    async def test_embed_query_ainvoke(self, mock_embeddings, sample_dict):
+        """Test that ainvoke uses the native async embeddings call"""
+        mock_embeddings.aembed_query = AsyncMock(return_value=[0.1, 0.2])
+        runnable = embed_query()
+
+        result = await runnable.ainvoke(sample_dict)
+
+        assert result["embedding"].tolist() == pytest.approx([0.1, 0.2])
+        mock_embeddings.aembed_query.assert_awaited_once_with(sample_dict["summary"])
+        mock_embeddings.embed_query.assert_not_called()
+
+    @patch("api.steps.embed_query.embeddings")
+    def test_embedding_is_a_float32_array(self, mock_embeddings, sample_dict):
+        """Test that the vector is kept as a compact, read-only float32 array"""
+        mock_embeddings.embed_query.return_value = [0.1, 0.2, 0.3]
+        runnable = embed_query()
+
+        embedding = runnable.invoke(sample_dict)["embedding"]
+
+        assert embedding.dtype == np.float32
+        assert embedding.shape == (3,)
+        assert not embedding.flags.writeable
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+
+from api.steps.embedding_cache import EmbeddingCache
+
+
+class CountingEmbeddings:
+    """Returns [len(text), 0.5] and counts how often it was called."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [float(len(text)), 0.5]
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+
+class TestEmbeddingCache:
+
+    def test_repeated_text_is_served_from_memory(self):
+        """Test that the second lookup of a summary doesn't call the model"""
+        embeddings = CountingEmbeddings()
+        cache = EmbeddingCache(embeddings, model="test")
+
+        first = cache.embed_query("a prompt")
+        second = cache.embed_query("a prompt")
+
+        assert first is second
+        assert first.tolist() == [8.0, 0.5]
+        assert embeddings.calls == 1
+        assert cache.stats()["memory_hits"] == 1
+        assert cache.stats()["hit_ratio"] == 0.5
+
+    def test_vectors_survive_a_restart_on_disk(self, tmp_path):
+        """Test that a new cache with the same file reads the stored vector"""
+        path = str(tmp_path / "embeddings.sqlite3")
+        embeddings = CountingEmbeddings()
+        EmbeddingCache(embeddings, path=path, model="test").embed_query("a prompt")
+
+        restarted = EmbeddingCache(embeddings, path=path, model="test")
+
+        assert restarted.embed_query("a prompt").tolist() == [8.0, 0.5]
+        assert embeddings.calls == 1
+        assert restarted.stats()["disk_hits"] == 1
+
+    def test_changing_the_model_misses(self, tmp_path):
+        """Test that vectors from another model are never returned"""
+        path = str(tmp_path / "embeddings.sqlite3")
+        embeddings = CountingEmbeddings()
+        EmbeddingCache(embeddings, path=path, model="small").embed_query("a prompt")
+
+        EmbeddingCache(embeddings, path=path, model="large").embed_query("a prompt")
+
+        assert embeddings.calls == 2
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """Test that the memory tier holds at most maxsize vectors"""
+        embeddings = CountingEmbeddings()
+        cache = EmbeddingCache(embeddings, maxsize=2, model="test")
+
+        for text in ("one", "two", "one", "three", "one"):
+            cache.embed_query(text)
+
+        assert embeddings.calls == 3
+        assert cache.stats()["memory_size"] == 2
+
+    def test_async_lookup_uses_the_cache(self):
+        """Test that aembed_query shares entries with embed_query"""
+        embeddings = CountingEmbeddings()
+        cache = EmbeddingCache(embeddings, model="test")
+        cache.embed_query("a prompt")
+
+        vector = asyncio.run(cache.aembed_query("a prompt"))
+
+        assert vector.tolist() == [8.0, 0.5]
+        assert embeddings.calls == 1
+
+    def test_async_disk_tier_runs_off_the_event_loop(self, tmp_path):
+        """Test that aembed_query reads and writes SQLite in a worker thread"""
+        embeddings = CountingEmbeddings()
+        cache = EmbeddingCache(embeddings, path=str(tmp_path / "embeddings.sqlite3"), model="test")
+        connect = cache._db
+        threads = []
+
+        def db():
+            threads.append(threading.get_ident())
+            return connect()
+
+        cache._db = db
+
+        async def embed():
+            await cache.aembed_query("a prompt")
+            return threading.get_ident()
+
+        loop_thread = asyncio.run(embed())
+
+        assert len(threads) == 2
+        assert loop_thread not in threads
+        assert EmbeddingCache(embeddings, path=cache.path, model="test").get(cache.key("a prompt")) is not None
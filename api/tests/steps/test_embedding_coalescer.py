@@ -0,0 +1,94 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from api.steps.embedding_coalescer import EmbeddingCoalescer
+
+
+class RecordingEmbeddings:
+    """Returns [len(text), index] per text and records each batch it was sent."""
+
+    def __init__(self):
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.batches.append(list(texts))
+        return [[float(len(t)), float(i)] for i, t in enumerate(texts)]
+
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+
+
+class TestEmbeddingCoalescer:
+
+    def test_concurrent_threads_share_one_request(self):
+        """Test that calls within the window are sent as one embed_documents batch"""
+        embeddings = RecordingEmbeddings()
+        coalescer = EmbeddingCoalescer(embeddings, window=0.2, max_batch=4)
+        texts = ["a", "bb", "ccc", "dddd"]
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            vectors = list(pool.map(coalescer.embed_query, texts))
+
+        assert len(embeddings.batches) == 1
+        assert [v[0] for v in vectors] == [1.0, 2.0, 3.0, 4.0]
+        assert coalescer.stats()["max_batch_size"] == 4
+
+    @pytest.mark.asyncio
+    async def test_async_callers_are_batched_and_deduplicated(self):
+        """Test that identical texts in a batch are embedded once"""
+        embeddings = RecordingEmbeddings()
+        coalescer = EmbeddingCoalescer(embeddings, window=0.05, max_batch=10)
+
+        vectors = await asyncio.gather(
+            *(coalescer.aembed_query(t) for t in ["x", "yy", "x"])
+        )
+
+        assert embeddings.batches == [["x", "yy"]]
+        assert vectors[0] is vectors[2]
+        assert vectors[0].tolist() == [1.0, 0.0]
+        stats = coalescer.stats()
+        assert stats["requests"] == 3
+        assert stats["texts_sent"] == 2
+
+    def test_errors_reach_every_caller(self):
+        """Test that a failed batch raises in each waiting caller"""
+        class FailingEmbeddings:
+            def embed_documents(self, texts):
+                raise RuntimeError("rate limited")
+
+        coalescer = EmbeddingCoalescer(FailingEmbeddings(), window=0.1, max_batch=2)
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(coalescer.embed_query, t) for t in ["a", "b"]]
+
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result()
+        assert coalescer.stats()["errors"] == 1
+
+    @pytest.mark.asyncio
+    async def test_cancelled_leader_releases_its_batch(self):
+        """Test that cancelling a leader fails its followers and lets new callers start a batch"""
+        embeddings = RecordingEmbeddings()
+        coalescer = EmbeddingCoalescer(embeddings, window=0.5, max_batch=10)
+
+        leader = asyncio.create_task(coalescer.aembed_query("a"))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(coalescer.aembed_query("bb"))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(follower, 0.2)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+        coalescer.window = 0.01
+        vector = await asyncio.wait_for(coalescer.aembed_query("ccc"), 1)
+        assert vector.tolist() == [3.0, 0.0]
+        assert embeddings.batches == [["ccc"]]
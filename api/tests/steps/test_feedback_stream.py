@@ -0,0 +1,46 @@
+import json
+
+from api.steps.feedback_stream import FeedbackStreamParser
+
+
+RESPONSE = json.dumps({
+    "strengths": ["Clear task", "Uses a \"role\""],
+    "improvements": ["Add an example"],
+    "tags": ["writing"]
+})
+
+
+class TestFeedbackStreamParser:
+
+    def test_items_are_emitted_as_they_complete(self):
+        """Test that array items are returned as soon as their string closes"""
+        parser = FeedbackStreamParser()
+        items = []
+
+        for ch in RESPONSE:
+            items.extend(parser.feed(ch))
+
+        assert items == [
+            ("strengths", "Clear task"),
+            ("strengths", "Uses a \"role\""),
+            ("improvements", "Add an example"),
+            ("tags", "writing"),
+        ]
+        assert parser.done
+        assert parser.result() == json.loads(RESPONSE)
+
+    def test_partial_item_is_not_emitted(self):
+        """Test that an unterminated string is held back"""
+        parser = FeedbackStreamParser()
+
+        assert parser.feed('{"strengths": ["Clear ta') == []
+        assert parser.feed('sk", "Sec') == [("strengths", "Clear task")]
+        assert not parser.done
+
+    def test_ignores_code_fences(self):
+        """Test that text around the JSON object is ignored"""
+        parser = FeedbackStreamParser()
+
+        parser.feed("```json\n" + RESPONSE + "\n```")
+
+        assert parser.result() == json.loads(RESPONSE)
@@ -0,0 +1,128 @@
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import api.steps.embed_query
+import api.steps.pinecone
+
+# The tools run from api/ and import the steps package by its top-level name
+with patch.dict(sys.modules, {
+    "steps.embed_query": sys.modules["api.steps.embed_query"],
+    "steps.pinecone": sys.modules["api.steps.pinecone"],
+}):
+    from api.tools import ingest as ingest_tool
+
+Checkpoint, Chunk, ingest = ingest_tool.Checkpoint, ingest_tool.Chunk, ingest_tool.ingest
+embedding_model = ingest_tool.embedding_model
+
+
+def _chunks(texts, model="text-embedding-3-small"):
+    return [Chunk(f"doc.md#{i}", text, "doc.md", i, model) for i, text in enumerate(texts)]
+
+
+class FakeIndex:
+    """Embeds each text as [len(text)] and keeps upserted records by id."""
+
+    def __init__(self, fail_batches=()):
+        self.embedded = []
+        self.records = {}
+        self.upserts = 0
+        self.fail_batches = set(fail_batches)
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text))] for text in texts]
+
+    def upsert(self, records):
+        self.upserts += 1
+        if self.upserts in self.fail_batches:
+            raise RuntimeError("upsert failed")
+        self.records.update((record["id"], record) for record in records)
+
+
+def _ingest(chunks, index, checkpoint):
+    return ingest(
+        chunks,
+        embed_documents=index.embed_documents,
+        upsert=index.upsert,
+        checkpoint=checkpoint,
+        embed_batch_size=4,
+        upsert_batch_size=2,
+        concurrency=1,
+        log=lambda message: None,
+    )
+
+
+@pytest.fixture(autouse=True)
+def no_backoff():
+    with patch.object(ingest_tool, "time"):
+        yield
+
+
+class TestIngest:
+
+    def test_resumes_after_a_failed_batch(self, tmp_path):
+        """Test that a re-run only embeds the chunks the interrupted run didn't upsert"""
+        path = str(tmp_path / "checkpoint.json")
+        chunks = _chunks(["a", "bb", "ccc", "dddd", "eeeee", "ffffff"])
+        # The second upsert batch fails on every attempt
+        failing = FakeIndex(fail_batches={2, 3, 4})
+
+        with pytest.raises(RuntimeError):
+            _ingest(chunks, failing, Checkpoint(path))
+
+        index = FakeIndex()
+        counts = _ingest(chunks, index, Checkpoint(path))
+
+        assert counts["skipped"] == 2
+        assert index.embedded == ["ccc", "dddd", "eeeee", "ffffff"]
+        assert sorted(index.records) == ["doc.md#2", "doc.md#3", "doc.md#4", "doc.md#5"]
+
+    def test_unchanged_chunks_are_skipped(self, tmp_path):
+        """Test that only chunks whose text changed are embedded again"""
+        checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+        _ingest(_chunks(["a", "bb", "ccc"]), FakeIndex(), checkpoint)
+
+        index = FakeIndex()
+        counts = _ingest(_chunks(["a", "BB!", "ccc"]), index, checkpoint)
+
+        assert index.embedded == ["BB!"]
+        assert counts == {"seen": 3, "skipped": 2, "embedded": 1, "upserted": 1, "stale": 0}
+        assert index.records["doc.md#1"]["metadata"]["content_hash"] == checkpoint.hashes["doc.md#1"]
+
+    def test_removed_chunks_are_counted_as_stale(self, tmp_path):
+        """Test that chunks missing from the corpus are reported for --prune"""
+        checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+        _ingest(_chunks(["a", "bb", "ccc"]), FakeIndex(), checkpoint)
+
+        counts = _ingest(_chunks(["a"]), FakeIndex(), checkpoint)
+
+        assert counts["stale"] == 2
+        checkpoint.forget(["doc.md#1", "doc.md#2"])
+        assert list(Checkpoint(checkpoint.path).hashes) == ["doc.md#0"]
+
+    def test_failed_upserts_are_retried(self, tmp_path):
+        """Test that a transient upsert failure doesn't stop the run"""
+        index = FakeIndex(fail_batches={1})
+
+        counts = _ingest(_chunks(["a", "bb"]), index, Checkpoint(str(tmp_path / "checkpoint.json")))
+
+        assert counts["upserted"] == 2
+        assert index.upserts == 2
+        assert sorted(index.records) == ["doc.md#0", "doc.md#1"]
+
+    def test_changing_the_dimension_re_embeds_everything(self, tmp_path):
+        """Test that shortened vectors don't match a checkpoint of native-size ones"""
+        client = MagicMock(model="text-embedding-3-small", dimensions=None)
+        native = embedding_model(client)
+        client.dimensions = 512
+        shortened = embedding_model(client)
+
+        checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+        _ingest(_chunks(["a", "bb"], model=native), FakeIndex(), checkpoint)
+        counts = _ingest(_chunks(["a", "bb"], model=shortened), FakeIndex(), checkpoint)
+
+        assert native == "text-embedding-3-small"
+        assert shortened == "text-embedding-3-small:512"
+        assert counts["embedded"] == 2
@@ -0,0 +1,94 @@
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+from langchain_core.runnables import RunnableLambda
+
+from api.steps.instrumentation import (
+    LatencyHistogram,
+    Metrics,
+    TokenUsageHandler,
+    metrics,
+    start_request,
+    timed,
+)
+
+
+class TestInstrumentation:
+
+    def test_timed_step_records_request_and_process_metrics(self):
+        """Test that a timed step shows up in Server-Timing and the stage histogram"""
+        timings = start_request()
+        step = timed("test_timed_step", RunnableLambda(lambda d: d + 1))
+
+        assert step.invoke(1) == 2
+        assert "test_timed_step" in timings.stages
+        assert timings.server_timing().startswith("test_timed_step;dur=")
+        assert metrics.snapshot()["stages"]["test_timed_step"]["count"] >= 1
+
+    @pytest.mark.asyncio
+    async def test_timed_step_counts_errors(self):
+        """Test that a failing step is recorded as an error and re-raised"""
+        def fail(d):
+            raise ValueError("boom")
+
+        step = timed("test_failing_step", RunnableLambda(fail))
+
+        with pytest.raises(ValueError):
+            await step.ainvoke({})
+        assert metrics.snapshot()["stages"]["test_failing_step"]["errors"] == 1
+
+    def test_histogram_quantiles(self):
+        """Test that p50/p95/p99 come from the recent samples"""
+        histogram = LatencyHistogram()
+        for i in range(1, 101):
+            histogram.observe(i / 1000)
+
+        quantiles = histogram.quantiles()
+        assert quantiles[0.5] == pytest.approx(0.0505)
+        assert quantiles[0.99] == pytest.approx(0.09901)
+        assert histogram.count == 100
+
+    def test_token_usage_handler(self):
+        """Test that the usage metadata on LLM results is added up per stage"""
+        message = AIMessage(
+            content="{}",
+            usage_metadata={"input_tokens": 120, "output_tokens": 30, "total_tokens": 150},
+        )
+        result = LLMResult(generations=[[ChatGeneration(message=message)]])
+        timings = start_request()
+
+        TokenUsageHandler("test_tokens_stage").on_llm_end(result)
+
+        assert metrics.snapshot()["tokens"]["test_tokens_stage"]["total_tokens"] >= 150
+        assert timings.tokens["input_tokens"] == 120
+
+    def test_token_usage_handler_records_cached_tokens(self):
+        """Test that prompt tokens served from the provider's cache are counted"""
+        message = AIMessage(
+            content="{}",
+            usage_metadata={
+                "input_tokens": 1500,
+                "output_tokens": 40,
+                "total_tokens": 1540,
+                "input_token_details": {"cache_read": 1024},
+            },
+        )
+        result = LLMResult(generations=[[ChatGeneration(message=message)]])
+        timings = start_request()
+
+        TokenUsageHandler("test_cached_stage").on_llm_end(result)
+
+        assert timings.tokens["cached_input_tokens"] == 1024
+        assert metrics.snapshot()["tokens"]["test_cached_stage"]["cached_input_tokens"] >= 1024
+
+    def test_render_prometheus(self):
+        """Test the scrape output includes buckets, quantiles and token counters"""
+        registry = Metrics()
+        registry.observe("parse_query", 0.2)
+        registry.add_tokens("parse_query", {"total_tokens": 42})
+
+        text = registry.render_prometheus()
+
+        assert 'prompy_stage_duration_seconds_bucket{stage="parse_query",le="0.25"} 1' in text
+        assert 'prompy_stage_duration_quantile_seconds{stage="parse_query",quantile="0.5"} 0.2' in text
+        assert 'prompy_llm_tokens_total{stage="parse_query",kind="total_tokens"} 42' in text
@@ -0,0 +1,61 @@
+from api.steps.local_parse import ParseAgreement, local_parse
+
+
+class TestLocalParse:
+
+    def test_detects_components(self):
+        """Test that clear markers for every component are detected"""
+        result = local_parse(
+            "You are a senior editor. Rewrite the essay for my class. "
+            "Do not use jargon. For example: 'use plain words'. "
+            "Format the answer as bullet points."
+        )
+
+        assert result.flags == {
+            "task": True,
+            "role": True,
+            "context": True,
+            "rules": True,
+            "examples": True,
+            "format": True,
+        }
+        assert result.is_confident(0.75)
+
+    def test_short_prompt_without_markers_is_confidently_absent(self):
+        """Test that a short prompt with only a task is classified confidently"""
+        result = local_parse("Write a poem about cats")
+
+        assert result.flags["task"] is True
+        assert not any(result.flags[key] for key in ("role", "context", "rules", "examples", "format"))
+        assert result.is_confident(0.75)
+
+    def test_weak_evidence_is_low_confidence(self):
+        """Test that weak markers lower the confidence below the default threshold"""
+        result = local_parse("Write a short story")
+
+        assert result.flags["format"] is True
+        assert result.confidence["format"] < 0.75
+        assert not result.is_confident(0.75)
+
+    def test_parsed_response_shape(self):
+        """Test that the local result matches the LLM parse output shape"""
+        parsed = local_parse("Write a poem about cats").parsed_response
+
+        assert parsed["user_query"] == "Write a poem about cats"
+        assert parsed["word_count"] == 5
+
+
+class TestParseAgreement:
+
+    def test_agreement_report(self):
+        """Test that per-component agreement is tallied"""
+        agreement = ParseAgreement()
+        local = local_parse("Write a poem about cats")
+
+        agreement.record(local, {**local.flags, "role": True})
+
+        stats = agreement.stats()
+        assert stats["compared"] == 1
+        assert stats["components"]["task"]["agreement"] == 1.0
+        assert stats["components"]["role"]["llm_only"] == 1
+        assert stats["min_component_agreement"] == 0.0
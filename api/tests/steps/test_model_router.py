@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from api.steps.model_router import HEDGE_MIN_SAMPLES, ModelRoute, ModelRouter
+
+
+def slow(answer, seconds=0.0, error=None):
+    """A stand-in model that answers after ``seconds`` or raises ``error``."""
+
+    def call(_):
+        time.sleep(seconds)
+        if error is not None:
+            raise error
+        return answer
+
+    async def acall(_):
+        await asyncio.sleep(seconds)
+        if error is not None:
+            raise error
+        return answer
+
+    return RunnableLambda(call, afunc=acall)
+
+
+def routed(route, models):
+    return ModelRouter({"chat_llm": route}).model("chat_llm", lambda name: models[name])
+
+
+class TestModelRouter:
+
+    def test_primary_answers_by_default(self):
+        """Test that a route without fallback, deadline or hedging calls the primary"""
+        model = routed(ModelRoute("a"), {"a": slow("from a")})
+
+        assert model.invoke("hi") == "from a"
+        assert model.router.stats()["chat_llm"]["calls"] == 1
+
+    def test_failover_to_secondary(self):
+        """Test that the secondary answers when the primary fails"""
+        model = routed(
+            ModelRoute("a", "b"),
+            {"a": slow(None, error=RuntimeError("down")), "b": slow("from b")},
+        )
+
+        assert model.invoke("hi") == "from b"
+        assert model.router.stats()["chat_llm"]["failovers"] == 1
+
+    def test_deadline_is_enforced(self):
+        """Test that a step slower than its deadline raises instead of waiting"""
+        model = routed(ModelRoute("a", deadline=0.05), {"a": slow("late", 0.5)})
+
+        start = time.perf_counter()
+        with pytest.raises(TimeoutError):
+            model.invoke("hi")
+
+        assert time.perf_counter() - start < 0.3
+        assert model.router.stats()["chat_llm"]["deadline_exceeded"] == 1
+
+    def test_slow_primary_is_hedged(self):
+        """Test that once the p95 is known a slow call is raced by the secondary"""
+        models = {"a": slow("from a", 0.01), "b": slow("from b", 0.01)}
+        model = routed(ModelRoute("a", "b", hedge=True, min_hedge_delay=0.02), models)
+        for _ in range(HEDGE_MIN_SAMPLES):
+            model.invoke("warm up")
+
+        model.primary = slow("from a", 0.5)
+
+        assert model.invoke("hi") == "from b"
+        stats = model.router.stats()["chat_llm"]
+        assert stats["hedged"] == 1
+        assert stats["hedge_wins"] == 1
+
+    def test_async_hedge_cancels_the_loser(self):
+        """Test that ainvoke returns the hedge's answer and cancels the primary"""
+        models = {"a": slow("from a", 0.01), "b": slow("from b", 0.01)}
+        model = routed(ModelRoute("a", "b", hedge=True, min_hedge_delay=0.02), models)
+        for _ in range(HEDGE_MIN_SAMPLES):
+            model.invoke("warm up")
+
+        model.primary = slow("from a", 5)
+
+        start = time.perf_counter()
+        assert asyncio.run(model.ainvoke("hi")) == "from b"
+        assert time.perf_counter() - start < 1
+
+    def test_stalled_step_leaves_other_steps_their_threads(self):
+        """Test that calls stuck past their deadline don't starve another step's calls"""
+        router = ModelRouter(
+            {"parse_query": ModelRoute("slow", deadline=0.05), "chat_llm": ModelRoute("fast", deadline=0.5)},
+            max_workers=4,
+        )
+        models = {"slow": slow("late", 1), "fast": slow("from fast")}
+        stalled = router.model("parse_query", lambda name: models[name])
+        healthy = router.model("chat_llm", lambda name: models[name])
+        for _ in range(4):
+            with pytest.raises(TimeoutError):
+                stalled.invoke("hi")
+
+        assert healthy.invoke("hi") == "from fast"
+
+    def test_queued_call_is_dropped_after_its_deadline(self):
+        """Test that a call still waiting for a thread at its deadline never runs"""
+        calls = []
+        models = {"a": RunnableLambda(lambda _: calls.append(1) or time.sleep(0.3))}
+        model = ModelRouter({"chat_llm": ModelRoute("a", deadline=0.05)}, max_workers=1).model(
+            "chat_llm", lambda name: models[name]
+        )
+        for _ in range(2):
+            with pytest.raises(TimeoutError):
+                model.invoke("hi")
+
+        time.sleep(0.4)
+        assert len(calls) == 1
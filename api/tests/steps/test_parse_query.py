@@ -1,5 +1,9 @@
 import pytest
 import json
+from unittest.mock import patch
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from api.steps.local_parse import ParseAgreement
 from api.steps.parse_query import parse_query
 
 
@@ -41,4 +45,28 @@ class TestParseQuery:
         # Should raise an exception for missing user_query
         with pytest.raises(Exception) as e:
             runnable.invoke({})
-            assert str(e.value) == "SummarizeQueryException: parsed user query response is not available"
\ No newline at end of file
+            assert str(e.value) == "SummarizeQueryException: parsed user query response is not available"
+
+    def test_parse_query_local_mode_skips_llm(self):
+        """Test that a confident local parse never calls the LLM"""
+        agreement = ParseAgreement()
+
+        with patch("api.steps.parse_query.llm", FakeListChatModel(responses=[])):
+            runnable = parse_query(mode="local", agreement=agreement)
+            result = runnable.invoke({"clean_query": "Write a poem about cats"})
+
+        assert result["parsed_response"]["task"] is True
+        assert result["parsed_response"]["word_count"] == 5
+        assert agreement.stats()["fast_path"] == 1
+
+    def test_parse_query_local_mode_falls_back_to_llm(self, sample_json_response):
+        """Test that a low-confidence local parse falls back to the LLM"""
+        agreement = ParseAgreement()
+        llm = FakeListChatModel(responses=[sample_json_response])
+
+        with patch("api.steps.parse_query.llm", llm):
+            runnable = parse_query(mode="local", agreement=agreement)
+            result = runnable.invoke({"clean_query": "What is a good prompt for summarizing text?"})
+
+        assert result == {"parsed_response": json.loads(sample_json_response)}
+        assert agreement.stats()["fallbacks"] == 1
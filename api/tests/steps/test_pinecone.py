@@ -0,0 +1,44 @@
+from unittest.mock import MagicMock, patch
+
+from api.steps.pinecone import IndexHandle
+
+
+class TestIndexHandle:
+
+    @patch("api.steps.pinecone.Pinecone")
+    def test_index_is_created_once_per_process(self, mock_pinecone):
+        """Test that repeated lookups reuse the same client and index handle"""
+        handle = IndexHandle(pool_size=4, pool_threads=2)
+
+        first = handle.index()
+        second = handle.index()
+
+        assert first is second
+        mock_pinecone.assert_called_once()
+        _, kwargs = mock_pinecone.return_value.Index.call_args
+        assert kwargs["connection_pool_maxsize"] == 4
+        assert kwargs["pool_threads"] == 2
+
+    @patch("api.steps.pinecone.Pinecone")
+    def test_index_is_recreated_after_fork(self, mock_pinecone):
+        """Test that a forked worker doesn't reuse the parent's connections"""
+        mock_pinecone.return_value.Index.side_effect = lambda *a, **k: MagicMock()
+        handle = IndexHandle()
+
+        parent = handle.index()
+        with patch("api.steps.pinecone.os.getpid", return_value=-1):
+            child = handle.index()
+
+        assert parent is not child
+        assert mock_pinecone.call_count == 2
+
+    @patch("api.steps.pinecone.Pinecone")
+    def test_warm_up_queries_the_index(self, mock_pinecone):
+        """Test that warm-up runs a single query with the index dimension"""
+        index = mock_pinecone.return_value.Index.return_value
+        index.describe_index_stats.return_value = MagicMock(dimension=3, total_vector_count=10)
+
+        stats = IndexHandle().warm_up()
+
+        assert stats == {"dimension": 3, "total_vector_count": 10}
+        index.query.assert_called_once_with(vector=[1.0, 0.0, 0.0], top_k=1)
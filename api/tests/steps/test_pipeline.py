@@ -0,0 +1,61 @@
+import time
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from api.steps.pipeline import PipelineRegistry, persist_and_retrieve
+
+
+class TestPipelineRegistry:
+
+    def test_pipeline_is_built_once_and_reused(self):
+        """Test that the registry builds a pipeline once and counts reuses"""
+        builds = []
+
+        def builder():
+            builds.append(1)
+            return RunnableLambda(lambda d: {**d, "ok": True})
+
+        registry = PipelineRegistry()
+        registry.register("default", builder)
+        registry.build_all()
+
+        for _ in range(3):
+            result = registry.get("default").invoke({"input": "hi"})
+
+        assert result == {"input": "hi", "ok": True}
+        assert len(builds) == 1
+
+        stats = registry.stats()["default"]
+        assert stats["uses"] == 3
+        assert stats["build_seconds"] >= 0
+
+    def test_unknown_pipeline(self):
+        """Test that requesting an unregistered variant raises"""
+        registry = PipelineRegistry()
+
+        with pytest.raises(KeyError):
+            registry.get("missing")
+
+
+class TestPersistAndRetrieve:
+
+    def _slow(self, key, value):
+        def step(d):
+            time.sleep(0.2)
+            d[key] = value
+            return d
+        return RunnableLambda(step)
+
+    def test_branches_run_concurrently_and_join(self):
+        """Test that persistence and retrieval overlap and are merged"""
+        runnable = persist_and_retrieve(
+            self._slow("user_query_version_id", 7),
+            self._slow("context", "docs"),
+        )
+
+        start = time.perf_counter()
+        result = runnable.invoke({"summary": "s"})
+        elapsed = time.perf_counter() - start
+
+        assert result == {"summary": "s", "context": "docs", "user_query_version_id": 7}
+        assert elapsed < 0.35
@@ -0,0 +1,62 @@
+from unittest.mock import patch
+from langchain_core.runnables import RunnableLambda
+
+from api.steps.result_cache import ResultCache
+
+
+FEEDBACK = {"score": 6, "strengths": ["Clear task"], "improvements": ["Add a role"], "tags": ["writing"]}
+
+
+class TestResultCache:
+
+    def test_wrapped_runnable_only_runs_on_a_miss(self):
+        """Test that a repeated prompt is served from the cache"""
+        calls = []
+        runnable = RunnableLambda(lambda d: calls.append(d) or dict(FEEDBACK))
+        cache = ResultCache(maxsize=10, ttl=60, version="v1")
+        cached = cache.wrap(runnable)
+
+        first = cached.invoke({"clean_query": "Write a  poem"})
+        second = cached.invoke({"clean_query": " Write a poem "})
+
+        assert first == second == FEEDBACK
+        assert len(calls) == 1
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_key_depends_on_prompt_version(self):
+        """Test that a new system prompt version doesn't reuse old results"""
+        assert ResultCache(version="v1").key("q") != ResultCache(version="v2").key("q")
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted past maxsize"""
+        cache = ResultCache(maxsize=2)
+        cache.set("a", FEEDBACK)
+        cache.set("b", FEEDBACK)
+        cache.get("a")
+        cache.set("c", FEEDBACK)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == FEEDBACK
+        assert cache.stats()["evictions"] == 1
+
+    @patch("api.steps.result_cache.time.monotonic")
+    def test_ttl_expiry(self, mock_monotonic):
+        """Test that entries expire after the TTL"""
+        mock_monotonic.return_value = 100
+        cache = ResultCache(ttl=10)
+        cache.set("a", FEEDBACK)
+
+        mock_monotonic.return_value = 111
+
+        assert cache.get("a") is None
+        assert cache.stats()["expirations"] == 1
+
+    def test_failed_parse_is_not_cached(self):
+        """Test that empty feedback from a failed LLM parse isn't cached"""
+        runnable = RunnableLambda(lambda d: {"score": 1, "strengths": [], "improvements": [], "tags": []})
+        cache = ResultCache()
+
+        cache.wrap(runnable).invoke({"clean_query": "q"})
+
+        assert cache.stats()["size"] == 0
@@ -0,0 +1,108 @@
+import os
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from api.steps.pinecone import pinecone_query
+from api.steps.retrieval import LocalIndexBackend, PineconeBackend, RetrievalBackend, write_local_index
+
+
+@pytest.fixture
+def local_index(tmp_path):
+    path = tmp_path / "local_index"
+    write_local_index(
+        str(path),
+        ids=["role", "task", "format"],
+        embeddings=[[1.0, 0.0, 0.0], [0.0, 2.0, 0.0], [0.6, 0.8, 0.0]],
+        metadata=[
+            {"text": "Give the model a role."},
+            {"text": "State the task clearly."},
+            {"text": "Ask for a format.", "source": "guide"},
+        ],
+        metric="cosine",
+    )
+    return LocalIndexBackend(str(path))
+
+
+class TestLocalIndexBackend:
+
+    def test_matches_are_ranked_by_cosine_similarity(self, local_index):
+        """Test that the closest documents come first with their scores"""
+        result = local_index.query([0.0, 1.0, 0.0], top_k=2)
+
+        assert [m.id for m in result.matches] == ["task", "format"]
+        assert result.matches[0].score == pytest.approx(1.0)
+        assert result.matches[1].score == pytest.approx(0.8)
+
+    def test_index_files_are_normalized_and_memory_mapped(self, local_index):
+        """Test that rows are stored unit length and loaded without copying"""
+        assert isinstance(local_index.embeddings, np.memmap)
+        assert np.allclose(np.linalg.norm(local_index.embeddings, axis=1), 1.0)
+        assert local_index.manifest["count"] == 3
+
+    def test_dimension_mismatch_raises(self, local_index):
+        """Test that an embedding from a different model is rejected"""
+        with pytest.raises(ValueError):
+            local_index.query([1.0, 0.0], top_k=1)
+
+    def test_rewriting_swaps_the_index_atomically(self, tmp_path, local_index):
+        """Test that a rewrite repoints the path and a loaded index keeps its own files"""
+        path = str(tmp_path / "local_index")
+        first = os.path.realpath(path)
+
+        write_local_index(path, ids=["only"], embeddings=[[0.0, 0.0, 1.0]], metadata=[None])
+
+        assert os.path.islink(path)
+        assert not os.path.exists(first)
+        assert len(LocalIndexBackend(path)) == 1
+        assert [m.id for m in local_index.query([1.0, 0.0, 0.0], top_k=1).matches] == ["role"]
+        assert sorted(os.listdir(tmp_path)) == sorted(["local_index", os.readlink(path)])
+
+    def test_plain_directory_index_is_replaced(self, tmp_path):
+        """Test that an index written before the symlink layout is swapped out too"""
+        path = tmp_path / "local_index"
+        path.mkdir()
+        (path / "stale").write_text("")
+
+        write_local_index(str(path), ids=["only"], embeddings=[[1.0]], metadata=[None])
+
+        assert os.path.islink(path)
+        assert LocalIndexBackend(str(path)).ids == ["only"]
+
+    def test_pinecone_query_with_local_backend(self, local_index):
+        """Test that pinecone_query builds the context from the local matches"""
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr("api.steps.pinecone.log_response", lambda res: None)
+            d = pinecone_query(local_index).invoke(
+                {"embedding": [0.9, 0.1, 0.0], "parsed_response": {}}
+            )
+
+        assert d["context"].startswith("Give the model a role.")
+        assert d["pinecone_results"][0].metadata == {}
+        assert len(d["pinecone_results"]) == 3
+
+
+class TestRetrievalBackend:
+
+    def test_backends_must_implement_query(self):
+        """Test that a backend without query and aquery can't be created"""
+        class Incomplete(RetrievalBackend):
+            pass
+
+        with pytest.raises(TypeError):
+            Incomplete()
+
+
+class TestPineconeBackend:
+
+    def test_float32_embedding_is_sent_as_a_list(self):
+        """Test that the array becomes plain floats only at the Pinecone client"""
+        handle = MagicMock()
+        embedding = np.array([0.5, 0.25], dtype=np.float32)
+
+        PineconeBackend(handle).query(embedding, top_k=2)
+
+        _, kwargs = handle.index.return_value.query.call_args
+        assert kwargs["vector"] == [0.5, 0.25]
+        assert all(type(value) is float for value in kwargs["vector"])
@@ -0,0 +1,57 @@
+import numpy as np
+
+from api.steps.semantic_cache import SemanticCache, signature
+
+
+FEEDBACK = {"strengths": ["Clear task"], "improvements": ["Add a role"], "tags": ["writing"]}
+PARSED = {"task": True, "role": False, "context": False, "rules": False, "examples": False, "format": False}
+
+
+class TestSemanticCache:
+
+    def test_near_duplicate_with_same_signature_hits(self):
+        """Test that a close embedding with matching flags and score reuses feedback"""
+        cache = SemanticCache(capacity=4, max_distance=0.05)
+        sig = signature(PARSED, 4)
+        cache.add([1.0, 0.0, 0.0], sig, FEEDBACK)
+
+        assert cache.lookup([0.99, 0.05, 0.0], sig) == FEEDBACK
+        assert cache.stats()["hits"] == 1
+
+    def test_hits_do_not_share_the_cached_lists(self):
+        """Test that a caller mutating its feedback leaves the cached entry alone"""
+        cache = SemanticCache(capacity=4, max_distance=0.05)
+        sig = signature(PARSED, 4)
+        cache.add([1.0, 0.0, 0.0], sig, FEEDBACK)
+
+        cache.lookup([1.0, 0.0, 0.0], sig)["strengths"].append("Mutated")
+
+        assert cache.lookup([1.0, 0.0, 0.0], sig) == FEEDBACK
+        assert FEEDBACK["strengths"] == ["Clear task"]
+
+    def test_distant_embedding_misses(self):
+        """Test that an embedding outside max_distance misses"""
+        cache = SemanticCache(capacity=4, max_distance=0.05)
+        sig = signature(PARSED, 4)
+        cache.add([1.0, 0.0, 0.0], sig, FEEDBACK)
+
+        assert cache.lookup([0.0, 1.0, 0.0], sig) is None
+
+    def test_different_flags_or_score_miss(self):
+        """Test that the component flags and score bucket must match"""
+        cache = SemanticCache(capacity=4)
+        cache.add([1.0, 0.0], signature(PARSED, 4), FEEDBACK)
+
+        assert cache.lookup([1.0, 0.0], signature(PARSED, 5)) is None
+        assert cache.lookup([1.0, 0.0], signature({**PARSED, "role": True}, 4)) is None
+
+    def test_oldest_entry_is_overwritten_at_capacity(self):
+        """Test that the store is bounded and replaces the oldest entry"""
+        cache = SemanticCache(capacity=2, max_distance=0.01)
+        sig = signature(PARSED, 4)
+        for i, vector in enumerate(np.eye(3, dtype=np.float32)):
+            cache.add(vector, sig, {**FEEDBACK, "tags": [str(i)]})
+
+        assert cache.stats()["size"] == 2
+        assert cache.lookup([1.0, 0.0, 0.0], sig) is None
+        assert cache.lookup([0.0, 0.0, 1.0], sig)["tags"] == ["2"]
@@ -0,0 +1,57 @@
+from unittest.mock import MagicMock, patch
+from flask import Flask
+from langchain_core.runnables import RunnableLambda
+
+from api.steps.score_query import score_query
+from api.steps.single_call import (
+    PromptReview,
+    format_review,
+    prepare_single_call,
+    review_query,
+)
+
+
+REVIEW = PromptReview(
+    task=True,
+    role=True,
+    context=False,
+    rules=False,
+    examples=False,
+    format=False,
+    strengths=["Clear task"],
+    improvements=["Add an example"],
+    tags=["writing"],
+)
+
+
+class TestSingleCall:
+
+    @patch("api.steps.single_call.build_llm")
+    def test_single_call_matches_chat_llm_output_shape(self, mock_build_llm):
+        """Test that one structured call yields flags, a local score and feedback"""
+        messages = []
+        llm = MagicMock()
+        llm.with_structured_output.return_value = RunnableLambda(
+            lambda m: messages.append(m) or REVIEW
+        )
+        mock_build_llm.return_value = llm
+
+        app = Flask(__name__)
+        with app.app_context():
+            runnable = (
+                prepare_single_call()
+                | review_query()
+                | score_query()
+                | format_review()
+            )
+            result = runnable.invoke({"clean_query": "You are a poet. Write a poem", "context": "docs"})
+
+        assert result == {
+            "score": 3,
+            "strengths": ["Clear task"],
+            "improvements": ["Add an example"],
+            "tags": ["writing"],
+            "versionId": None,
+        }
+        assert len(messages) == 1
+        assert "docs" in messages[0][0].content
@@ -0,0 +1,152 @@
+import json
+import sys
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import text
+
+import api.steps
+from api.config import TestingConfig
+from api.steps.database import database
+
+# Modules the app and the benchmark fakes import by their top-level names,
+# as they do when run from api/
+STEP_MODULES = (
+    "chat_llm", "database", "embed_query", "local_parse", "parse_query", "pinecone", "retrieval", "single_call",
+)
+# What bench.fakes.install swaps out, put back after each test
+FAKED = {
+    "parse_query": ("llm", "build_llm"),
+    "chat_llm": ("build_llm",),
+    "single_call": ("build_llm",),
+    "embed_query": ("embeddings",),
+    "pinecone": ("Pinecone", "PineconeAsyncio"),
+}
+
+
+def _top_level_steps():
+    modules = {f"steps.{name}": sys.modules[f"api.steps.{name}"] for name in STEP_MODULES}
+    return patch.dict(sys.modules, {"steps": api.steps, **modules})
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The real app with the benchmark's OpenAI, Pinecone and SQLite stand-ins."""
+    for name, attributes in FAKED.items():
+        for attribute in attributes:
+            module = sys.modules[f"api.steps.{name}"]
+            monkeypatch.setattr(module, attribute, getattr(module, attribute))
+    saved = dict(vars(database))
+    database._hooks = []
+    database._engine = None
+    database.uri = f"sqlite:///{tmp_path / 'test.db'}"
+
+    with _top_level_steps():
+        from api.app import create_app
+        from api.bench.fakes import Latency, install
+
+        install(Latency(0), Latency(0), Latency(0), Latency(0))
+        app = create_app(TestingConfig)
+        app.logger.disabled = True
+
+    yield app
+
+    database.engine().dispose()
+    vars(database).update(saved)
+
+
+def _post(client):
+    return client.post(
+        "/api/chat/stream",
+        json={"prompt": "Act as a historian and summarise the causes of the First World War in five bullet points"},
+        base_url="https://localhost",
+    )
+
+
+def _events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def _rows(table):
+    with database.connect() as connection:
+        return connection.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+
+
+class TestStreamingPipeline:
+
+    def test_events_end_with_the_feedback(self, app):
+        """Test that the score comes first, then the items, then the whole feedback"""
+        state = {}
+
+        with app.app_context():
+            events = list(app.extensions["stream_pipeline"].events("Write a poem about dogs", state))
+
+        names = [event for event, _ in events]
+        assert names[0] == "score"
+        assert names[-1] == "feedback"
+        assert set(names[1:-1]) <= {"strengths", "improvements", "tags"}
+        feedback = events[-1][1]
+        assert "versionId" not in feedback
+        for key in ("strengths", "improvements", "tags"):
+            assert [item for event, item in events if event == key] == feedback[key]
+        assert state["feedback"]["score"] == events[0][1]["score"]
+
+    def test_persist_writes_every_row(self, app):
+        """Test that a completed stream's query, scores and feedback are written"""
+        stream_pipeline = app.extensions["stream_pipeline"]
+        state = {}
+
+        with app.app_context():
+            list(stream_pipeline.events("Write a poem about dogs", state))
+            stream_pipeline.persist(state)
+
+        assert [_rows(table) for table in ("user_query", "user_query_version", "scores", "feedback_response")] == [1, 1, 1, 1]
+
+
+class TestChatStreamEndpoint:
+
+    def test_rows_are_written_once_the_response_closes(self, app):
+        """Test that the SSE response streams every event and persists only on close"""
+        response = _post(app.test_client())
+
+        events = _events(response.get_data(as_text=True))
+        assert response.mimetype == "text/event-stream"
+        assert events[0][0] == "score"
+        assert events[-1][0] == "feedback"
+        assert _rows("feedback_response") == 0
+
+        response.close()
+
+        assert _rows("user_query") == 1
+        assert _rows("feedback_response") == 1
+
+    def test_nothing_is_written_when_the_stream_fails(self, app):
+        """Test that a pipeline error ends the stream with an error event and no rows"""
+        stream_pipeline = app.extensions["stream_pipeline"]
+
+        def failing(d):
+            yield "strengths", "Clear task"
+            raise RuntimeError("model went away")
+
+        with patch.object(stream_pipeline, "feedback", failing):
+            response = _post(app.test_client())
+            events = _events(response.get_data(as_text=True))
+            response.close()
+
+        assert [event for event, _ in events] == ["score", "strengths", "error"]
+        assert "model went away" in events[-1][1]["message"]
+        assert _rows("user_query") == 0
+
+    def test_nothing_is_written_when_the_client_disconnects(self, app):
+        """Test that a stream closed before the feedback event persists nothing"""
+        response = _post(app.test_client())
+
+        first = next(iter(response.response))
+        response.close()
+
+        assert first.startswith(b"event: score")
+        assert _rows("user_query") == 0
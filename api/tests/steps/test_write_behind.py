@@ -0,0 +1,73 @@
+import threading
+import time
+
+from api.steps.write_behind import PendingWrite, WriteBehindQueue
+
+
+def _record(n):
+    record = PendingWrite(parsed_response={"user_query": str(n)}, score_breakdown={})
+    record.feedback = {"score": n}
+    return record
+
+
+class TestWriteBehindQueue:
+
+    def test_records_are_flushed_in_batches_and_drained_on_close(self):
+        """Test that the flusher batches records and close drains the queue"""
+        batches = []
+        queue = WriteBehindQueue(
+            lambda batch: batches.append(list(batch)) or 0,
+            batch_size=10,
+            flush_interval=5,
+        )
+
+        for n in range(25):
+            assert queue.submit(_record(n))
+
+        queue.close()
+
+        written = [r.feedback["score"] for batch in batches for r in batch]
+        assert written == list(range(25))
+        assert all(len(batch) <= 10 for batch in batches)
+        assert queue.stats()["written"] == 25
+
+    def test_full_queue_rejects_submissions(self):
+        """Test that a full queue applies backpressure by rejecting records"""
+        release = threading.Event()
+        queue = WriteBehindQueue(
+            lambda batch: release.wait() and 0,
+            maxsize=1,
+            batch_size=1,
+            put_timeout=0.01,
+        )
+
+        results = [queue.submit(_record(n)) for n in range(5)]
+        release.set()
+        queue.close()
+
+        assert False in results
+        assert queue.stats()["rejected"] == results.count(False)
+
+    def test_closed_queue_hands_records_back(self):
+        """Test that submissions after shutdown must be written by the caller"""
+        queue = WriteBehindQueue(lambda batch: 0)
+        queue.close()
+
+        assert queue.submit(_record(1)) is False
+
+    def test_close_gives_up_on_a_stuck_flusher(self):
+        """Test that close returns after its timeout when the flusher can't take the stop marker"""
+        release = threading.Event()
+        queue = WriteBehindQueue(lambda batch: release.wait() and 0, maxsize=1, batch_size=1)
+
+        queue.submit(_record(1))
+        while queue.stats()["queued"]:
+            time.sleep(0.01)
+        queue.submit(_record(2))
+
+        closer = threading.Thread(target=queue.close, kwargs={"timeout": 0.1})
+        closer.start()
+        closer.join(2)
+        release.set()
+
+        assert not closer.is_alive()
@@ -0,0 +1 @@
+"""Maintenance scripts for the API's data stores. Run them from api/ with ``python -m tools.<name>``."""
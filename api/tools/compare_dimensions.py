@@ -0,0 +1,120 @@
+"""
+Compare retrieval quality of shortened embeddings against the native size.
+
+Run from the api/ directory, after exporting the index with
+tools.export_pinecone::
+
+    python -m tools.compare_dimensions --queries prompts.txt --dimensions 1024 512 256
+
+text-embedding-3 models are trained so that the first n components of a
+vector, L2-normalised again, are the vector the API returns when asked for
+``dimensions=n``. So the exported corpus and the query embeddings are
+fetched once at native size and truncated for every candidate dimension.
+For each one this reports recall@k: the share of the native top_k
+documents that the shortened vectors still retrieve.
+
+Queries are prompts, one per line, embedded with the model embed_query
+uses. Without --queries, a sample of the corpus itself is used, each row
+excluded from its own results.
+"""
+import argparse
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+from steps.embed_query import embeddings
+from steps.retrieval import LocalIndexBackend
+
+
+def truncate(vectors: np.ndarray, dimension: int) -> np.ndarray:
+    """Shorten embeddings the way the API does: keep a prefix and renormalise."""
+    shortened = np.asarray(vectors, dtype=np.float32)[:, :dimension]
+    norms = np.linalg.norm(shortened, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return shortened / norms
+
+
+def top_k_ids(corpus: np.ndarray, queries: np.ndarray, top_k: int, exclude: Optional[Sequence[int]] = None) -> np.ndarray:
+    scores = queries @ corpus.T
+    if exclude is not None:
+        scores[np.arange(len(queries)), exclude] = -np.inf
+    best = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    return best
+
+
+def compare(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    dimensions: Sequence[int],
+    top_k: int = 3,
+    exclude: Optional[Sequence[int]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Recall@k of each candidate dimension against the full-size vectors.
+    ``exclude`` gives, per query, a corpus row to leave out of its results.
+    """
+    native = corpus.shape[1]
+    top_k = min(top_k, len(corpus) - (exclude is not None))
+    truth = top_k_ids(truncate(corpus, native), truncate(queries, native), top_k, exclude)
+
+    rows = []
+    for dimension in sorted(set(dimensions), reverse=True):
+        if dimension > native:
+            raise ValueError(f"Can't compare {dimension} dimensions, the index has {native}")
+        found = top_k_ids(truncate(corpus, dimension), truncate(queries, dimension), top_k, exclude)
+        hits = [len(set(t) & set(f)) for t, f in zip(truth, found)]
+        rows.append(
+            {
+                "dimension": dimension,
+                "recall_at_k": round(sum(hits) / (top_k * len(queries)), 4),
+                "queries_fully_recalled": round(sum(h == top_k for h in hits) / len(queries), 4),
+                "bytes_per_vector": dimension * 4,
+            }
+        )
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--index",
+        default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "local_index"),
+        help="A local index exported at native size",
+    )
+    parser.add_argument("--queries", help="File of prompts, one per line")
+    parser.add_argument("--sample", type=int, default=200, help="Corpus rows to query with when --queries isn't given")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[1024, 768, 512, 256])
+    parser.add_argument("--top-k", type=int, default=3, help="pinecone_query retrieves 3")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    corpus = np.asarray(LocalIndexBackend(args.index).embeddings)
+    exclude = None
+
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as file:
+            prompts = [line.strip() for line in file if line.strip()]
+        # Native size, whatever EMBED_DIMENSIONS the app is configured with
+        embeddings.dimensions = None
+        queries = np.asarray(embeddings.embed_documents(prompts), dtype=np.float32)
+    else:
+        rng = np.random.default_rng(args.seed)
+        exclude = rng.choice(len(corpus), size=min(args.sample, len(corpus)), replace=False)
+        queries = corpus[exclude]
+
+    if queries.shape[1] != corpus.shape[1]:
+        raise SystemExit(
+            f"Queries have {queries.shape[1]} dimensions but the index {corpus.shape[1]}; "
+            "export the index at the model's native size"
+        )
+
+    rows = compare(corpus, queries, [corpus.shape[1], *args.dimensions], args.top_k, exclude)
+    print(json.dumps({"documents": len(corpus), "queries": len(queries), "top_k": args.top_k, "results": rows}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Export the Pinecone index into the LocalIndexBackend format.
+
+Run from the api/ directory::
+
+    python -m tools.export_pinecone --output data/local_index
+
+Then set RETRIEVAL_BACKEND=local (and LOCAL_INDEX_PATH if the output is
+elsewhere) to serve retrieval from the exported copy. Re-run the export
+whenever the Pinecone index changes.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Iterator, List
+
+from dotenv import load_dotenv
+from pinecone import Pinecone
+load_dotenv()
+
+from steps.retrieval import write_local_index
+
+FETCH_BATCH_SIZE = 100
+
+
+def batched(ids: List[str], size: int) -> Iterator[List[str]]:
+    for i in range(0, len(ids), size):
+        yield ids[i : i + size]
+
+
+def export(index, output: str, namespace: str = "", **manifest) -> dict:
+    ids: List[str] = []
+    for page in index.list(namespace=namespace):
+        ids.extend(page)
+    ids.sort()
+
+    exported, vectors, metadata = [], [], []
+    for batch in batched(ids, FETCH_BATCH_SIZE):
+        fetched = index.fetch(ids=batch, namespace=namespace).vectors
+        for id in batch:
+            vector = fetched.get(id)
+            if vector is None:
+                # Deleted between listing and fetching
+                continue
+            exported.append(id)
+            vectors.append(vector.values)
+            metadata.append(vector.metadata)
+
+    return write_local_index(output, exported, vectors, metadata, namespace=namespace, **manifest)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default=os.environ.get("PINECONE_INDEX_NAME"))
+    parser.add_argument("--namespace", default="")
+    parser.add_argument(
+        "--output",
+        default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "local_index"),
+    )
+    args = parser.parse_args(argv)
+
+    pc = Pinecone(api_key=os.environ.get("PINECONE_API_KEY"))
+    description = pc.describe_index(args.index)
+    if description.metric != "cosine":
+        print(
+            f"Warning: {args.index} uses the {description.metric} metric; the local index ranks by cosine similarity",
+            file=sys.stderr,
+        )
+
+    manifest = export(
+        pc.Index(host=description.host),
+        args.output,
+        namespace=args.namespace,
+        source_index=args.index,
+        metric=description.metric,
+        exported_at=datetime.now(timezone.utc).isoformat(),
+    )
+    print(f"Exported {manifest['count']} vectors ({manifest['dimension']} dimensions) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Chunk, embed and upsert the retrieval corpus into the Pinecone index.
+
+Run from the api/ directory::
+
+    python -m tools.ingest --source ../corpus
+
+Documents (.md and .txt) are read one at a time, split into overlapping
+chunks, embedded in large batches with the same model embed_query uses,
+and upserted in parallel batches with bounded concurrency.
+
+Progress is checkpointed to a JSON file mapping chunk id to content hash
+after every upserted batch. An interrupted run resumes where it stopped,
+and a re-run only embeds chunks whose text changed. With --prune, chunks
+of documents that shrank or were deleted are removed from the index.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, TypeVar
+
+from dotenv import load_dotenv
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+load_dotenv()
+
+from steps.embed_query import configure_embeddings, embeddings
+from steps.pinecone import index_handle
+
+EXTENSIONS = (".md", ".markdown", ".txt")
+
+T = TypeVar("T")
+
+
+class Chunk:
+    def __init__(self, id: str, text: str, source: str, position: int, model: str):
+        self.id = id
+        self.text = text
+        self.source = source
+        self.position = position
+        # The model (and dimension) is part of the hash so switching either re-embeds everything
+        self.content_hash = hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    @property
+    def metadata(self) -> dict:
+        return {
+            "text": self.text,
+            "source": self.source,
+            "chunk": self.position,
+            "content_hash": self.content_hash,
+        }
+
+
+def embedding_model(client) -> str:
+    """The model chunks are hashed with, plus the dimension when the vectors are shortened."""
+    dimensions = getattr(client, "dimensions", None)
+    return f"{client.model}:{dimensions}" if dimensions else client.model
+
+
+def iter_documents(source: str) -> Iterator[tuple[str, str]]:
+    """Yield (relative path, text) for each document under ``source``, in a stable order."""
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith(EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, encoding="utf-8") as file:
+                yield os.path.relpath(path, source), file.read()
+
+
+def iter_chunks(source: str, splitter, model: str) -> Iterator[Chunk]:
+    for relpath, text in iter_documents(source):
+        for position, piece in enumerate(splitter.split_text(text)):
+            yield Chunk(f"{relpath}#{position}", piece, relpath, position, model)
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def with_retries(call: Callable[[], T], attempts: int = 3, backoff: float = 1.0) -> T:
+    for attempt in range(attempts):
+        try:
+            return call()
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(backoff * 2**attempt)
+
+
+class Checkpoint:
+    """Chunk id to content hash of everything already in the index, saved atomically."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.hashes: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.hashes = json.load(file)
+
+    def is_current(self, chunk: Chunk) -> bool:
+        return self.hashes.get(chunk.id) == chunk.content_hash
+
+    def record(self, chunks: List[Chunk]) -> None:
+        with self._lock:
+            for chunk in chunks:
+                self.hashes[chunk.id] = chunk.content_hash
+            self._save()
+
+    def forget(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for id in ids:
+                self.hashes.pop(id, None)
+            self._save()
+
+    def _save(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        staging = f"{self.path}.tmp"
+        with open(staging, "w") as file:
+            json.dump(self.hashes, file)
+        os.replace(staging, self.path)
+
+
+def ingest(
+    chunks: Iterable[Chunk],
+    embed_documents: Callable[[List[str]], List[List[float]]],
+    upsert: Optional[Callable[[List[dict]], None]],
+    checkpoint: Checkpoint,
+    embed_batch_size: int = 256,
+    upsert_batch_size: int = 100,
+    concurrency: int = 4,
+    log: Callable[[str], None] = print,
+) -> Dict[str, int]:
+    """
+    Embed and upsert every chunk whose content hash isn't in the checkpoint.
+    At most ``concurrency`` upserts are in flight; embedding the next batch
+    waits for a free slot, which keeps memory bounded on a large corpus.
+    """
+    counts = {"seen": 0, "skipped": 0, "embedded": 0, "upserted": 0}
+    seen_ids: Set[str] = set()
+
+    def pending() -> Iterator[Chunk]:
+        for chunk in chunks:
+            counts["seen"] += 1
+            seen_ids.add(chunk.id)
+            if checkpoint.is_current(chunk):
+                counts["skipped"] += 1
+                continue
+            yield chunk
+
+    def upsert_batch(batch: List[Chunk], vectors: List[List[float]]) -> int:
+        if upsert is not None:
+            records = [
+                {"id": chunk.id, "values": vector, "metadata": chunk.metadata}
+                for chunk, vector in zip(batch, vectors)
+            ]
+            with_retries(lambda: upsert(records))
+        checkpoint.record(batch)
+        return len(batch)
+
+    in_flight: Set[Future] = set()
+
+    def drain(limit: int) -> None:
+        nonlocal in_flight
+        while len(in_flight) > limit:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                counts["upserted"] += future.result()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for embed_batch in batched(pending(), embed_batch_size):
+            vectors = with_retries(lambda: embed_documents([c.text for c in embed_batch]))
+            counts["embedded"] += len(embed_batch)
+
+            for start in range(0, len(embed_batch), upsert_batch_size):
+                drain(concurrency - 1)
+                end = start + upsert_batch_size
+                in_flight.add(
+                    pool.submit(upsert_batch, embed_batch[start:end], vectors[start:end])
+                )
+
+            log(
+                f"embedded {counts['embedded']}, upserted {counts['upserted']}, "
+                f"skipped {counts['skipped']} of {counts['seen']} chunks seen"
+            )
+
+        drain(0)
+
+    counts["stale"] = len(set(checkpoint.hashes) - seen_ids)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", required=True, help="Directory of .md/.txt documents")
+    parser.add_argument("--checkpoint", help="Defaults to <source>/.ingest-checkpoint.json")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Characters per chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=150)
+    parser.add_argument("--embed-batch-size", type=int, default=256)
+    parser.add_argument("--upsert-batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4, help="Upserts in flight")
+    parser.add_argument("--prune", action="store_true", help="Delete chunks no longer in the corpus")
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        default=int(os.environ.get("EMBED_DIMENSIONS", 0)),
+        help="Shortened embedding size, must match the index; defaults to EMBED_DIMENSIONS (0 for native)",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Embed and checkpoint nothing, only count")
+    args = parser.parse_args(argv)
+
+    configure_embeddings(args.dimensions)
+    model = embedding_model(embeddings)
+
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(args.source, ".ingest-checkpoint.json"))
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap
+    )
+    chunks = iter_chunks(args.source, splitter, model)
+
+    if args.dry_run:
+        total = changed = 0
+        for chunk in chunks:
+            total += 1
+            changed += not checkpoint.is_current(chunk)
+        print(f"{changed} of {total} chunks would be embedded")
+        return
+
+    index_handle.configure(pool_size=args.concurrency, pool_threads=1, keep_alive_idle=60)
+    index = index_handle.index()
+
+    counts = ingest(
+        chunks,
+        embed_documents=embeddings.embed_documents,
+        upsert=lambda records: index.upsert(vectors=records),
+        checkpoint=checkpoint,
+        embed_batch_size=args.embed_batch_size,
+        upsert_batch_size=args.upsert_batch_size,
+        concurrency=args.concurrency,
+        log=lambda message: print(message, file=sys.stderr),
+    )
+
+    if args.prune and counts["stale"]:
+        seen = {chunk.id for chunk in iter_chunks(args.source, splitter, model)}
+        stale = sorted(set(checkpoint.hashes) - seen)
+        for batch in batched(stale, 1000):
+            with_retries(lambda: index.delete(ids=batch))
+            checkpoint.forget(batch)
+        counts["pruned"] = len(stale)
+
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
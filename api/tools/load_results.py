@@ -0,0 +1,58 @@
+"""
+Bulk-load pipeline results into the database, to backfill or replay traffic.
+
+Run from the api/ directory::
+
+    python -m tools.load_results results.jsonl --batch-size 10000
+
+Each line of the file is one pipeline result: a JSON object with the
+``parsed_response`` and ``score_breakdown`` run_query writes and, unless
+only those rows are wanted, the ``feedback`` query_feedback writes. On
+Postgres with psycopg (the default --driver here, unlike the app's
+DB_DRIVER) the rows are streamed in with COPY, one transaction per batch;
+other drivers and databases get the chained INSERTs of write-behind mode.
+"""
+import argparse
+import json
+import sys
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from steps.bulk_load import load_results, read_results
+from steps.database import database
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("results", help="JSON Lines file of pipeline results")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Records per transaction")
+    parser.add_argument("--database-uri", help="Defaults to SUPABASE_URI")
+    parser.add_argument("--driver", choices=["psycopg", "psycopg2"], default="psycopg", help="For postgresql:// URIs")
+    args = parser.parse_args(argv)
+
+    if args.database_uri:
+        database.uri = args.database_uri
+    database.driver = args.driver
+
+    start = time.perf_counter()
+    written = load_results(read_results(args.results), batch_size=args.batch_size)
+    seconds = time.perf_counter() - start
+
+    print(
+        json.dumps(
+            {
+                "written": written,
+                "seconds": round(seconds, 3),
+                "records_per_second": round(written / seconds, 1) if seconds else None,
+                "driver": database.engine().dialect.driver,
+            },
+            indent=2,
+        )
+    )
+    return 0 if written else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())